@@ -0,0 +1,161 @@
+"""
+Admission control for generated answers.
+
+Tracks how many answers are being generated and an exponentially weighted average of how
+long they take. When either passes its thresholds, new questions are answered in
+progressively cheaper ways instead of queueing for beam search:
+
+    normal  -> retrieval, rerank and generation as usual
+    direct  -> return the top retrieved answer whenever it passes the similarity filter
+               (the direct-answer threshold is widened), so nothing is generated
+    cached  -> an earlier generated answer to the same question, or the closest
+               suggested question; otherwise the busy reply
+    busy    -> a fast "please try again" reply
+
+Every answer is counted per stage in metrics().
+"""
+
+import os
+import time
+import difflib
+import logging
+import threading
+from collections import OrderedDict
+import inference_pool
+from utils.suggested_qna import suggested_qna
+from utils.single_flight import normalize_query
+
+logger = logging.getLogger(__name__)
+
+STAGES = ("normal", "direct", "cached", "busy")
+
+# In-flight answers at which each stage starts
+ADMISSION_DIRECT_INFLIGHT = int(os.environ.get("ADMISSION_DIRECT_INFLIGHT", "4"))
+ADMISSION_CACHED_INFLIGHT = int(os.environ.get("ADMISSION_CACHED_INFLIGHT", "8"))
+ADMISSION_BUSY_INFLIGHT = int(os.environ.get("ADMISSION_BUSY_INFLIGHT", "16"))
+# Average answer latency (seconds) at which each stage starts
+ADMISSION_DIRECT_LATENCY = float(os.environ.get("ADMISSION_DIRECT_LATENCY", "5"))
+ADMISSION_CACHED_LATENCY = float(os.environ.get("ADMISSION_CACHED_LATENCY", "10"))
+ADMISSION_BUSY_LATENCY = float(os.environ.get("ADMISSION_BUSY_LATENCY", "20"))
+# The latency average halves every this many seconds without new samples, so a burst
+# of slow answers does not keep the service degraded once it is idle again
+LATENCY_HALF_LIFE = 30.0
+LATENCY_SMOOTHING = 0.2
+# Direct-answer threshold in the "direct" stage (model_inference.MIN_SIMILARITY)
+ADMISSION_DIRECT_SIMILARITY = float(os.environ.get("ADMISSION_DIRECT_SIMILARITY", "0.5"))
+# Generated answers remembered for the "cached" stage
+ANSWER_CACHE_SIZE = 512
+SUGGESTED_MATCH_CUTOFF = 0.75
+
+BUSY_RESPONSE = (
+    "We're receiving a lot of questions right now, so I can't give a full answer at the moment. "
+    "Please try again in a minute, or contact Corvit Systems Islamabad at 0303-8888555 or https://corvit.com."
+)
+
+
+class AdmissionController:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.inflight = 0
+        self.latency = 0.0
+        self.latency_at = time.monotonic()
+        self.answers = OrderedDict()  # normalized query -> generated answer
+        self.counts = {stage: 0 for stage in STAGES}
+        self.cache_hits = 0
+        self.suggested_hits = 0
+
+    def _current_latency(self):
+        elapsed = time.monotonic() - self.latency_at
+        return self.latency * 0.5 ** (elapsed / LATENCY_HALF_LIFE)
+
+    def stage(self):
+        """
+        The stage a new question would be answered in right now.
+        """
+        with self.lock:
+            inflight, latency = self.inflight, self._current_latency()
+        if inflight >= ADMISSION_BUSY_INFLIGHT or latency >= ADMISSION_BUSY_LATENCY:
+            return "busy"
+        if inflight >= ADMISSION_CACHED_INFLIGHT or latency >= ADMISSION_CACHED_LATENCY:
+            return "cached"
+        if inflight >= ADMISSION_DIRECT_INFLIGHT or latency >= ADMISSION_DIRECT_LATENCY:
+            return "direct"
+        return "normal"
+
+    def _record(self, seconds):
+        with self.lock:
+            self.inflight -= 1
+            current = self._current_latency()
+            self.latency = current + LATENCY_SMOOTHING * (seconds - current) if current else seconds
+            self.latency_at = time.monotonic()
+
+    def _cached_answer(self, query):
+        key = normalize_query(query)
+        with self.lock:
+            answer = self.answers.get(key)
+            if answer is not None:
+                self.answers.move_to_end(key)
+                self.cache_hits += 1
+                return answer
+        match = difflib.get_close_matches(query, list(suggested_qna), n=1, cutoff=SUGGESTED_MATCH_CUTOFF)
+        if match:
+            with self.lock:
+                self.suggested_hits += 1
+            return suggested_qna[match[0]]
+        return None
+
+    def answer(self, query):
+        """
+        Answer a query through inference_pool.generate_response, degrading under load.
+        Returns (stage, english answer).
+        """
+        stage = self.stage()
+        if stage in ("cached", "busy"):
+            answer = self._cached_answer(query) if stage == "cached" else None
+            with self.lock:
+                self.counts[stage] += 1
+            logger.info(f"Admission stage '{stage}' for: {query}")
+            return stage, answer or BUSY_RESPONSE
+
+        with self.lock:
+            self.inflight += 1
+            self.counts[stage] += 1
+        started = time.monotonic()
+        try:
+            if stage == "direct":
+                logger.info(f"Admission stage 'direct' for: {query}")
+                answer = inference_pool.generate_response(query, ADMISSION_DIRECT_SIMILARITY)
+            else:
+                answer = inference_pool.generate_response(query)
+        finally:
+            self._record(time.monotonic() - started)
+        if stage == "normal" and not answer.startswith(("Error", "🤖 Error")):
+            with self.lock:
+                key = normalize_query(query)
+                self.answers[key] = answer
+                self.answers.move_to_end(key)
+                while len(self.answers) > ANSWER_CACHE_SIZE:
+                    self.answers.popitem(last=False)
+        return stage, answer
+
+    def metrics(self):
+        with self.lock:
+            return {
+                "inflight": self.inflight,
+                "latency_ewma_s": round(self._current_latency(), 3),
+                "stages": dict(self.counts),
+                "cache_hits": self.cache_hits,
+                "suggested_hits": self.suggested_hits,
+                "cached_answers": len(self.answers),
+            }
+
+
+controller = AdmissionController()
+
+
+def answer(query):
+    return controller.answer(query)
+
+
+def metrics():
+    return dict(controller.metrics(), stage=controller.stage())
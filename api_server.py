@@ -0,0 +1,318 @@
+import argparse
+import asyncio
+import json
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit, parse_qs
+
+from chat_handler import chatbot_reply
+from utils.event_utils import (
+    load_events,
+    rank_events,
+    get_today_events,
+    get_tomorrow_events,
+    get_this_week_events,
+    get_next_week_events,
+    get_next_month_events,
+    get_next_seven_days_events,
+)
+from utils.schedule_utils import load_schedule, get_schedule_index
+from utils import history_writer
+import inference_pool
+import admission
+import translation_service
+from utils import single_flight
+from utils.history_search import search_history
+from auth import login_user
+from session_tokens import issue_token, verify_token, revoke_token
+
+# Set up logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+API_HOST = os.environ.get("API_HOST", "0.0.0.0")
+API_PORT = int(os.environ.get("API_PORT", "8000"))
+# Threads running blocking model work, and how many requests may wait for one
+API_WORKERS = int(os.environ.get("API_WORKERS", "4"))
+API_MAX_PENDING = int(os.environ.get("API_MAX_PENDING", "64"))
+API_MAX_BODY_BYTES = 64 * 1024
+# Require a session token (Authorization: Bearer ...) on /chat. Without one, /chat only
+# answers as the anonymous default user; acting as any other email always needs a token
+API_REQUIRE_AUTH = os.environ.get("API_REQUIRE_AUTH", "0") == "1"
+ANONYMOUS_EMAIL = "default_user@gmail.com"
+
+EVENT_RANGES = {
+    "today": get_today_events,
+    "tomorrow": get_tomorrow_events,
+    "this_week": get_this_week_events,
+    "next_week": get_next_week_events,
+    "next_month": get_next_month_events,
+    "next_seven_days": get_next_seven_days_events,
+}
+
+REASONS = {200: "OK", 400: "Bad Request", 401: "Unauthorized", 403: "Forbidden", 404: "Not Found",
+           405: "Method Not Allowed", 413: "Payload Too Large", 431: "Request Header Fields Too Large",
+           500: "Internal Server Error", 503: "Service Unavailable"}
+
+
+class ApiError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+def int_param(query, name, default, maximum):
+    """
+    A positive integer query parameter, capped at maximum; 400 if it is not one.
+    """
+    value = query.get(name)
+    if value is None:
+        return default
+    try:
+        number = int(value)
+    except ValueError:
+        raise ApiError(400, f"'{name}' must be an integer.")
+    if number < 1:
+        raise ApiError(400, f"'{name}' must be at least 1.")
+    return min(number, maximum)
+
+
+# === Handlers (run on the worker pool) ===
+def handle_chat(query, body, user):
+    message = body.get("message")
+    if message is not None and not isinstance(message, str):
+        raise ApiError(400, "'message' must be a string.")
+    message = (message or "").strip()
+    if not message:
+        raise ApiError(400, "'message' is required.")
+    if body.get("session_id") is not None and not isinstance(body["session_id"], str):
+        raise ApiError(400, "'session_id' must be a string.")
+    if user:
+        email = user["sub"]
+        if body.get("email") and body["email"] != email:
+            raise ApiError(403, "The session token is for another user.")
+    elif API_REQUIRE_AUTH:
+        raise ApiError(401, "A session token is required.")
+    elif body.get("email") and body["email"] != ANONYMOUS_EMAIL:
+        raise ApiError(401, "A session token is required to chat as a specific user.")
+    else:
+        email = ANONYMOUS_EMAIL
+    reply = chatbot_reply(message, email=email, session_id=body.get("session_id"))
+    return {"reply": reply, "session_id": body.get("session_id")}
+
+
+def handle_events(query, body, user):
+    events = load_events()
+    if query.get("q"):
+        limit = int_param(query, "limit", 5, 50)
+        return {"events": [dict(event, score=round(score, 4)) for score, event in rank_events(query["q"], events, k=limit)]}
+    range_name = query.get("range", "next_seven_days")
+    if range_name not in EVENT_RANGES:
+        raise ApiError(400, f"Unknown range '{range_name}'. Use one of: {', '.join(EVENT_RANGES)}.")
+    return {"events": EVENT_RANGES[range_name](events)}
+
+
+def handle_schedule(query, body, user):
+    index = get_schedule_index(load_schedule())
+    filters = {name: query.get(name) for name in ("day", "mode", "city")}
+    course = query.get("course")
+    entry_ids = index.match(course) if course else None
+    return {"schedule": index.filter(entry_ids, **filters)}
+
+
+def handle_history_search(query, body, user):
+    if not user:
+        raise ApiError(401, "A session token is required.")
+    if not query.get("q"):
+        raise ApiError(400, "'q' is required.")
+    limit = int_param(query, "limit", 20, 100)
+    return {"results": search_history(user["sub"], query["q"], limit=limit, session_id=query.get("session_id"))}
+
+
+def handle_health(query, body, user):
+    return {
+        "status": "ok",
+        "history_writer": history_writer.metrics(),
+        "inference": inference_pool.metrics(),
+        "admission": admission.metrics(),
+        "single_flight": single_flight.metrics(),
+        "translation": translation_service.metrics(),
+    }
+
+
+def handle_login(query, body, user):
+    email, password = body.get("email") or "", body.get("password") or ""
+    name = login_user(email, password) if email and password else None
+    if not name:
+        raise ApiError(401, "Invalid email or password.")
+    return {"token": issue_token(email, name), "name": name}
+
+
+def handle_logout(query, body, user):
+    if not user:
+        raise ApiError(401, "A session token is required.")
+    revoke_token(user["token"])
+    return {"status": "logged out"}
+
+
+ROUTES = {
+    ("POST", "/chat"): handle_chat,
+    ("GET", "/events"): handle_events,
+    ("GET", "/schedule"): handle_schedule,
+    ("GET", "/history/search"): handle_history_search,
+    ("GET", "/health"): handle_health,
+    ("POST", "/login"): handle_login,
+    ("POST", "/logout"): handle_logout,
+}
+
+
+# === HTTP server ===
+class ApiServer:
+    """
+    Minimal asyncio HTTP/1.1 server. Connections are handled on the event loop; handlers,
+    which call into the models, run on a bounded thread pool shared by all clients.
+    """
+
+    def __init__(self, workers=API_WORKERS, max_pending=API_MAX_PENDING):
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="api-worker")
+        self.max_pending = max_pending
+        self.pending = 0
+        self.started = {}  # in-flight request -> monotonic start time (event loop only)
+
+    async def dispatch(self, method, target, body, headers=None):
+        url = urlsplit(target)
+        paths = {path for _, path in ROUTES}
+        handler = ROUTES.get((method, url.path))
+        if handler is None:
+            raise ApiError(405 if url.path in paths else 404, f"No route for {method} {url.path}.")
+        query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        try:
+            payload = json.loads(body) if body else {}
+        except json.JSONDecodeError:
+            raise ApiError(400, "Request body must be JSON.")
+        if not isinstance(payload, dict):
+            raise ApiError(400, "Request body must be a JSON object.")
+        if self.pending >= self.max_pending:
+            raise ApiError(503, "Server is busy, please retry.")
+        self.pending += 1
+        request = object()
+        self.started[request] = time.monotonic()
+        try:
+            loop = asyncio.get_running_loop()
+            user = None
+            scheme, _, token = (headers or {}).get("authorization", "").partition(" ")
+            if scheme.lower() == "bearer":
+                # Off the event loop: verification may refresh the revocation list from SQLite
+                user = await loop.run_in_executor(self.executor, verify_token, token.strip())
+                if user is None:
+                    raise ApiError(401, "Invalid or expired session token.")
+                user = dict(user, token=token.strip())
+            return await loop.run_in_executor(self.executor, handler, query, payload, user)
+        finally:
+            self.pending -= 1
+            del self.started[request]
+
+    def oldest_request_age(self):
+        """
+        Seconds the longest-running in-flight request has been running (0 when idle).
+        """
+        return time.monotonic() - min(self.started.values()) if self.started else 0.0
+
+    async def handle_connection(self, reader, writer):
+        try:
+            while True:
+                try:
+                    request_line = await reader.readline()
+                except ValueError:
+                    # Longer than the stream limit (LimitOverrunError surfaces as ValueError)
+                    await self.respond(writer, 400, {"error": "Request line too long."}, keep_alive=False)
+                    break
+                if not request_line:
+                    break
+                try:
+                    method, target, version = request_line.decode("latin-1").split()
+                except ValueError:
+                    await self.respond(writer, 400, {"error": "Malformed request line."}, keep_alive=False)
+                    break
+                headers = {}
+                try:
+                    while True:
+                        line = await reader.readline()
+                        if line in (b"\r\n", b"\n", b""):
+                            break
+                        name, _, value = line.decode("latin-1").partition(":")
+                        headers[name.strip().lower()] = value.strip()
+                except ValueError:
+                    await self.respond(writer, 431, {"error": "Header line too long."}, keep_alive=False)
+                    break
+
+                keep_alive = headers.get("connection", "").lower() != "close" and version == "HTTP/1.1"
+                try:
+                    length = int(headers.get("content-length", 0) or 0)
+                except ValueError:
+                    length = -1
+                if length < 0:
+                    await self.respond(writer, 400, {"error": "Invalid Content-Length."}, keep_alive=False)
+                    break
+                if length > API_MAX_BODY_BYTES:
+                    await self.respond(writer, 413, {"error": "Request body too large."}, keep_alive=False)
+                    break
+                body = await reader.readexactly(length) if length else b""
+
+                try:
+                    status, result = 200, await self.dispatch(method.upper(), target, body, headers)
+                except ApiError as e:
+                    status, result = e.status, {"error": e.message}
+                except Exception as e:
+                    logger.error(f"Unhandled error for {method} {target}: {e}", exc_info=True)
+                    status, result = 500, {"error": "Internal server error."}
+                await self.respond(writer, status, result, keep_alive=keep_alive)
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def respond(self, writer, status, payload, keep_alive=True):
+        data = json.dumps(payload, ensure_ascii=False, default=str).encode("utf-8")
+        head = (
+            f"HTTP/1.1 {status} {REASONS.get(status, '')}\r\n"
+            "Content-Type: application/json; charset=utf-8\r\n"
+            f"Content-Length: {len(data)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n"
+        )
+        writer.write(head.encode("latin-1") + data)
+        await writer.drain()
+
+    async def serve(self, host=API_HOST, port=API_PORT, sock=None):
+        if sock is not None:
+            server = await asyncio.start_server(self.handle_connection, sock=sock)
+        else:
+            server = await asyncio.start_server(self.handle_connection, host, port)
+        logger.info(f"API server listening on {', '.join(str(s.getsockname()) for s in server.sockets)}")
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the Corvit chatbot over HTTP.")
+    parser.add_argument("--host", default=API_HOST)
+    parser.add_argument("--port", type=int, default=API_PORT)
+    parser.add_argument("--workers", type=int, default=API_WORKERS, help="threads running model inference")
+    parser.add_argument("--max-pending", type=int, default=API_MAX_PENDING, help="requests queued before returning 503")
+    args = parser.parse_args()
+    try:
+        asyncio.run(ApiServer(workers=args.workers, max_pending=args.max_pending).serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
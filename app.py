@@ -1,8 +1,12 @@
 import streamlit as st
-from auth import init_user_db, register_user, login_user
+from auth import init_user_db, register_user, login_user, get_pool
+from session_tokens import issue_token, verify_token, revoke_token, SESSION_TTL_HOURS
 from utils.event_utils import load_events, get_next_seven_days_events
 from utils.chat_utils import load_user_chats, save_user_chats, delete_chat
+from utils.history_search import search_history
+from utils.history_store import new_session_id
 from chat_handler import chatbot_reply
+import inference_pool
 from preprocess_input import detect_language, translate_urdu_to_english
 from datetime import datetime
 import streamlit.components.v1 as components
@@ -11,6 +15,13 @@ from utils.suggested_qna import suggested_qna
 import os
 import re
 
+# Messages rendered per chat at first, and how many more each "load earlier" click adds
+CHAT_WINDOW = 30
+# Chats listed per sidebar page
+SIDEBAR_PAGE_SIZE = 15
+# Cookie holding the signed session token, so reloads and new tabs stay logged in
+SESSION_COOKIE = "corvit_session"
+
 def is_urdu(text):
     urdu_pattern = re.compile(r'[\u0600-\u06FF]')
     return bool(urdu_pattern.search(text))
@@ -19,86 +30,154 @@ def is_english(text):
     english_pattern = re.compile(r'^[A-Za-z0-9\s\.,!?;:\'\"()\[\]\-]+$')
     return bool(english_pattern.match(text.strip()))
 
-# Init user DB
-init_user_db()
-
-# Language translations
-def get_translations():
-    return {
-        "english": {
-            "greeting": "What can I assist you with today?",
-            "good_morning": "Good morning",
-            "good_afternoon": "Good afternoon",
-            "good_evening": "Good evening",
-            "input_placeholder": "Type your question here...",
-            "new_chat": "➕ New Chat",
-            "logout": "Logout",
-            "chats": " Chats",
-            "events": "🔔 This Week's Events",
-            "reminder_close": "❌ Close Reminder",
-            "reminder_show": "🔁 Show Weekly Reminder Again",
-            "welcome_message": "Hello! I’m the Corvit Customer Service Assistant. How can I help you today?",
-            "suggested_questions": [
-                "What is the fee structure of courses?",
-                "How can I register for a course?",
-                "What are the class timings at Corvit?",
-                "Where is the Corvit office located?",
-                "What courses does Corvit offer?"
-            ]
-        },
-        "urdu": {
-            "greeting": "میں آپ کی کیا مدد کر سکتا ہوں؟",
-            "good_morning": "صبح بخیر",
-            "good_afternoon": "دوپہر بخیر",
-            "good_evening": "شام بخیر",
-            "input_placeholder": "اپنا سوال یہاں لکھیں...",
-            "new_chat": "➕ نئی گفتگو",
-            "logout": "لوگ آؤٹ",
-            "chats": " گفتگوئیں",
-            "events": "🔔 اس ہفتے کی تقریبات",
-            "reminder_close": "❌ بند کریں",
-            "reminder_show": "🔁 دوبارہ دکھائیں",
-            "welcome_message": "السلام علیکم! میں کوروٹ کا کسٹمر سروس اسسٹنٹ ہوں۔ آپ کی کس طرح مدد کر سکتا ہوں؟",
-            "suggested_questions": [
-                "کورسز کی فیس کا ڈھانچہ کیا ہے؟",
-                "میں کورس کے لیے کیسے رجسٹر کر سکتا ہوں؟",
-                "کوروٹ میں کلاسز کے اوقات کیا ہیں؟",
-                "کوروٹ آفس کہاں واقع ہے؟",
-                "کوروٹ کون سے کورسز آفر کرتا ہے؟"
-            ]
-        }
+# === Cached resources and data (shared across reruns and sessions) ===
+@st.cache_resource
+def init_auth():
+    # Creates the tables once per process and keeps the connection pool open
+    init_user_db()
+    return get_pool()
+
+@st.cache_resource
+def load_logo():
+    return Image.open("images/corvit_logo.png") if os.path.exists("images/corvit_logo.png") else None
+
+@st.cache_data
+def read_text_file(path):
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        return f.read()
+
+@st.cache_data(ttl=300)
+def week_events(day):
+    # Keyed by date so the list rolls over at midnight; the ttl picks up edits to events.json
+    return get_next_seven_days_events(load_events())
+
+@st.cache_resource
+def start_inference_workers():
+    # Start loading the models in the worker processes now rather than on the first question
+    return inference_pool.get_pool() if inference_pool.INFERENCE_WORKERS > 0 else None
+
+init_auth()
+start_inference_workers()
+
+# Language translations (built once per process)
+TRANSLATIONS = {
+    "english": {
+        "greeting": "What can I assist you with today?",
+        "good_morning": "Good morning",
+        "good_afternoon": "Good afternoon",
+        "good_evening": "Good evening",
+        "input_placeholder": "Type your question here...",
+        "new_chat": "➕ New Chat",
+        "logout": "Logout",
+        "chats": " Chats",
+        "events": "🔔 This Week's Events",
+        "reminder_close": "❌ Close Reminder",
+        "reminder_show": "🔁 Show Weekly Reminder Again",
+        "search_chats": "Search chats",
+        "load_earlier": "⬆ Load earlier messages",
+        "page": "Page",
+        "search_messages": "🔎 Search messages",
+        "no_results": "No matching messages.",
+        "welcome_message": "Hello! I’m the Corvit Customer Service Assistant. How can I help you today?",
+        "suggested_questions": [
+            "What is the fee structure of courses?",
+            "How can I register for a course?",
+            "What are the class timings at Corvit?",
+            "Where is the Corvit office located?",
+            "What courses does Corvit offer?"
+        ]
+    },
+    "urdu": {
+        "greeting": "میں آپ کی کیا مدد کر سکتا ہوں؟",
+        "good_morning": "صبح بخیر",
+        "good_afternoon": "دوپہر بخیر",
+        "good_evening": "شام بخیر",
+        "input_placeholder": "اپنا سوال یہاں لکھیں...",
+        "new_chat": "➕ نئی گفتگو",
+        "logout": "لوگ آؤٹ",
+        "chats": " گفتگوئیں",
+        "events": "🔔 اس ہفتے کی تقریبات",
+        "reminder_close": "❌ بند کریں",
+        "reminder_show": "🔁 دوبارہ دکھائیں",
+        "search_chats": "گفتگو تلاش کریں",
+        "load_earlier": "⬆ پرانے پیغامات دکھائیں",
+        "page": "صفحہ",
+        "search_messages": "🔎 پیغامات تلاش کریں",
+        "no_results": "کوئی پیغام نہیں ملا۔",
+        "welcome_message": "السلام علیکم! میں کوروٹ کا کسٹمر سروس اسسٹنٹ ہوں۔ آپ کی کس طرح مدد کر سکتا ہوں؟",
+        "suggested_questions": [
+            "کورسز کی فیس کا ڈھانچہ کیا ہے؟",
+            "میں کورس کے لیے کیسے رجسٹر کر سکتا ہوں؟",
+            "کوروٹ میں کلاسز کے اوقات کیا ہیں؟",
+            "کوروٹ آفس کہاں واقع ہے؟",
+            "کوروٹ کون سے کورسز آفر کرتا ہے؟"
+        ]
     }
+}
 
 # Safe logo loading
-if os.path.exists("images/corvit_logo.png"):
-    logo = Image.open("images/corvit_logo.png")
+logo = load_logo()
+if logo is not None:
     col1, col2, col3 = st.columns([3, 4, 1])
     with col2:
         st.image(logo, width=150)
 
 # Load style
-if os.path.exists("css/style.css"):
-    with open("css/style.css") as f:
-        css = f.read()
-        st.markdown(f"<style>{css} html body {{ background-color: #800000 !important; }}</style>", unsafe_allow_html=True)
+css = read_text_file("css/style.css")
+if css is not None:
+    st.markdown(f"<style>{css} html body {{ background-color: #800000 !important; }}</style>", unsafe_allow_html=True)
+
+# Restore the login from the signed session token cookie (reloads, new tabs). The token is
+# never put in the URL, where it would end up in browser history, Referer headers and logs
+def read_session_cookie():
+    context = getattr(st, "context", None)
+    return context.cookies.get(SESSION_COOKIE) if context is not None else None
+
+def write_session_cookie(token, max_age):
+    # Cookies can only be set from the browser; the component iframe shares the app's origin
+    secure = " + (parent.location.protocol === 'https:' ? '; Secure' : '')"
+    components.html(
+        f"<script>parent.document.cookie = '{SESSION_COOKIE}={token}; path=/; max-age={max_age}; SameSite=Strict'{secure};</script>",
+        height=0,
+    )
+
+if not st.session_state.get("logged_in") and "session_token" not in st.session_state:
+    cookie_token = read_session_cookie()
+    claims = verify_token(cookie_token) if cookie_token else None
+    if claims:
+        st.session_state.logged_in = True
+        st.session_state.username = claims["sub"]
+        st.session_state.name = claims["name"]
+        st.session_state.first_login = False
+        st.session_state.session_token = cookie_token
+    elif cookie_token:
+        st.session_state.session_cookie_update = ("", 0)
+
+# Cookie changes are written on the run after login/logout, since st.rerun() discards this run's output
+if "session_cookie_update" in st.session_state:
+    write_session_cookie(*st.session_state.pop("session_cookie_update"))
 
 # Header before login
 if "logged_in" not in st.session_state or not st.session_state.logged_in:
-    if os.path.exists("html/header.html"):
-        with open("html/header.html", "r", encoding="utf-8") as f:
-            st.markdown(f.read(), unsafe_allow_html=True)
+    header = read_text_file("html/header.html")
+    if header is not None:
+        st.markdown(header, unsafe_allow_html=True)
 
 # Session State defaults
 st.session_state.setdefault("logged_in", False)
 st.session_state.setdefault("first_login", True)
 st.session_state.setdefault("username", "")
 st.session_state.setdefault("name", "")
-st.session_state.setdefault("selected_chat_title", None)
+st.session_state.setdefault("selected_chat_id", None)
 st.session_state.setdefault("delete_states", {})
 st.session_state.setdefault("show_popup", True)
 st.session_state.setdefault("lang", "english")
+st.session_state.setdefault("message_windows", {})
+st.session_state.setdefault("chat_page", 0)
 
-translations = get_translations()
+translations = TRANSLATIONS
 lang_raw = st.session_state.get("lang", "english").lower()
 lang = "urdu" if lang_raw in ["ur", "urdu", "ur_pk", "ur-in"] else "english"
 if lang not in translations:
@@ -122,6 +201,8 @@ if not st.session_state.logged_in:
                 st.session_state.username = login_username
                 st.session_state.name = user_name
                 st.session_state.first_login = True
+                st.session_state.session_token = issue_token(login_username, user_name)
+                st.session_state.session_cookie_update = (st.session_state.session_token, int(SESSION_TTL_HOURS * 3600))
                 st.success("✅ Login successful!")
                 st.rerun()
             else:
@@ -146,20 +227,22 @@ if not st.session_state.logged_in:
 # ---------- MAIN APP ----------
 else:
     username = st.session_state.username
+    # chat_utils keeps the chats in memory and only re-reads the log when it changed on disk
     user_chats = load_user_chats(username)
 
     # Welcome message on first login
     if st.session_state.first_login:
         new_title = f"Chat {datetime.now().strftime('%d-%b %H:%M')}"
         welcome_message = {"role": "bot", "text": translations[lang]["welcome_message"]}
-        user_chats.insert(0, {"title": new_title, "messages": [welcome_message]})
+        new_chat = {"id": new_session_id(), "title": new_title, "messages": [welcome_message]}
+        user_chats.insert(0, new_chat)
         save_user_chats(username, user_chats)
-        st.session_state.selected_chat_title = new_title
+        st.session_state.selected_chat_id = new_chat["id"]
         st.session_state.first_login = False
 
     # Select default chat
-    if not st.session_state.selected_chat_title:
-        st.session_state.selected_chat_title = user_chats[0]["title"] if user_chats else None
+    if not st.session_state.selected_chat_id:
+        st.session_state.selected_chat_id = user_chats[0]["id"] if user_chats else None
 
     # -------------------- SIDEBAR --------------------
     with st.sidebar:
@@ -178,9 +261,13 @@ else:
                 st.session_state.show_email_logout = not st.session_state.show_email_logout
             if st.session_state.show_email_logout:
                 if st.button(" Logout"):
+                    if st.session_state.get("session_token"):
+                        revoke_token(st.session_state.session_token)
+                        st.session_state.session_token = None
+                        st.session_state.session_cookie_update = ("", 0)
                     st.session_state.logged_in = False
                     st.session_state.username = ""
-                    st.session_state.selected_chat_title = None
+                    st.session_state.selected_chat_id = None
                     st.rerun()
 
         # 🌐 Language Selection 
@@ -190,10 +277,10 @@ else:
             if new_lang != st.session_state.lang:
                 st.session_state.lang = new_lang
                 # Update welcome message in current chat
-                selected_chat = st.session_state.get("selected_chat_title")
+                selected_chat = st.session_state.get("selected_chat_id")
                 if selected_chat:
                     for chat in user_chats:
-                        if chat["title"] == selected_chat and chat["messages"]:
+                        if chat["id"] == selected_chat and chat["messages"]:
                             if chat["messages"][0]["role"] == "bot":
                                 chat["messages"][0]["text"] = translations[new_lang]["welcome_message"]
                                 save_user_chats(username, user_chats)
@@ -206,41 +293,80 @@ else:
         if st.button(translations[lang].get("new_chat", "New Chat")):
             new_title = f"Chat {datetime.now().strftime('%d-%b %H:%M')}"
             welcome_message = {"role": "bot", "text": translations[lang]["welcome_message"]}
-            user_chats.insert(0, {"title": new_title, "messages": [welcome_message]})
+            new_chat = {"id": new_session_id(), "title": new_title, "messages": [welcome_message]}
+            user_chats.insert(0, new_chat)
             save_user_chats(username, user_chats)
-            st.session_state.selected_chat_title = new_title
+            st.session_state.selected_chat_id = new_chat["id"]
             st.rerun()
 
-        # Chats list (always visible)
+        # Chats list (always visible): searchable, one page of buttons at a time
         st.markdown(f"### {translations[lang]['chats']}")
-        for i, chat in enumerate(user_chats):
-            chat_key = chat["title"]
+        chat_query = st.text_input(
+            translations[lang]["search_chats"], key="chat_search",
+            label_visibility="collapsed", placeholder=translations[lang]["search_chats"],
+        ).strip().lower()
+        if chat_query != st.session_state.get("last_chat_search", ""):
+            st.session_state.last_chat_search = chat_query
+            st.session_state.chat_page = 0
+        listed = [(i, chat) for i, chat in enumerate(user_chats) if chat_query in chat["title"].lower()]
+        page_count = max(1, -(-len(listed) // SIDEBAR_PAGE_SIZE))
+        page = min(st.session_state.chat_page, page_count - 1)
+        for i, chat in listed[page * SIDEBAR_PAGE_SIZE:(page + 1) * SIDEBAR_PAGE_SIZE]:
+            chat_key = chat["id"]
             cols = st.columns([0.8, 0.2])
-            if cols[0].button(f" {chat_key}", key=f"chat_{chat_key}_{i}"):
-                st.session_state.selected_chat_title = chat_key
+            if cols[0].button(f" {chat['title']}", key=f"chat_{chat_key}_{i}"):
+                st.session_state.selected_chat_id = chat_key
                 st.rerun()
             if cols[1].button("⋮", key=f"dots_{chat_key}_{i}", help="chat-options"):
                 st.session_state.delete_states[chat_key] = not st.session_state.delete_states.get(chat_key, False)
                 st.rerun()
             if st.session_state.delete_states.get(chat_key, False):
-                if st.button(f" Delete '{chat_key}'", key=f"delete_{chat_key}_{i}"):
+                if st.button(f" Delete '{chat['title']}'", key=f"delete_{chat_key}_{i}"):
                     delete_chat(username, chat_key)
                     del st.session_state.delete_states[chat_key]
-                    if st.session_state.get("selected_chat_title") == chat_key:
-                        st.session_state.selected_chat_title = None
+                    if st.session_state.get("selected_chat_id") == chat_key:
+                        st.session_state.selected_chat_id = None
                     st.rerun()
+        if page_count > 1:
+            cols = st.columns([0.25, 0.5, 0.25])
+            if cols[0].button("◀", key="chat_page_prev", disabled=page == 0):
+                st.session_state.chat_page = page - 1
+                st.rerun()
+            cols[1].markdown(f"{translations[lang]['page']} {page + 1} / {page_count}")
+            if cols[2].button("▶", key="chat_page_next", disabled=page >= page_count - 1):
+                st.session_state.chat_page = page + 1
+                st.rerun()
+
+        # Full-text search over every message in the user's chats
+        with st.expander(translations[lang]["search_messages"], expanded=False):
+            message_query = st.text_input(
+                translations[lang]["search_messages"], key="message_search", label_visibility="collapsed",
+            ).strip()
+            if message_query:
+                hits = search_history(username, message_query, limit=10)
+                if not hits:
+                    st.caption(translations[lang]["no_results"])
+                for n, hit in enumerate(hits):
+                    if st.button(f"{hit['title']}: {hit['snippet']}", key=f"search_hit_{n}"):
+                        st.session_state.selected_chat_id = hit["session"]
+                        # Widen the transcript window so the matched message is on screen
+                        chat = next((c for c in user_chats if c["id"] == hit["session"]), None)
+                        if chat:
+                            needed = len(chat["messages"]) - hit["position"]
+                            windows = st.session_state.message_windows
+                            windows[hit["session"]] = max(windows.get(hit["session"], CHAT_WINDOW), needed)
+                        st.rerun()
 
         # Events section 
         st.markdown(f"### {translations[lang]['events']}")
-        all_events = load_events()
-        week_events = get_next_seven_days_events(all_events)
-        if week_events and st.session_state.show_popup:
-            for e in week_events:
+        upcoming_events = week_events(datetime.now().date().isoformat())
+        if upcoming_events and st.session_state.show_popup:
+            for e in upcoming_events:
                 if st.button(f" {e['title']} ({e['date']})", key=f"event_{e['title']}"):
                     auto_msg = f"** {e['title']}**\n {e['description']}\n {e['date']}"
-                    selected_chat = st.session_state.selected_chat_title
+                    selected_chat = st.session_state.selected_chat_id
                     if selected_chat:
-                        current_chat = next(c for c in user_chats if c["title"] == selected_chat)
+                        current_chat = next(c for c in user_chats if c["id"] == selected_chat)
                         current_chat["messages"].append({"role": "bot", "text": auto_msg})
                         save_user_chats(username, user_chats)
                         st.rerun()
@@ -253,9 +379,9 @@ else:
                 st.rerun()
 
     # Chat Panel
-    selected_chat = st.session_state.selected_chat_title
+    selected_chat = st.session_state.selected_chat_id
     if selected_chat:
-        current_chat = next(chat for chat in user_chats if chat["title"] == selected_chat)
+        current_chat = next(chat for chat in user_chats if chat["id"] == selected_chat)
 
         with st.container():
             current_hour = datetime.now().hour
@@ -278,18 +404,30 @@ else:
             cols = st.columns(len(suggested_questions))
             for i, question in enumerate(suggested_questions):
                 if cols[i].button(question, key=f"suggested_{i}"):
-                    current_chat = next(c for c in user_chats if c["title"] == selected_chat)
+                    current_chat = next(c for c in user_chats if c["id"] == selected_chat)
                     current_chat["messages"].append({"role": "user", "text": question})
                     answer = suggested_qna.get(question, "Sorry, I don't have an answer for that.")
                     current_chat["messages"].append({"role": "bot", "text": answer})
                     save_user_chats(username, user_chats)
                     st.rerun()
 
-        for msg in current_chat["messages"]:
+        # Only the last messages are rendered; "load earlier" widens the window
+        messages = current_chat["messages"]
+        window = st.session_state.message_windows.get(selected_chat, CHAT_WINDOW)
+        start = max(0, len(messages) - window)
+        if start > 0:
+            if st.button(f"{translations[lang]['load_earlier']} ({start})", key=f"load_earlier_{selected_chat}"):
+                st.session_state.message_windows[selected_chat] = window + CHAT_WINDOW
+                st.rerun()
+
+        # One markdown element for the visible window rather than one per message
+        bubbles = []
+        for msg in messages[start:]:
             if msg["role"] == "user":
-                st.markdown(f"<div class='chat-bubble-user'><strong> You:</strong> {msg['text']}</div>", unsafe_allow_html=True)
+                bubbles.append(f"<div class='chat-bubble-user'><strong> You:</strong> {msg['text']}</div>")
             else:
-                st.markdown(f"<div class='chat-bubble-bot'><strong> Bot:</strong> {msg['text']}</div>", unsafe_allow_html=True)
+                bubbles.append(f"<div class='chat-bubble-bot'><strong> Bot:</strong> {msg['text']}</div>")
+        st.markdown("\n\n".join(bubbles), unsafe_allow_html=True)
 
         # Invisible div to scroll to
         st.markdown("<div id='chat-end'></div>", unsafe_allow_html=True)
@@ -321,13 +459,11 @@ else:
                     st.warning("Error processing input. Using raw input.")
                     corrected_input = user_input
 
-                # Use the logged-in user's email and current chat title as session_id
+                # Use the logged-in user's email and current chat id as session_id
                 email = st.session_state.username  # Email from login
-                session_id = st.session_state.selected_chat_title
+                session_id = st.session_state.selected_chat_id
 
-                # Call chatbot_reply with email and session_id
-                current_chat["messages"].append({"role": "user", "text": user_input})
-                bot_reply = chatbot_reply(user_input, email=email, session_id=session_id)
-                current_chat["messages"].append({"role": "bot", "text": bot_reply})
-                save_user_chats(username, user_chats)
+                # Call chatbot_reply with email and session_id; it persists the turn
+                # and updates the in-memory chats, so no separate save is needed
+                chatbot_reply(user_input, email=email, session_id=session_id)
                 st.rerun()
\ No newline at end of file
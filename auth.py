@@ -1,65 +1,133 @@
 import sqlite3
 import bcrypt
 import os
+import queue
+import threading
+from contextlib import contextmanager
+
+USERS_DB = os.environ.get("USERS_DB", "users.db")
+# Connections kept open to users.db and shared across requests
+AUTH_POOL_SIZE = int(os.environ.get("AUTH_POOL_SIZE", "8"))
+# bcrypt cost factor for new hashes; existing hashes keep the cost they were created with
+BCRYPT_ROUNDS = int(os.environ.get("BCRYPT_ROUNDS", "12"))
+# bcrypt hashes or checks allowed to run at once; callers beyond this wait their turn.
+# bcrypt releases the GIL, so this caps CPU use without taking the work off the calling thread
+AUTH_HASH_WORKERS = int(os.environ.get("AUTH_HASH_WORKERS", str(min(8, os.cpu_count() or 1))))
+
+# Statements are kept constant so sqlite3's per-connection statement cache reuses them
+INSERT_USER = "INSERT INTO users (username, password, name) VALUES (?, ?, ?)"
+SELECT_LOGIN = "SELECT password, name FROM users WHERE username = ?"
+UPDATE_PASSWORD = "UPDATE users SET password = ? WHERE username = ?"
+SELECT_USERNAMES = "SELECT username FROM users"
+
+class ConnectionPool:
+    """
+    Fixed-size pool of SQLite connections in WAL mode, so readers do not block the writer.
+    """
+
+    def __init__(self, path, size=AUTH_POOL_SIZE):
+        self.path = path
+        self.size = size
+        self.idle = queue.LifoQueue()
+        self.created = 0
+        self.lock = threading.Lock()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False, cached_statements=32)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA busy_timeout=30000")
+        return conn
+
+    @contextmanager
+    def connection(self):
+        """
+        Borrow a connection; the transaction is committed on success and rolled back on error.
+        """
+        conn = None
+        try:
+            conn = self.idle.get_nowait()
+        except queue.Empty:
+            with self.lock:
+                if self.created < self.size:
+                    self.created += 1
+                    conn = self._connect()
+            if conn is None:
+                conn = self.idle.get()
+        try:
+            yield conn
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            self.idle.put(conn)
+
+    def close(self):
+        while True:
+            try:
+                self.idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+_pool = None
+_pool_lock = threading.Lock()
+_hash_slots = threading.BoundedSemaphore(AUTH_HASH_WORKERS)
+
+def get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None or _pool.path != USERS_DB:
+            _pool = ConnectionPool(USERS_DB)
+        return _pool
+
+# Hash and check on the calling thread, at most AUTH_HASH_WORKERS at a time
+def hash_password(password):
+    with _hash_slots:
+        return bcrypt.hashpw(password.encode(), bcrypt.gensalt(BCRYPT_ROUNDS))
+
+def check_password(password, hashed):
+    with _hash_slots:
+        return bcrypt.checkpw(password.encode(), hashed)
 
 # Create users.db with a users table (including 'name')
 def init_user_db():
-    conn = sqlite3.connect("users.db")
-    cursor = conn.cursor()
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS users (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            username TEXT UNIQUE NOT NULL,
-            password TEXT NOT NULL,
-            name TEXT NOT NULL
-        )
-    """)
-    conn.commit()
-    conn.close()
+    with get_pool().connection() as conn:
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS users (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                username TEXT UNIQUE NOT NULL,
+                password TEXT NOT NULL,
+                name TEXT NOT NULL
+            )
+        """)
 
 # Register a new user with name
 def register_user(username, password, name):
-    conn = sqlite3.connect("users.db")
-    cursor = conn.cursor()
-    hashed_pw = bcrypt.hashpw(password.encode(), bcrypt.gensalt())
+    hashed_pw = hash_password(password)
     try:
-        cursor.execute(
-            "INSERT INTO users (username, password, name) VALUES (?, ?, ?)",
-            (username, hashed_pw, name)
-        )
-        conn.commit()
+        with get_pool().connection() as conn:
+            conn.execute(INSERT_USER, (username, hashed_pw, name))
         return True
     except sqlite3.IntegrityError:
         return False
-    finally:
-        conn.close()
 
 # Login existing user and return their name
 def login_user(username, password):
-    conn = sqlite3.connect("users.db")
-    cursor = conn.cursor()
-    cursor.execute(
-        "SELECT password, name FROM users WHERE username = ?",
-        (username,)
-    )
-    row = cursor.fetchone()
-    conn.close()
-    if row and bcrypt.checkpw(password.encode(), row[0]):
+    with get_pool().connection() as conn:
+        row = conn.execute(SELECT_LOGIN, (username,)).fetchone()
+    if row and check_password(password, row[0]):
         return row[1]  # return name
     return None
 
+# List every registered username (email)
+def list_usernames():
+    with get_pool().connection() as conn:
+        return [row[0] for row in conn.execute(SELECT_USERNAMES)]
+
 # Reset password for an existing user
 def reset_password(username, new_password):
-    conn = sqlite3.connect("users.db")
-    cursor = conn.cursor()
-    hashed_pw = bcrypt.hashpw(new_password.encode(), bcrypt.gensalt())
-
-    cursor.execute("SELECT * FROM users WHERE username = ?", (username,))
-    if cursor.fetchone():
-        cursor.execute("UPDATE users SET password = ? WHERE username = ?", (hashed_pw, username))
-        conn.commit()
-        conn.close()
-        return True
-    else:
-        conn.close()
-        return False
+    hashed_pw = hash_password(new_password)
+    with get_pool().connection() as conn:
+        updated = conn.execute(UPDATE_PASSWORD, (hashed_pw, username)).rowcount
+    return updated > 0
@@ -0,0 +1,71 @@
+import argparse
+import os
+import statistics
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import auth
+
+
+def prepare_users(count, password):
+    for i in range(count):
+        auth.register_user(f"loadtest{i}@example.com", password, f"Load Test {i}")
+
+
+def run(users, concurrency, rounds, password):
+    """
+    Sign every user in `rounds` times from `concurrency` threads at once.
+    Returns (elapsed seconds, per-login latencies in ms, failures).
+    """
+    latencies = []
+    failures = []
+    lock = threading.Lock()
+    start_gate = threading.Barrier(concurrency)
+
+    def sign_in(worker):
+        start_gate.wait()
+        for attempt in range(rounds):
+            for i in range(worker, users, concurrency):
+                started = time.perf_counter()
+                name = auth.login_user(f"loadtest{i}@example.com", password)
+                elapsed = (time.perf_counter() - started) * 1000
+                with lock:
+                    latencies.append(elapsed)
+                    if name is None:
+                        failures.append(i)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(sign_in, range(concurrency)))
+    return time.perf_counter() - started, latencies, failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure login throughput of auth.py under concurrent sign-ins.")
+    parser.add_argument("--users", type=int, default=200, help="accounts to create")
+    parser.add_argument("--concurrency", type=int, default=50, help="simultaneous sign-ins")
+    parser.add_argument("--rounds", type=int, default=1, help="logins per account")
+    parser.add_argument("--db", help="database file (default: a temporary file)")
+    args = parser.parse_args()
+
+    password = "load-test-password"
+    directory = tempfile.mkdtemp(prefix="auth_load_")
+    auth.USERS_DB = args.db or os.path.join(directory, "users.db")
+    auth.init_user_db()
+    print(f"Creating {args.users} users in {auth.USERS_DB} (bcrypt rounds {auth.BCRYPT_ROUNDS}, "
+          f"{auth.AUTH_HASH_WORKERS} concurrent hashes, pool size {auth.AUTH_POOL_SIZE})")
+    prepare_users(args.users, password)
+
+    elapsed, latencies, failures = run(args.users, args.concurrency, args.rounds, password)
+    latencies.sort()
+    p95 = latencies[int(len(latencies) * 0.95) - 1] if latencies else 0.0
+    print(f"{len(latencies)} logins from {args.concurrency} threads in {elapsed:.2f}s: "
+          f"{len(latencies) / elapsed:.1f} logins/s, "
+          f"p50 {statistics.median(latencies):.1f} ms, p95 {p95:.1f} ms, "
+          f"max {latencies[-1]:.1f} ms, failures {len(failures)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+import argparse
+import json
+import logging
+import sys
+
+from chat_handler import answer_query, finalize_generated_response, route_query
+from model_inference import generate_responses
+from preprocess_input import detect_language, translate_urdu_to_english
+
+logger = logging.getLogger(__name__)
+
+# Queries read per chunk; results for a chunk are written before the next chunk is read
+BATCH_CHUNK_SIZE = 256
+GENERATION_BATCH_SIZE = 8
+
+
+def read_queries(stream):
+    """
+    Yield query records from JSONL. Each line is either a JSON string or an object with
+    "query" (or "message") and optional "id", "email" and "session_id".
+    """
+    for line_no, line in enumerate(stream, start=1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            record = json.loads(line)
+        except json.JSONDecodeError as e:
+            logger.error(f"Skipping invalid JSON on line {line_no}: {e}")
+            continue
+        if isinstance(record, str):
+            record = {"query": record}
+        if not isinstance(record, dict) or not (record.get("query") or record.get("message")):
+            logger.error(f"Skipping line {line_no}: no query text")
+            continue
+        record.setdefault("id", line_no)
+        record["query"] = record.get("query") or record["message"]
+        yield record
+
+
+def prepare(record):
+    """
+    Steps 1-2 of chatbot_reply: detect language and translate Urdu to English.
+    """
+    query = record["query"]
+    try:
+        lang = detect_language(query)
+    except Exception as e:
+        logger.error(f"Language detection error for {record['id']}: {e}")
+        lang = "english"
+    try:
+        corrected = translate_urdu_to_english(query) if lang == "urdu" else query
+    except Exception as e:
+        logger.error(f"Translation error for {record['id']}: {e}")
+        corrected = query
+    return lang, corrected
+
+
+def reply_batch(records, generation_batch_size=GENERATION_BATCH_SIZE):
+    """
+    Answer a list of query records without writing chat history. Queries that reach the
+    generation step are grouped and answered with batched retrieval, reranking and generation.
+    Returns result dicts in input order.
+    """
+    results = [None] * len(records)
+    generate = []  # (position, lang, corrected)
+    for i, record in enumerate(records):
+        lang, corrected = prepare(record)
+        route = route_query(corrected)
+        results[i] = {"id": record["id"], "query": record["query"], "route": route}
+        if route == "generate":
+            generate.append((i, lang, corrected))
+            continue
+        results[i]["reply"] = answer_query(
+            corrected, lang,
+            email=record.get("email", "default_user@gmail.com"),
+            session_id=record.get("session_id"),
+            save_history=False,
+        )
+
+    if generate:
+        answers = generate_responses([corrected for _, _, corrected in generate], batch_size=generation_batch_size)
+        for (i, lang, _), answer in zip(generate, answers):
+            results[i]["reply"] = finalize_generated_response(answer, lang)
+    return results
+
+
+def run(input_stream, output_stream, chunk_size=BATCH_CHUNK_SIZE, generation_batch_size=GENERATION_BATCH_SIZE):
+    chunk = []
+    total = 0
+    for record in read_queries(input_stream):
+        chunk.append(record)
+        if len(chunk) >= chunk_size:
+            total += write_results(reply_batch(chunk, generation_batch_size), output_stream)
+            chunk = []
+    if chunk:
+        total += write_results(reply_batch(chunk, generation_batch_size), output_stream)
+    logger.info(f"Answered {total} queries")
+    return total
+
+
+def write_results(results, output_stream):
+    for result in results:
+        output_stream.write(json.dumps(result, ensure_ascii=False) + "\n")
+    output_stream.flush()
+    return len(results)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Answer a JSONL file of queries without touching chat history.")
+    parser.add_argument("input", help="JSONL file of queries, or - for stdin")
+    parser.add_argument("-o", "--output", default="-", help="JSONL output file, or - for stdout")
+    parser.add_argument("--chunk-size", type=int, default=BATCH_CHUNK_SIZE)
+    parser.add_argument("--generation-batch-size", type=int, default=GENERATION_BATCH_SIZE)
+    args = parser.parse_args()
+
+    input_stream = sys.stdin if args.input == "-" else open(args.input, "r", encoding="utf-8")
+    output_stream = sys.stdout if args.output == "-" else open(args.output, "w", encoding="utf-8")
+    try:
+        run(input_stream, output_stream, args.chunk_size, args.generation_batch_size)
+    finally:
+        if input_stream is not sys.stdin:
+            input_stream.close()
+        if output_stream is not sys.stdout:
+            output_stream.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,8 @@
 import logging
-from model_inference import generate_response, retriever
+# Models are loaded lazily, or in worker processes when INFERENCE_WORKERS > 0;
+# admission degrades to cheaper answers when generation is saturated
+import admission
+from concurrent.futures import TimeoutError as InferenceTimeout
 from preprocess_input import detect_language, translate_urdu_to_english, translate_to_urdu
 from utils.event_utils import (
     load_events,
@@ -14,13 +17,14 @@ from utils.event_utils import (
 )
 from utils.schedule_utils import (
     load_schedule,
-    get_course_schedule,
+    get_schedule_index,
+    format_schedule,
     get_all_schedule
 )
-from utils.common_utils import extract_keywords
 from utils.recommendation_utils import generate_recommendations
-from utils.history_utils import append_chat_history  
+from utils.history_utils import append_chat_history
 from utils.suggested_qna import suggested_qna
+from utils.single_flight import coalesce, normalize_query
 from datetime import datetime
 import re
 
@@ -28,7 +32,23 @@ import re
 logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-def chatbot_reply(user_input, email='default_user@gmail.com', session_id=None):
+ROUTES = ("general_event", "recommendation", "event", "schedule", "suggested", "generate")
+
+GENERAL_EVENT_KEYWORDS = [
+    "what type of events", "what kind of events", "which events occur", 
+    "types of events", "kind of events", "what events happen", 
+    "what seminars", "what workshops", "what sessions",
+    "کس قسم کے ایونٹس", "کوروٹ میں کون سے ایونٹس", "ایونٹس کی اقسام"
+]
+EVENT_TIME_KEYWORDS = [
+    "today", "tomorrow", "this week", "next week", "this month", "next month",
+    "آج", "کل", "اس ہفتے", "اگلے ہفتے", "اس مہینے", "اگلے مہینے"
+]
+RECOMMENDATION_KEYWORDS = ["recommend", "suggest", "what should i learn", "what do you recommend", "which course is good", "which course should i take"]
+EVENT_KEYWORDS = ["event", "seminar", "webinar", "orientation", "workshop", "meetup"]
+SCHEDULE_KEYWORDS = ["class timing", "class schedule", "timing", "schedule", "class timings", "classes timing", "timing of"]
+
+def chatbot_reply(user_input, email='default_user@gmail.com', session_id=None, save_history=True):
     logger.debug(f"Received user input: {user_input}")
 
     # Step 1: Detect Language
@@ -37,37 +57,89 @@ def chatbot_reply(user_input, email='default_user@gmail.com', session_id=None):
         logger.debug(f"Detected language: {lang}")
     except Exception as e:
         logger.error(f"Language detection error: {e}")
+        if save_history:
+            append_chat_history(email, user_input, "Error detecting language.", session_id=session_id)
         return "Error detecting language."
 
     # Step 2: Translate Urdu to English
     try:
-        translated_input = translate_urdu_to_english(user_input) if lang == "urdu" else user_input
+        translated_input = (
+            coalesce("translation", ("en", normalize_query(user_input)), translate_urdu_to_english, user_input)
+            if lang == "urdu" else user_input
+        )
         logger.debug(f"Translated input: {translated_input}")
     except Exception as e:
         logger.error(f"Translation error: {e}")
+        if save_history:
+            append_chat_history(email, user_input, "Error translating input.", session_id=session_id)
         return "Error translating input."
 
     corrected_input = translated_input
     logger.debug(f"Corrected input: {corrected_input}")
 
-    # Step 3: Check for general event type questions
+    return answer_query(corrected_input, lang, email=email, session_id=session_id, save_history=save_history, user_input=user_input)
+
+def route_query(corrected_input):
+    """
+    Decide which step of the pipeline answers this (English) query.
+    Returns one of ROUTES.
+    """
     lower_input = corrected_input.lower()
-    general_event_keywords = [
-        "what type of events", "what kind of events", "which events occur", 
-        "types of events", "kind of events", "what events happen", 
-        "what seminars", "what workshops", "what sessions",
-        "کس قسم کے ایونٹس", "کوروٹ میں کون سے ایونٹس", "ایونٹس کی اقسام"
-    ]
     is_general_event_query = (
-        any(phrase in lower_input for phrase in general_event_keywords) or
+        any(phrase in lower_input for phrase in GENERAL_EVENT_KEYWORDS) or
         ("events" in lower_input and "corvit" in lower_input and 
-         not any(time_keyword in lower_input for time_keyword in [
-             "today", "tomorrow", "this week", "next week", "this month", "next month",
-             "آج", "کل", "اس ہفتے", "اگلے ہفتے", "اس مہینے", "اگلے مہینے"
-         ]))
+         not any(time_keyword in lower_input for time_keyword in EVENT_TIME_KEYWORDS))
     )
-
     if is_general_event_query:
+        return "general_event"
+    if any(kw in lower_input for kw in RECOMMENDATION_KEYWORDS):
+        return "recommendation"
+    if any(word in lower_input for word in EVENT_KEYWORDS):
+        return "event"
+    if any(kw in lower_input for kw in SCHEDULE_KEYWORDS):
+        return "schedule"
+    if corrected_input in suggested_qna:
+        return "suggested"
+    return "generate"
+
+def translate_reply(text):
+    # Identical replies (e.g. to a broadcast question) are translated once
+    return coalesce("translation", ("ur", text), translate_to_urdu, text)
+
+def finalize_generated_response(english_response, lang):
+    if not english_response:
+        english_response = (
+            "Sorry, I couldn't understand your question. Please contact Corvit at 051-111-333-222 or email info@corvit.com.pk"
+        )
+        logger.debug(f"Fallback response: {english_response}")
+    return translate_reply(english_response) if lang == "urdu" else english_response
+
+def generate_final_response(corrected_input, lang):
+    stage, english_response = admission.answer(corrected_input)
+    logger.debug(f"Generated response ({stage}): {english_response}")
+    return finalize_generated_response(english_response, lang)
+
+def answer_query(corrected_input, lang, email='default_user@gmail.com', session_id=None, save_history=True, user_input=None):
+    """
+    Answer an already detected/translated query. With save_history=False nothing is written
+    to the user's chat history (used by batch runs). user_input is the message as typed,
+    stored for display when it differs from corrected_input.
+    """
+    def record(response):
+        if save_history:
+            append_chat_history(email, corrected_input, response, session_id=session_id, original_msg=user_input)
+
+    def respond(response, translate=True):
+        final = translate_reply(response) if translate and lang == "urdu" else response
+        record(final)
+        return final
+
+    route = route_query(corrected_input)
+    lower_input = corrected_input.lower()
+    logger.debug(f"Route: {route}")
+
+    # Step 3: Check for general event type questions
+    if route == "general_event":
         logger.debug("Detected general event type question.")
         question = (
             "What types of events occur at Corvit?" if lang == "english" else 
@@ -77,11 +149,10 @@ def chatbot_reply(user_input, email='default_user@gmail.com', session_id=None):
             question, 
             "Corvit hosts various events like workshops, seminars, and webinars."
         )
-        append_chat_history(email, corrected_input, response, session_id=session_id)
-        return response
+        return respond(response, translate=False)
 
     # Step 4: Recommendation-related logic
-    if any(kw in lower_input for kw in ["recommend", "suggest", "what should i learn", "what do you recommend", "which course is good", "which course should i take"]):
+    if route == "recommendation":
         logger.debug("Processing recommendation query.")
         try:
             logger.debug(f"Processing recommendations for email: {email}")
@@ -90,21 +161,17 @@ def chatbot_reply(user_input, email='default_user@gmail.com', session_id=None):
 
             if recommendations:
                 response_text = "**Based on your interests, we recommend:**\n\n" + recommendations
-                append_chat_history(email, corrected_input, response_text, session_id=session_id)
-                return translate_to_urdu(response_text) if lang == "urdu" else response_text
+                return respond(response_text)
             else:
                 fallback = "Sorry, we couldn't generate any recommendations at the moment. Try asking about a topic you're interested in!"
-                append_chat_history(email, corrected_input, fallback, session_id=session_id)
-                return translate_to_urdu(fallback) if lang == "urdu" else fallback
+                return respond(fallback)
         except Exception as e:
             logger.error(f"Recommendation error for {email}: {str(e)}", exc_info=True)
             error_msg = "Error generating recommendations. Please try again or contact support."
-            append_chat_history(email, corrected_input, error_msg, session_id=session_id)
-            return translate_to_urdu(error_msg) if lang == "urdu" else error_msg
+            return respond(error_msg)
 
     # Step 5: Event-related Logic
-    event_keywords = ["event", "seminar", "webinar", "orientation", "workshop", "meetup"]
-    if any(word in lower_input for word in event_keywords):
+    if route == "event":
         logger.debug("Processing event-related query.")
         try:
             events = load_events()
@@ -133,8 +200,7 @@ def chatbot_reply(user_input, email='default_user@gmail.com', session_id=None):
             if filtered:
                 combined = "\n\n---\n\n".join(format_events(filtered))
                 logger.debug(f"Event response: {combined}")
-                append_chat_history(email, corrected_input, combined, session_id=session_id)
-                return translate_to_urdu(combined) if lang == "urdu" else combined
+                return respond(combined)
             else:
                 fallback = (
                     "Sorry, I couldn't find any relevant event info.\n"
@@ -144,44 +210,30 @@ def chatbot_reply(user_input, email='default_user@gmail.com', session_id=None):
                     "Website: https://www.corvit.com.pk"
                 )
                 logger.debug(f"Event fallback response: {fallback}")
-                append_chat_history(email, corrected_input, fallback, session_id=session_id)
-                return translate_to_urdu(fallback) if lang == "urdu" else fallback
+                return respond(fallback)
         except Exception as e:
             logger.error(f"Event processing error: {e}")
             error_msg = "Error processing event query."
-            append_chat_history(email, corrected_input, error_msg, session_id=session_id)
-            return translate_to_urdu(error_msg) if lang == "urdu" else error_msg
+            return respond(error_msg)
 
     # Step 6: Schedule/class timing logic
-    schedule_keywords = ["timing", "class", "schedule", "classes", "Course"]
-    if any(kw in lower_input for kw in ["class timing", "class schedule", "timing", "schedule", "class timings", "classes timing", "timing of"]):
+    if route == "schedule":
         logger.debug("Processing schedule-related query.")
         try:
             schedule_data = load_schedule()
-            logger.debug(f"Loaded schedule: {schedule_data}")
-            all_course_names = [entry["course"].lower() for entry in schedule_data]
-            keywords = extract_keywords(corrected_input)
-            logger.debug(f"Extracted keywords: {keywords}")
-
-            filtered_keywords = [
-                kw for kw in keywords
-                if any(kw.lower() in course for course in all_course_names)
-            ]
-            logger.debug(f"Filtered keywords: {filtered_keywords}")
-
-            if filtered_keywords:
-                matched_courses = []
-                for kw in filtered_keywords:
-                    course_result = get_course_schedule(kw, schedule_data)
-                    if course_result:
-                        matched_courses.extend(course_result)
-                        logger.debug(f"Matched courses for {kw}: {course_result}")
+            schedule_index = get_schedule_index(schedule_data)
+            course_ids = schedule_index.match(corrected_input)
+            filters = schedule_index.extract_filters(corrected_input)
+            logger.debug(f"Matched course entries: {course_ids}, filters: {filters}")
+
+            if course_ids:
+                matched_courses = [format_schedule(entry) for entry in schedule_index.filter(course_ids, **filters)]
+                logger.debug(f"Matched courses: {matched_courses}")
 
                 if matched_courses:
                     combined = "\n\n---\n\n".join(matched_courses)
                     logger.debug(f"Schedule response: {combined}")
-                    append_chat_history(email, corrected_input, combined, session_id=session_id)
-                    return translate_to_urdu(combined) if lang == "urdu" else combined
+                    return respond(combined)
                 else:
                     fallback = (
                         "Sorry, currently this course is not available.\n"
@@ -191,43 +243,48 @@ def chatbot_reply(user_input, email='default_user@gmail.com', session_id=None):
                         "Website: https://www.corvit.com.pk"
                     )
                     logger.debug(f"Schedule fallback response: {fallback}")
-                    append_chat_history(email, corrected_input, fallback, session_id=session_id)
-                    return translate_to_urdu(fallback) if lang == "urdu" else fallback
+                    return respond(fallback)
             else:
-                result = get_all_schedule(schedule_data)
-                logger.debug(f"Full schedule: {result}")
+                if any(filters.values()):
+                    result = [format_schedule(entry) for entry in schedule_index.filter(**filters)]
+                else:
+                    result = get_all_schedule(schedule_data)
+                logger.debug(f"Schedule for filters {filters}: {result}")
+                if not result:
+                    # Nothing runs on that day / in that mode or city: say so rather than list every class
+                    return respond(
+                        "Sorry, no classes are scheduled for that day, mode or city.\n"
+                        "For more information:\n\n"
+                        "Contact Corvit: 051-111-333-222\n"
+                        "Email: info@corvit.com.pk\n"
+                        "Website: https://www.corvit.com.pk"
+                    )
                 combined = "\n\n---\n\n".join(result)
-                append_chat_history(email, corrected_input, combined, session_id=session_id)
-                return translate_to_urdu(combined) if lang == "urdu" else combined
+                return respond(combined)
         except Exception as e:
             logger.error(f"Schedule processing error: {e}")
             error_msg = "Error processing schedule query."
-            append_chat_history(email, corrected_input, error_msg, session_id=session_id)
-            return translate_to_urdu(error_msg) if lang == "urdu" else error_msg
+            return respond(error_msg)
 
     # Step 7: Check suggested_qna for other predefined responses
-    if corrected_input in suggested_qna:
+    if route == "suggested":
         logger.debug(f"Found response in suggested_qna for: {corrected_input}")
         response = suggested_qna[corrected_input]
-        append_chat_history(email, corrected_input, response, session_id=session_id)
-        return response
+        return respond(response, translate=False)
 
-    # Step 8: General response using generate_response
+    # Step 8: General response using generate_response, subject to admission control.
+    # Concurrent identical questions in the same language share one answer
     logger.debug("Falling back to generate_response.")
     try:
-        english_response = generate_response(corrected_input)
-        logger.debug(f"Generated response: {english_response}")
-        if not english_response:
-            english_response = (
-                "Sorry, I couldn't understand your question. Please contact Corvit at 051-111-333-222 or email info@corvit.com.pk"
-            )
-            logger.debug(f"Fallback response: {english_response}")
-        final_response = translate_to_urdu(english_response) if lang == "urdu" else english_response
+        final_response = coalesce(
+            "generation", (normalize_query(corrected_input), lang), generate_final_response, corrected_input, lang
+        )
         logger.debug(f"Final response: {final_response}")
-        append_chat_history(email, corrected_input, final_response, session_id=session_id)
-        return final_response
+        return respond(final_response, translate=False)
+    except InferenceTimeout:
+        logger.error(f"Generate response timed out for: {corrected_input}")
+        return respond("Sorry, this is taking longer than expected. Please try again in a moment.")
     except Exception as e:
         logger.error(f"Generate response error: {e}")
         error_msg = "Error generating response."
-        append_chat_history(email, corrected_input, error_msg, session_id=session_id)
-        return translate_to_urdu(error_msg) if lang == "urdu" else error_msg
\ No newline at end of file
+        return respond(error_msg)
\ No newline at end of file
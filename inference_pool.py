@@ -0,0 +1,258 @@
+"""
+Out-of-process model inference.
+
+With INFERENCE_WORKERS > 0, generate_response() is answered by a pool of worker processes
+that each load model_inference (embedding, retrieval, rerank, generation) with torch pinned to
+INFERENCE_THREADS threads. The calling process (Streamlit or the API) never imports
+model_inference or the flan-t5 generator, so the beam search no longer competes with UI and
+I/O threads. It still loads the MiniLM embedder and FAISS index of utils.recommendation_utils,
+which serve recommendations and encode user messages for interest profiles on a background
+thread.
+
+Requests carry an id and go over a pipe to an idle worker. A request that times out is
+cancelled: if it is still queued it is dropped, and if a worker is already running it the
+worker is killed (a beam search cannot be interrupted) and a fresh one is started.
+
+With INFERENCE_WORKERS=0 (the default) the models are imported lazily and run in-process.
+"""
+
+import os
+import time
+import logging
+import itertools
+import threading
+import multiprocessing
+from collections import deque
+from concurrent.futures import Future, TimeoutError
+from multiprocessing.connection import wait
+
+logger = logging.getLogger(__name__)
+
+INFERENCE_WORKERS = int(os.environ.get("INFERENCE_WORKERS", "0"))
+# torch intra-op threads per worker; workers x threads should not exceed the host's cores
+INFERENCE_THREADS = int(os.environ.get("INFERENCE_THREADS", "2"))
+# Seconds a request may take, including time queued behind others
+INFERENCE_TIMEOUT = float(os.environ.get("INFERENCE_TIMEOUT", "120"))
+
+# model_inference functions workers will run
+METHODS = {"generate_response", "generate_responses"}
+
+
+def _worker_main(conn, threads):
+    try:
+        import torch
+        torch.set_num_threads(threads)
+    except ImportError:
+        pass
+    import model_inference
+    conn.send(("ready", True, None))
+    while True:
+        try:
+            message = conn.recv()
+        except (EOFError, OSError):
+            return
+        if message is None:
+            return
+        request_id, method, args = message
+        try:
+            conn.send((request_id, True, getattr(model_inference, method)(*args)))
+        except Exception as e:
+            conn.send((request_id, False, f"{type(e).__name__}: {e}"))
+
+
+class _Worker:
+    def __init__(self, ctx, threads):
+        self.conn, child_conn = ctx.Pipe()
+        self.process = ctx.Process(target=_worker_main, args=(child_conn, threads), daemon=True, name="inference-worker")
+        self.process.start()
+        child_conn.close()
+        self.ready = False
+        self.request_id = None  # request being run, if any
+
+
+class InferencePool:
+    def __init__(self, workers=INFERENCE_WORKERS, threads=INFERENCE_THREADS):
+        self.ctx = multiprocessing.get_context("spawn")
+        self.threads = threads
+        self.lock = threading.Lock()
+        self.queue = deque()  # request ids waiting for a worker
+        self.requests = {}  # request id -> (method, args, future)
+        self.ids = itertools.count(1)
+        self.wake_reader, self.wake_writer = self.ctx.Pipe(duplex=False)
+        self.stats = {"completed": 0, "failed": 0, "timeouts": 0, "cancelled": 0, "restarts": 0}
+        self.workers = [_Worker(self.ctx, threads) for _ in range(workers)]
+        self.retired = []  # connections of replaced workers, closed by the dispatch thread
+        self.closed = False
+        self.thread = threading.Thread(target=self._run, name="inference-dispatch", daemon=True)
+        self.thread.start()
+
+    def submit(self, method, *args):
+        """
+        Queue a call of model_inference.<method>(*args). Returns a Future with a request_id attribute.
+        """
+        if method not in METHODS:
+            raise ValueError(f"Unknown inference method: {method}")
+        future = Future()
+        with self.lock:
+            request_id = next(self.ids)
+            future.request_id = request_id
+            self.requests[request_id] = (method, args, future)
+            self.queue.append(request_id)
+        self.wake_writer.send(None)
+        return future
+
+    def call(self, method, *args, timeout=INFERENCE_TIMEOUT):
+        future = self.submit(method, *args)
+        try:
+            return future.result(timeout)
+        except TimeoutError:
+            self.stats["timeouts"] += 1
+            self.cancel(future.request_id)
+            raise
+
+    def cancel(self, request_id):
+        """
+        Cancel a request: drop it if queued, or kill and replace the worker running it.
+        """
+        with self.lock:
+            entry = self.requests.pop(request_id, None)
+            if entry is None:
+                return False
+            self.stats["cancelled"] += 1
+            if request_id in self.queue:
+                self.queue.remove(request_id)
+            for index, worker in enumerate(self.workers):
+                if worker.request_id == request_id:
+                    logger.warning(f"Killing inference worker {worker.process.pid} running cancelled request {request_id}")
+                    worker.process.kill()
+                    self._replace(index)
+        entry[2].cancel()
+        self.wake_writer.send(None)
+        return True
+
+    def metrics(self):
+        with self.lock:
+            busy = sum(1 for worker in self.workers if worker.request_id is not None)
+            ready = sum(1 for worker in self.workers if worker.ready)
+            return dict(self.stats, workers=len(self.workers), ready=ready, busy=busy, queued=len(self.queue))
+
+    def close(self):
+        self.closed = True
+        self.wake_writer.send(None)
+        for worker in self.workers:
+            try:
+                worker.conn.send(None)
+            except OSError:
+                pass
+            worker.process.join(timeout=5)
+            if worker.process.is_alive():
+                worker.process.kill()
+
+    def _replace(self, index):
+        # Called with self.lock held. The old connection may be in the dispatch thread's
+        # wait(), so that thread closes it
+        self.retired.append(self.workers[index].conn)
+        self.workers[index] = _Worker(self.ctx, self.threads)
+        self.stats["restarts"] += 1
+
+    def _dispatch(self):
+        # Called with self.lock held
+        for index, worker in enumerate(list(self.workers)):
+            if not self.queue:
+                return
+            if worker.ready and worker.request_id is None:
+                request_id = self.queue.popleft()
+                method, args, future = self.requests[request_id]
+                # A request requeued after a failed send is already running
+                if not future.running() and not future.set_running_or_notify_cancel():
+                    self.requests.pop(request_id, None)
+                    continue
+                try:
+                    worker.conn.send((request_id, method, args))
+                except OSError as e:
+                    # The idle worker died (e.g. OOM-killed): requeue the request for another worker
+                    logger.error(f"Inference worker {worker.process.pid} is gone ({e}), replacing it")
+                    self.queue.appendleft(request_id)
+                    worker.process.kill()
+                    self._replace(index)
+                    continue
+                worker.request_id = request_id
+
+    def _run(self):
+        while not self.closed:
+            with self.lock:
+                for conn in self.retired:
+                    conn.close()
+                self.retired = []
+                self._dispatch()
+                conns = {worker.conn: worker for worker in self.workers}
+            ready = wait(list(conns) + [self.wake_reader], timeout=1.0)
+            for conn in ready:
+                if conn is self.wake_reader:
+                    while self.wake_reader.poll():
+                        self.wake_reader.recv()
+                    continue
+                worker = conns[conn]
+                try:
+                    request_id, ok, payload = conn.recv()
+                except (EOFError, OSError):
+                    if self._worker_died(worker):
+                        time.sleep(0.5)  # do not spin if workers keep crashing at startup
+                    continue
+                with self.lock:
+                    if request_id == "ready":
+                        worker.ready = True
+                        continue
+                    worker.request_id = None
+                    entry = self.requests.pop(request_id, None)
+                if entry is None:
+                    continue  # cancelled meanwhile
+                if ok:
+                    self.stats["completed"] += 1
+                    entry[2].set_result(payload)
+                else:
+                    self.stats["failed"] += 1
+                    entry[2].set_exception(RuntimeError(payload))
+
+    def _worker_died(self, worker):
+        with self.lock:
+            if worker not in self.workers:
+                return False  # already replaced by cancel()
+            index = self.workers.index(worker)
+            logger.error(f"Inference worker {worker.process.pid} exited (code {worker.process.exitcode})")
+            entry = self.requests.pop(worker.request_id, None) if worker.request_id else None
+            self._replace(index)
+        if entry is not None:
+            self.stats["failed"] += 1
+            entry[2].set_exception(RuntimeError("Inference worker exited while answering."))
+        return True
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """
+    Return the process-wide pool, starting its workers on first use.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = InferencePool()
+        return _pool
+
+
+def generate_response(query, *args, timeout=INFERENCE_TIMEOUT):
+    """
+    Answer a query with the retrieval + generation pipeline (model_inference.generate_response),
+    in a worker process when INFERENCE_WORKERS > 0 and in-process otherwise.
+    """
+    if INFERENCE_WORKERS > 0:
+        return get_pool().call("generate_response", query, *args, timeout=timeout)
+    from model_inference import generate_response as local_generate_response
+    return local_generate_response(query, *args)
+
+
+def metrics():
+    return _pool.metrics() if _pool else {}
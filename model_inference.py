@@ -1,11 +1,17 @@
 import logging
 import sys
+import os
+import json
+import hashlib
 from langchain.vectorstores import FAISS
 from langchain.embeddings import HuggingFaceEmbeddings
 from sentence_transformers import SentenceTransformer, util
 import torch
 import re
+import numpy as np
+import faiss
 from transformers import AutoTokenizer, AutoModelForSeq2SeqLM
+from utils.single_flight import coalesce, normalize_query
 
 # Set up logging
 logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -26,7 +32,8 @@ except Exception as e:
 try:
     logger.debug("Loading embedding and reranker models...")
     embedding_model = HuggingFaceEmbeddings(model_name="sentence-transformers/all-mpnet-base-v2")
-    reranker_model = SentenceTransformer("sentence-transformers/all-mpnet-base-v2")
+    # Same checkpoint as the embedder: reuse its SentenceTransformer instead of loading a second copy
+    reranker_model = getattr(embedding_model, "client", None) or SentenceTransformer("sentence-transformers/all-mpnet-base-v2")
     logger.debug("Embedding and reranker models loaded successfully.")
 except Exception as e:
     logger.error(f"Error loading embedding/reranker models: {e}")
@@ -46,6 +53,79 @@ except Exception as e:
     logger.error(f"Error loading FAISS index: {e}")
     sys.exit(1)
 
+# === Answering thresholds ===
+RETRIEVAL_K = 4
+MIN_SIMILARITY = 0.5
+DIRECT_ANSWER_SIMILARITY = 0.64
+GENERATION_KWARGS = dict(
+    max_new_tokens=300,
+    min_length=20,
+    num_beams=4,
+    no_repeat_ngram_size=2
+)
+NO_ANSWER_RESPONSE = "I'm sorry, I couldn't find a specific answer to your question at the moment. However, Corvit Systems Islamabad offers a wide range of IT training programs, including CCNA, Cybersecurity, AWS, and many more. If you're looking to enhance your skills or start a career in IT, we’d be happy to help you explore the right course. Would you like to know more about our available training options?"
+
+# === Precomputed answers ===
+# Answers generated offline by precompute_answers.py for frequent (top-1, top-2) document
+# pairs, so queries in the generation band (MIN_SIMILARITY to DIRECT_ANSWER_SIMILARITY)
+# with a known pair skip flan-t5
+ANSWER_TABLE_PATH = os.environ.get("ANSWER_TABLE_PATH", os.path.join("data", "answer_table.json"))
+_answer_table = {"key": None, "answers": {}}
+
+def index_version(path=faiss_path):
+    """
+    Hash of the FAISS index files. A precomputed table is only used with the index it was built from.
+    """
+    digest = hashlib.sha256()
+    for name in sorted(os.listdir(path)):
+        with open(os.path.join(path, name), "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+    return digest.hexdigest()[:16]
+
+INDEX_VERSION = index_version()
+
+def pair_key(ranked):
+    if len(ranked) < 2:
+        return None
+    texts = [doc.page_content for _, doc in ranked[:2]]
+    return hashlib.sha1("\x1f".join(texts).encode("utf-8")).hexdigest()[:20]
+
+def load_answer_table():
+    """
+    Load the precomputed answers ({pair key: entry}). Reused until the file changes; empty if
+    missing or built from another index version.
+    """
+    try:
+        stat = os.stat(ANSWER_TABLE_PATH)
+    except FileNotFoundError:
+        return {}
+    key = (stat.st_mtime_ns, stat.st_size)
+    if _answer_table["key"] == key:
+        return _answer_table["answers"]
+    answers = {}
+    try:
+        with open(ANSWER_TABLE_PATH, "r", encoding="utf-8") as f:
+            table = json.load(f)
+        if table.get("index_version") == INDEX_VERSION:
+            answers = table.get("answers", {})
+            logger.info(f"Loaded {len(answers)} precomputed answers from {ANSWER_TABLE_PATH}")
+        else:
+            logger.warning(f"Ignoring {ANSWER_TABLE_PATH}: built for index {table.get('index_version')}, current is {INDEX_VERSION}")
+    except (OSError, ValueError) as e:
+        logger.error(f"Error loading precomputed answers from {ANSWER_TABLE_PATH}: {e}")
+    _answer_table["key"] = key
+    _answer_table["answers"] = answers
+    return answers
+
+def precomputed_answer(ranked):
+    key = pair_key(ranked)
+    entry = load_answer_table().get(key) if key else None
+    if entry:
+        logger.debug(f"Using precomputed answer for document pair {key}")
+        return entry["answer"]
+    return None
+
 # === Utility functions ===
 def clean_output(text):
     logger.debug(f"Cleaning output: {text}")
@@ -54,7 +134,7 @@ def clean_output(text):
     text = re.sub(r'(##end_quote##|\bTherefore\b.*|[\(\[][^)]*[:\]]|[^\w\s.,!?])', '', text, flags=re.IGNORECASE)
     text = re.sub(r'\s+', ' ', text).strip()
     logger.debug(f"Cleaned output: {text}")
-    return text if text else "I'm sorry, I couldn't find a specific answer to your question at the moment. However, Corvit Systems Islamabad offers a wide range of IT training programs, including CCNA, Cybersecurity, AWS, and many more. If you're looking to enhance your skills or start a career in IT, we’d be happy to help you explore the right course. Would you like to know more about our available training options?"
+    return text if text else NO_ANSWER_RESPONSE
 
 def is_out_of_domain(query):
     blacklist = [
@@ -81,17 +161,88 @@ def is_outside_islamabad(query):
     logger.debug(f"Outside Islamabad check for query '{query}': {result}")
     return result
 
-# === Main QA function ===
-def generate_response(query):
-    logger.debug(f"Processing query: {query}")
-    
+# === Pipeline stages (shared by single and batch answering) ===
+def screen_query(query):
+    """
+    Return a canned reply for general-knowledge, out-of-domain or other-branch queries, else None.
+    """
     if is_general_knowledge(query):
         return "🤖 Sorry, I’m only trained to answer questions about Corvit Islamabad’s IT training and services."
     if is_out_of_domain(query):
         return "🤖 Sorry, I’m only trained to answer questions about Corvit Islamabad."
     if is_outside_islamabad(query):
         return "🤖 I’m focused only on Corvit Islamabad. I don’t have data for other branches."
+    return None
+
+def encode_distinct(texts):
+    """
+    Encode each distinct text once, in a single reranker pass.
+    Returns (embeddings, {text: row in embeddings}).
+    """
+    distinct = list(dict.fromkeys(texts))
+    embeddings = reranker_model.encode(distinct, convert_to_tensor=True)
+    return embeddings, {text: row for row, text in enumerate(distinct)}
+
+def rank_documents(query_emb, doc_embs, results):
+    sims = util.cos_sim(query_emb, doc_embs)[0]
+    logger.debug(f"Similarity scores: {sims.tolist()}")
+    return sorted(zip(sims, results), key=lambda x: x[0], reverse=True)
+
+def build_prompt(query, ranked):
+    context = ""
+    for sim, doc in ranked[:2]:
+        context += f"Q: {doc.page_content}\nA: {doc.metadata.get('answer', '')}\n\n"
+    logger.debug(f"Context for generation: {context}")
+
+    return f"""You are a customer support assistant for Corvit Islamabad, specializing in IT training and certifications (e.g., CCNA, CCNP, cybersecurity, AWS, Azure). 
+Use only the provided context to answer questions about Corvit’s services, registration, or courses in Islamabad. For process-related queries (e.g., how to register), provide full steps. For irrelevant or unrelated questions (e.g., cooking, yoga, general knowledge), respond only with: "Sorry, I couldn’t find a relevant answer to your question. Corvit offers IT training like CCNA, cybersecurity, and AWS in Islamabad. Interested?" Do not guess or repeat question or generate answers outside Corvit’s scope. If no relevant answer is found in the context, use the same apology.
+
+Context:
+{context}
+
+User Question: {query}
+Answer:"""
+
+def plan_answer(query, ranked, direct_answer_similarity=DIRECT_ANSWER_SIMILARITY):
+    """
+    Decide how to answer from the reranked documents.
+    Returns ("final", text) when no generation is needed, else ("generate", prompt).
+    Lowering direct_answer_similarity (down to MIN_SIMILARITY) skips generation for more queries.
+    """
+    top_sim, top_doc = ranked[0]
+    top_answer = top_doc.metadata.get("answer", "").strip()
+    logger.debug(f"Top similarity: {top_sim.item()}, Top answer: {top_answer}, Query: {query}")
+
+    # Hard filter
+    if not top_answer or top_sim.item() < MIN_SIMILARITY:
+        logger.warning(f"Top answer empty or similarity too low: {top_sim.item()}")
+        return "final", NO_ANSWER_RESPONSE
+
+    # Use direct answer if high confidence
+    logger.debug(f"Checking direct answer condition: top_sim={top_sim.item()}")
+    if top_sim.item() >= direct_answer_similarity:
+        logger.debug("Returning direct answer due to high confidence.")
+        return "final", clean_output(top_answer)
 
+    prompt = build_prompt(query, ranked)
+    logger.debug(f"Prompt: {prompt}")
+    return "generate", prompt
+
+def finalize_generation(response, ranked):
+    top_answer = ranked[0][1].metadata.get("answer", "").strip()
+    final = clean_output(response)
+    logger.debug(f"Generated response: {final}")
+    # Fallback to top answer if generated response is too short or empty
+    if not final or len(final.split()) < 5 and top_answer:
+        logger.debug("Generated response too short or empty, using top answer instead.")
+        return clean_output(top_answer)
+    return final
+
+def retrieve_ranked(query):
+    """
+    Retrieve and rerank documents for a query.
+    Returns the ranked [(similarity, doc)] list, or a reply string if nothing could be ranked.
+    """
     # Step 1: Retrieve documents
     try:
         results = retriever.get_relevant_documents(query)
@@ -99,70 +250,130 @@ def generate_response(query):
         logger.debug(f"Document metadata: {[doc.metadata for doc in results]}")
         if not results:
             logger.warning("No documents retrieved.")
-            return "I'm sorry, I couldn't find a specific answer to your question at the moment. However, Corvit Systems Islamabad offers a wide range of IT training programs, including CCNA, Cybersecurity, AWS, and many more. If you're looking to enhance your skills or start a career in IT, we’d be happy to help you explore the right course. Would you like to know more about our available training options?"
+            return NO_ANSWER_RESPONSE
     except Exception as e:
         logger.error(f"Retriever error: {e}")
         return "Error retrieving documents."
 
     # Step 2: Rerank using semantic similarity
     try:
-        query_emb = reranker_model.encode(query, convert_to_tensor=True)
         doc_texts = [doc.page_content for doc in results]
-        doc_embs = reranker_model.encode(doc_texts, convert_to_tensor=True)
-        sims = util.cos_sim(query_emb, doc_embs)[0]
-        logger.debug(f"Similarity scores: {sims.tolist()}")
-        ranked = sorted(zip(sims, results), key=lambda x: x[0], reverse=True)
-        top_sim, top_doc = ranked[0]
-        top_answer = top_doc.metadata.get("answer", "").strip()
-        logger.debug(f"Top similarity: {top_sim.item()}, Top answer: {top_answer}, Query: {query}")
+        embeddings, position = encode_distinct([query] + doc_texts)
+        doc_embs = embeddings[[position[text] for text in doc_texts]]
+        return rank_documents(embeddings[position[query]], doc_embs, results)
     except Exception as e:
         logger.error(f"Reranking error: {e}")
         return "Error during reranking."
 
-    # Step 3: Hard filter
-    if not top_answer or top_sim.item() < 0.5:
-        logger.warning(f"Top answer empty or similarity too low: {top_sim.item()}")
-        return "I'm sorry, I couldn't find a specific answer to your question at the moment. However, Corvit Systems Islamabad offers a wide range of IT training programs, including CCNA, Cybersecurity, AWS, and many more. If you're looking to enhance your skills or start a career in IT, we’d be happy to help you explore the right course. Would you like to know more about our available training options?"
+# === Main QA function ===
+def generate_response(query, direct_answer_similarity=DIRECT_ANSWER_SIMILARITY):
+    logger.debug(f"Processing query: {query}")
+    
+    screened = screen_query(query)
+    if screened:
+        return screened
 
-    # Step 4: Use direct answer if high confidence
-    logger.debug(f"Checking direct answer condition: top_sim={top_sim.item()}")
-    if top_sim.item() >= 0.64:
-        logger.debug("Returning direct answer due to high confidence.")
-        return clean_output(top_answer)
+    # Steps 1-2: Retrieve and rerank, shared with concurrent identical queries
+    ranked = coalesce("retrieval", normalize_query(query), retrieve_ranked, query)
+    if isinstance(ranked, str):
+        return ranked
+
+    # Steps 3-4: Hard filter and direct answer
+    action, payload = plan_answer(query, ranked, direct_answer_similarity)
+    if action == "final":
+        return payload
+    precomputed = precomputed_answer(ranked)
+    if precomputed:
+        return precomputed
 
     # Step 5: Generate answer with context
-    context = ""
-    for sim, doc in ranked[:2]:
-        context += f"Q: {doc.page_content}\nA: {doc.metadata.get('answer', '')}\n\n"
-    logger.debug(f"Context for generation: {context}")
+    try:
+        inputs = tokenizer(payload, return_tensors="pt", truncation=True, padding=True).to(model.device)
+        outputs = model.generate(**inputs, **GENERATION_KWARGS)
+        response = tokenizer.decode(outputs[0], skip_special_tokens=True)
+        return finalize_generation(response, ranked)
+    except Exception as e:
+        logger.error(f"Generation error: {e}")
+        return "🤖 Error generating response."
 
-    prompt = f"""You are a customer support assistant for Corvit Islamabad, specializing in IT training and certifications (e.g., CCNA, CCNP, cybersecurity, AWS, Azure). 
-Use only the provided context to answer questions about Corvit’s services, registration, or courses in Islamabad. For process-related queries (e.g., how to register), provide full steps. For irrelevant or unrelated questions (e.g., cooking, yoga, general knowledge), respond only with: "Sorry, I couldn’t find a relevant answer to your question. Corvit offers IT training like CCNA, cybersecurity, and AWS in Islamabad. Interested?" Do not guess or repeat question or generate answers outside Corvit’s scope. If no relevant answer is found in the context, use the same apology.
+# === Batch QA ===
+def retrieve_batch(queries, k=RETRIEVAL_K):
+    """
+    Retrieve the top-k documents for many queries with one embedding pass and one FAISS search.
+    """
+    vectorstore = retriever.vectorstore
+    vectors = np.array(embedding_model.embed_documents(list(queries)), dtype=np.float32)
+    if getattr(vectorstore, "_normalize_L2", False):
+        faiss.normalize_L2(vectors)
+    _, indices = vectorstore.index.search(vectors, k)
+    batch_results = []
+    for row in indices:
+        docs = []
+        for i in row:
+            if i == -1:
+                continue
+            docs.append(vectorstore.docstore.search(vectorstore.index_to_docstore_id[i]))
+        batch_results.append(docs)
+    return batch_results
 
-Context:
-{context}
+def generate_responses(queries, batch_size=8):
+    """
+    Answer a list of queries like generate_response, batching the embedding, retrieval,
+    reranking and generation work. Returns answers in input order.
+    """
+    answers = [None] * len(queries)
+    pending = []
+    for i, query in enumerate(queries):
+        answers[i] = screen_query(query)
+        if answers[i] is None:
+            pending.append(i)
+    if not pending:
+        return answers
 
-User Question: {query}
-Answer:"""
-    logger.debug(f"Prompt: {prompt}")
+    try:
+        batch_results = retrieve_batch([queries[i] for i in pending])
+    except Exception as e:
+        logger.error(f"Batch retriever error: {e}")
+        for i in pending:
+            answers[i] = "Error retrieving documents."
+        return answers
 
+    # Rerank: encode each distinct query and document text once, in a single pass
     try:
-        inputs = tokenizer(prompt, return_tensors="pt", truncation=True, padding=True).to(model.device)
-        outputs = model.generate(
-            **inputs,
-            max_new_tokens=300,
-            min_length=20,
-            num_beams=4,
-            no_repeat_ngram_size=2
+        embeddings, position = encode_distinct(
+            [queries[i] for i in pending] +
+            [doc.page_content for docs in batch_results for doc in docs]
         )
-        response = tokenizer.decode(outputs[0], skip_special_tokens=True)
-        final = clean_output(response)
-        logger.debug(f"Generated response: {final}")
-        # Fallback to top answer if generated response is too short or empty
-        if not final or len(final.split()) < 5 and top_answer:
-            logger.debug("Generated response too short or empty, using top answer instead.")
-            return clean_output(top_answer)
-        return final
     except Exception as e:
-        logger.error(f"Generation error: {e}")
-        return "🤖 Error generating response."
\ No newline at end of file
+        logger.error(f"Batch reranking error: {e}")
+        for i in pending:
+            answers[i] = "Error during reranking."
+        return answers
+
+    to_generate = []  # (answer index, prompt, ranked)
+    for i, results in zip(pending, batch_results):
+        if not results:
+            answers[i] = NO_ANSWER_RESPONSE
+            continue
+        doc_embs = embeddings[[position[doc.page_content] for doc in results]]
+        ranked = rank_documents(embeddings[position[queries[i]]], doc_embs, results)
+        action, payload = plan_answer(queries[i], ranked)
+        if action == "final":
+            answers[i] = payload
+        else:
+            answers[i] = precomputed_answer(ranked)
+            if answers[i] is None:
+                to_generate.append((i, payload, ranked))
+
+    for start in range(0, len(to_generate), batch_size):
+        chunk = to_generate[start:start + batch_size]
+        try:
+            inputs = tokenizer([prompt for _, prompt, _ in chunk], return_tensors="pt", truncation=True, padding=True).to(model.device)
+            outputs = model.generate(**inputs, **GENERATION_KWARGS)
+            for (i, _, ranked), output in zip(chunk, outputs):
+                answers[i] = finalize_generation(tokenizer.decode(output, skip_special_tokens=True), ranked)
+        except Exception as e:
+            logger.error(f"Batch generation error: {e}")
+            for i, _, _ in chunk:
+                answers[i] = "🤖 Error generating response."
+    return answers
@@ -0,0 +1,199 @@
+"""
+Precompute generated answers for frequent (top-1, top-2) document pairs.
+
+Queries whose best match falls between MIN_SIMILARITY and DIRECT_ANSWER_SIMILARITY are answered
+by flan-t5 from a prompt built on the top two Q/A pairs, which gives near-identical output for
+the same pair. This job generates those answers ahead of time and writes them, keyed by the
+document pair and the FAISS index version, to ANSWER_TABLE_PATH (data/answer_table.json). At
+runtime model_inference looks the pair up and only generates for pairs not in the table.
+
+Pairs come from:
+- the dataset itself: every question paired with each of its nearest neighbours, asked as the
+  question itself;
+- real queries (chat_logs/*.jsonl with --history, and/or JSONL files as read by batch_reply):
+  pairs that reached generation at least --min-count times, asked as their most common query.
+
+    python precompute_answers.py --history queries.jsonl
+"""
+
+import argparse
+import glob
+import json
+import logging
+import os
+import sys
+import time
+from collections import Counter
+
+import model_inference as mi
+from batch_reply import read_queries, prepare
+from utils import history_store
+
+logger = logging.getLogger(__name__)
+
+# Nearest neighbours paired with each dataset question
+DATASET_NEIGHBOURS = 3
+MIN_QUERY_COUNT = 2
+RETRIEVAL_CHUNK_SIZE = 256
+GENERATION_BATCH_SIZE = 8
+
+
+def dataset_documents():
+    vectorstore = mi.retriever.vectorstore
+    return [vectorstore.docstore.search(doc_id) for doc_id in vectorstore.index_to_docstore_id.values()]
+
+
+def dataset_pairs(neighbours=DATASET_NEIGHBOURS, chunk_size=RETRIEVAL_CHUNK_SIZE):
+    """
+    Return {pair key: candidate} for every dataset question and its nearest neighbours.
+    """
+    candidates = {}
+    documents = dataset_documents()
+    for start in range(0, len(documents), chunk_size):
+        chunk = documents[start:start + chunk_size]
+        for doc, results in zip(chunk, mi.retrieve_batch([doc.page_content for doc in chunk], k=neighbours + 1)):
+            others = [other for other in results if other.page_content != doc.page_content][:neighbours]
+            for other in others:
+                ranked = [(None, doc), (None, other)]
+                candidates[mi.pair_key(ranked)] = {"ranked": ranked, "count": 0, "queries": Counter([doc.page_content])}
+    return candidates
+
+
+def history_queries(history_dir=history_store.HISTORY_DIR):
+    """
+    Yield the English text of every user message in the chat logs.
+    """
+    for path in sorted(glob.glob(os.path.join(history_dir, "*.jsonl"))):
+        with open(path, "r", encoding="utf-8", errors="replace") as file:
+            for line in file:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if record.get("op") == "message" and record.get("role") == "user":
+                    text = record.get("query") or record.get("text")
+                    if text:
+                        yield text
+
+
+def observed_pairs(queries, chunk_size=RETRIEVAL_CHUNK_SIZE):
+    """
+    Rank each query like generate_response and count the document pairs of those that reach
+    generation. Returns {pair key: candidate}.
+    """
+    candidates = {}
+    queries = [query for query in queries if mi.screen_query(query) is None]
+    for start in range(0, len(queries), chunk_size):
+        chunk = queries[start:start + chunk_size]
+        batch_results = mi.retrieve_batch(chunk)
+        embeddings, position = mi.encode_distinct(chunk + [doc.page_content for docs in batch_results for doc in docs])
+        for query, results in zip(chunk, batch_results):
+            if len(results) < 2:
+                continue
+            doc_embs = embeddings[[position[doc.page_content] for doc in results]]
+            ranked = mi.rank_documents(embeddings[position[query]], doc_embs, results)
+            action, _ = mi.plan_answer(query, ranked)
+            if action != "generate":
+                continue
+            key = mi.pair_key(ranked)
+            candidate = candidates.setdefault(key, {"ranked": ranked[:2], "count": 0, "queries": Counter()})
+            candidate["count"] += 1
+            candidate["queries"][query] += 1
+    return candidates
+
+
+def load_existing(path, index_version):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            table = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    return table.get("answers", {}) if table.get("index_version") == index_version else {}
+
+
+def generate_answers(candidates, batch_size=GENERATION_BATCH_SIZE):
+    """
+    Generate an answer for each (key, candidate), in batches. Returns {key: answer}.
+    """
+    answers = {}
+    items = list(candidates)
+    for start in range(0, len(items), batch_size):
+        chunk = items[start:start + batch_size]
+        prompts = [mi.build_prompt(candidate["queries"].most_common(1)[0][0], candidate["ranked"]) for _, candidate in chunk]
+        inputs = mi.tokenizer(prompts, return_tensors="pt", truncation=True, padding=True).to(mi.model.device)
+        outputs = mi.model.generate(**inputs, **mi.GENERATION_KWARGS)
+        for (key, candidate), output in zip(chunk, outputs):
+            answers[key] = mi.finalize_generation(mi.tokenizer.decode(output, skip_special_tokens=True), candidate["ranked"])
+        logger.info(f"Generated {min(start + batch_size, len(items))} of {len(items)} answers")
+    return answers
+
+
+def write_table(path, index_version, entries):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    table = {"index_version": index_version, "created": time.strftime("%Y-%m-%dT%H:%M:%S"), "answers": entries}
+    tmp_path = f"{path}.tmp.{os.getpid()}"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(table, f, ensure_ascii=False, indent=1)
+    os.replace(tmp_path, path)
+
+
+def build(query_streams=(), history=False, output=mi.ANSWER_TABLE_PATH, neighbours=DATASET_NEIGHBOURS,
+          min_count=MIN_QUERY_COUNT, max_pairs=None, force=False, batch_size=GENERATION_BATCH_SIZE):
+    candidates = dataset_pairs(neighbours) if neighbours > 0 else {}
+    logger.info(f"{len(candidates)} dataset pairs")
+
+    queries = [prepare(record)[1] for stream in query_streams for record in read_queries(stream)]
+    if history:
+        queries += list(history_queries())
+    observed = {key: candidate for key, candidate in observed_pairs(queries).items() if candidate["count"] >= min_count}
+    logger.info(f"{len(queries)} queries, {len(observed)} pairs seen at least {min_count} times")
+    candidates.update(observed)
+
+    # Most frequently seen pairs first, so --max-pairs keeps the ones that save the most generation
+    ordered = sorted(candidates.items(), key=lambda item: item[1]["count"], reverse=True)
+    if max_pairs:
+        ordered = ordered[:max_pairs]
+
+    existing = {} if force else load_existing(output, mi.INDEX_VERSION)
+    missing = [(key, candidate) for key, candidate in ordered if key not in existing]
+    logger.info(f"{len(ordered) - len(missing)} answers reused, {len(missing)} to generate")
+    generated = generate_answers(missing, batch_size)
+
+    entries = {}
+    for key, candidate in ordered:
+        entry = existing.get(key) or {"answer": generated[key]}
+        entry.update(
+            top1=candidate["ranked"][0][1].page_content,
+            top2=candidate["ranked"][1][1].page_content,
+            query=candidate["queries"].most_common(1)[0][0],
+            count=candidate["count"],
+        )
+        entries[key] = entry
+    write_table(output, mi.INDEX_VERSION, entries)
+    logger.info(f"Wrote {len(entries)} answers for index {mi.INDEX_VERSION} to {output}")
+    return entries
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Precompute generated answers for frequent top-2 document pairs.")
+    parser.add_argument("queries", nargs="*", help="JSONL files of queries (as for batch_reply.py), or - for stdin")
+    parser.add_argument("--history", action="store_true", help="also use user messages from chat_logs/")
+    parser.add_argument("-o", "--output", default=mi.ANSWER_TABLE_PATH)
+    parser.add_argument("--neighbours", type=int, default=DATASET_NEIGHBOURS, help="neighbours paired with each dataset question (0 to skip)")
+    parser.add_argument("--min-count", type=int, default=MIN_QUERY_COUNT, help="times a pair must be seen in the queries")
+    parser.add_argument("--max-pairs", type=int, default=None)
+    parser.add_argument("--force", action="store_true", help="regenerate answers already in the table")
+    parser.add_argument("--generation-batch-size", type=int, default=GENERATION_BATCH_SIZE)
+    args = parser.parse_args()
+
+    streams = [sys.stdin if path == "-" else open(path, "r", encoding="utf-8") for path in args.queries]
+    try:
+        build(streams, args.history, args.output, args.neighbours, args.min_count, args.max_pairs, args.force, args.generation_batch_size)
+    finally:
+        for stream in streams:
+            if stream is not sys.stdin:
+                stream.close()
+
+
+if __name__ == "__main__":
+    main()
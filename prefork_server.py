@@ -0,0 +1,211 @@
+"""
+Pre-forking API server: loads every model and index once, then forks worker processes.
+
+The parent imports api_server and model_inference (flan-t5, the mpnet embedder/reranker,
+MiniLM and the FAISS indexes), warms the lazily built indexes, and calls gc.freeze() so the garbage
+collector never writes to the inherited objects. Workers forked afterwards share those pages
+copy-on-write, so each extra worker costs little memory and concurrency scales with cores.
+
+All workers accept connections from one listening socket. Each worker stamps a shared
+heartbeat slot from its event loop while none of its requests has been running longer than
+PREFORK_REQUEST_TIMEOUT; the parent restarts workers that exit or stop beating, so a worker
+whose request threads are stuck is replaced as well as one whose loop is.
+
+The parent runs torch and the tokenizers single-threaded while preloading: thread pools
+started before fork() do not exist in the children and can deadlock them.
+
+    python prefork_server.py --port 8000 --workers 4
+"""
+
+import argparse
+import asyncio
+import gc
+import logging
+import os
+import signal
+import socket
+import time
+from multiprocessing import RawArray
+
+# Collections during model loading would walk (and dirty) every object; freeze them instead
+gc.disable()
+# Must be set before tokenizers is imported; its Rust thread pool is not fork-safe
+os.environ.setdefault("TOKENIZERS_PARALLELISM", "false")
+
+from api_server import ApiServer, API_HOST, API_PORT, API_MAX_PENDING
+from inference_pool import INFERENCE_WORKERS
+from utils.event_utils import load_events, get_event_index
+from utils.schedule_utils import load_schedule, get_schedule_index
+
+logger = logging.getLogger(__name__)
+
+PREFORK_WORKERS = int(os.environ.get("PREFORK_WORKERS", str(os.cpu_count() or 1)))
+# Request threads per worker process
+PREFORK_THREADS = int(os.environ.get("PREFORK_THREADS", "2"))
+HEARTBEAT_INTERVAL = 2.0
+# A worker whose event loop has not beaten for this long is killed and replaced
+HEARTBEAT_TIMEOUT = float(os.environ.get("PREFORK_HEARTBEAT_TIMEOUT", "30"))
+# A worker stops beating while a request has been running longer than this (seconds); keep it
+# above INFERENCE_TIMEOUT so slow but healthy answers are not killed
+REQUEST_TIMEOUT = float(os.environ.get("PREFORK_REQUEST_TIMEOUT", "300"))
+# Minimum seconds between restarts of the same worker slot (avoids crash loops)
+RESTART_BACKOFF = 5.0
+
+
+def preload():
+    """
+    Load the models and build the lazily created indexes in the parent so workers inherit them.
+    """
+    try:
+        import torch
+        # Encoding the embedding caches here must not start an OpenMP pool in the parent
+        torch.set_num_threads(1)
+    except ImportError:
+        pass
+    if INFERENCE_WORKERS == 0:
+        # Otherwise each worker's inference pool loads the models in its own processes
+        import model_inference
+    get_event_index(load_events())
+    get_schedule_index(load_schedule())
+    try:
+        from utils.recommendation_utils import EMBEDDER_MODEL, encode_texts
+        from utils.course_catalog import get_recommender
+        get_recommender(EMBEDDER_MODEL, encode_texts)
+    except Exception as e:
+        logger.warning(f"Course recommender not preloaded: {e}")
+    gc.collect()
+    # Move everything allocated so far to the permanent generation: collections in the
+    # workers skip it, so they do not touch (and copy) the shared pages
+    gc.freeze()
+
+
+def run_worker(slot, sock, heartbeats, threads):
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    gc.enable()
+    try:
+        import torch
+        # Split the cores between workers instead of every worker using all of them
+        torch.set_num_threads(max(1, (os.cpu_count() or 1) // max(1, len(heartbeats))))
+    except ImportError:
+        pass
+
+    server = ApiServer(workers=threads, max_pending=API_MAX_PENDING)
+
+    async def beat():
+        while True:
+            age = server.oldest_request_age()
+            if age < REQUEST_TIMEOUT:
+                heartbeats[slot] = time.time()
+            else:
+                logger.error(f"Worker {slot}: a request has been running for {age:.0f}s, not beating")
+            await asyncio.sleep(HEARTBEAT_INTERVAL)
+
+    async def main():
+        asyncio.get_running_loop().create_task(beat())
+        await server.serve(sock=sock)
+
+    heartbeats[slot] = time.time()
+    try:
+        asyncio.run(main())
+    finally:
+        os._exit(0)
+
+
+class Supervisor:
+    """
+    Forks the workers and keeps them running.
+    """
+
+    def __init__(self, sock, workers=PREFORK_WORKERS, threads=PREFORK_THREADS):
+        self.sock = sock
+        self.threads = threads
+        self.heartbeats = RawArray("d", workers)
+        self.pids = {}  # slot -> pid
+        self.started = [0.0] * workers
+        self.stopping = False
+
+    def spawn(self, slot):
+        pid = os.fork()
+        if pid == 0:
+            run_worker(slot, self.sock, self.heartbeats, self.threads)
+        self.pids[slot] = pid
+        self.started[slot] = time.monotonic()
+        self.heartbeats[slot] = time.time()
+        logger.info(f"Started worker {slot} (pid {pid})")
+
+    def reap(self):
+        while self.pids:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            for slot, worker_pid in list(self.pids.items()):
+                if worker_pid == pid:
+                    del self.pids[slot]
+                    logger.warning(f"Worker {slot} (pid {pid}) exited with status {status}")
+
+    def check_heartbeats(self):
+        now = time.time()
+        for slot, pid in list(self.pids.items()):
+            if now - self.heartbeats[slot] > HEARTBEAT_TIMEOUT:
+                logger.error(f"Worker {slot} (pid {pid}) missed its heartbeat, restarting it")
+                try:
+                    os.kill(pid, signal.SIGKILL)
+                except ProcessLookupError:
+                    pass
+
+    def stop(self, signum=None, frame=None):
+        self.stopping = True
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        for slot in range(len(self.heartbeats)):
+            self.spawn(slot)
+        while not self.stopping:
+            time.sleep(1.0)
+            self.reap()
+            self.check_heartbeats()
+            for slot in range(len(self.heartbeats)):
+                if slot not in self.pids and not self.stopping:
+                    if time.monotonic() - self.started[slot] >= RESTART_BACKOFF:
+                        self.spawn(slot)
+        logger.info("Stopping workers")
+        for pid in self.pids.values():
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        deadline = time.monotonic() + 10
+        while self.pids and time.monotonic() < deadline:
+            self.reap()
+            time.sleep(0.1)
+        for pid in self.pids.values():
+            try:
+                os.kill(pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the Corvit chatbot API from pre-forked workers sharing one copy of the models.")
+    parser.add_argument("--host", default=API_HOST)
+    parser.add_argument("--port", type=int, default=API_PORT)
+    parser.add_argument("--workers", type=int, default=PREFORK_WORKERS, help="worker processes")
+    parser.add_argument("--threads", type=int, default=PREFORK_THREADS, help="request threads per worker")
+    args = parser.parse_args()
+    if not hasattr(os, "fork"):
+        raise SystemExit("prefork_server needs os.fork(); use api_server.py on this platform.")
+
+    preload()
+    sock = socket.create_server((args.host, args.port), reuse_port=False, backlog=1024)
+    sock.setblocking(False)
+    logger.info(f"Listening on {args.host}:{args.port} with {args.workers} workers")
+    Supervisor(sock, workers=args.workers, threads=args.threads).run()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,5 @@
 from textblob import TextBlob
-from deep_translator import GoogleTranslator
+import translation_service
 from langdetect import detect
 import re
 
@@ -21,16 +21,11 @@ def detect_language(text):
         return "english"
 
 
-# Translate Urdu → English (for model input)
+# Translate Urdu → English (for model input). Bounded by translation_service's deadline;
+# falls back to a cached/offline translation or the text itself
 def translate_urdu_to_english(text):
-    try:
-        return GoogleTranslator(source='auto', target='en').translate(text)
-    except:
-        return text
+    return translation_service.translate(text, 'auto', 'en')
 
 # Translate English → Urdu (for response)
 def translate_to_urdu(text):
-    try:
-        return GoogleTranslator(source='en', target='ur').translate(text)
-    except:
-        return text
+    return translation_service.translate(text, 'en', 'ur')
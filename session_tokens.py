@@ -0,0 +1,123 @@
+"""
+Signed, expiring session tokens.
+
+A token is issued at login and carries the user's email, name, expiry and a random id,
+signed with HMAC-SHA256. Checking a token is an in-memory HMAC comparison, so reconnects
+and new tabs skip the database and bcrypt. Revoked token ids are stored in users.db and
+cached in memory, refreshed every REVOCATION_REFRESH_SECONDS so revocations made by other
+processes are picked up.
+
+The signing key comes from SESSION_TOKEN_SECRET, or is generated once and kept in users.db.
+"""
+
+import os
+import hmac
+import json
+import time
+import base64
+import hashlib
+import secrets
+import logging
+import threading
+import auth
+
+SESSION_TOKEN_SECRET = os.environ.get("SESSION_TOKEN_SECRET", "")
+SESSION_TTL_HOURS = float(os.environ.get("SESSION_TTL_HOURS", "12"))
+REVOCATION_REFRESH_SECONDS = 30
+
+_state = {"db": None, "key": None, "revoked": set(), "refreshed": 0.0}
+_lock = threading.Lock()
+
+def _b64encode(data):
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode("ascii")
+
+def _b64decode(text):
+    return base64.urlsafe_b64decode(text + "=" * (-len(text) % 4))
+
+def _sign(key, payload):
+    return hmac.new(key, payload.encode("ascii"), hashlib.sha256).digest()
+
+def _init():
+    """
+    Create the token tables and load the signing key, once per users.db.
+    """
+    if _state["db"] == auth.USERS_DB:
+        return
+    with auth.get_pool().connection() as conn:
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS revoked_tokens (
+                jti TEXT PRIMARY KEY,
+                expires INTEGER NOT NULL
+            )
+        """)
+        conn.execute("CREATE TABLE IF NOT EXISTS settings (name TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        if SESSION_TOKEN_SECRET:
+            key = SESSION_TOKEN_SECRET.encode("utf-8")
+        else:
+            # INSERT OR IGNORE so concurrent first starts agree on one key
+            conn.execute(
+                "INSERT OR IGNORE INTO settings (name, value) VALUES ('session_token_key', ?)",
+                (secrets.token_hex(32),),
+            )
+            key = bytes.fromhex(conn.execute("SELECT value FROM settings WHERE name = 'session_token_key'").fetchone()[0])
+    _state.update(db=auth.USERS_DB, key=key, revoked=set(), refreshed=0.0)
+
+def _revoked_ids():
+    now = time.monotonic()
+    if now - _state["refreshed"] >= REVOCATION_REFRESH_SECONDS:
+        with auth.get_pool().connection() as conn:
+            rows = conn.execute("SELECT jti FROM revoked_tokens WHERE expires > ?", (int(time.time()),)).fetchall()
+        _state["revoked"] = {row[0] for row in rows}
+        _state["refreshed"] = now
+    return _state["revoked"]
+
+def issue_token(username, name, ttl_hours=SESSION_TTL_HOURS):
+    """
+    Return a signed token for a user who has just logged in.
+    """
+    with _lock:
+        _init()
+        key = _state["key"]
+    claims = {"sub": username, "name": name, "exp": int(time.time() + ttl_hours * 3600), "jti": secrets.token_urlsafe(12)}
+    payload = _b64encode(json.dumps(claims, separators=(",", ":")).encode("utf-8"))
+    return f"{payload}.{_b64encode(_sign(key, payload))}"
+
+def verify_token(token):
+    """
+    Return the token's claims ({"sub", "name", "exp", "jti"}) if it is authentic, unexpired and
+    not revoked, otherwise None.
+    """
+    if not token or not isinstance(token, str) or token.count(".") != 1:
+        return None
+    payload, signature = token.split(".")
+    try:
+        with _lock:
+            _init()
+            key = _state["key"]
+            revoked = _revoked_ids()
+        if not hmac.compare_digest(_sign(key, payload), _b64decode(signature)):
+            return None
+        claims = json.loads(_b64decode(payload))
+    except Exception as e:
+        logging.warning(f"Rejected session token: {str(e)}")
+        return None
+    if not isinstance(claims, dict) or claims.get("exp", 0) <= time.time() or claims.get("jti") in revoked:
+        return None
+    return claims
+
+def revoke_token(token):
+    """
+    Revoke a token (on logout). Returns True if the token was valid.
+    """
+    claims = verify_token(token)
+    if claims is None:
+        return False
+    with _lock:
+        with auth.get_pool().connection() as conn:
+            conn.execute("DELETE FROM revoked_tokens WHERE expires <= ?", (int(time.time()),))
+            conn.execute(
+                "INSERT OR IGNORE INTO revoked_tokens (jti, expires) VALUES (?, ?)",
+                (claims["jti"], claims["exp"]),
+            )
+        _state["revoked"].add(claims["jti"])
+    return True
@@ -0,0 +1,321 @@
+"""
+Resilient access to the remote translator.
+
+Every translation goes through translate(), which bounds how long an Urdu request can wait on
+the upstream service:
+
+- each attempt runs on a worker thread and is abandoned after TRANSLATION_TIMEOUT seconds
+  (the translator client has no timeout of its own);
+- failed attempts are retried up to TRANSLATION_RETRIES times with jittered exponential
+  backoff, all within TRANSLATION_DEADLINE seconds per call;
+- a circuit breaker opens after BREAKER_FAILURES consecutive failures and sends calls
+  straight to the fallback for BREAKER_RESET_SECONDS, then lets a single probe call through.
+
+The fallback is, in order: an earlier translation of the same text, a local MarianMT model when
+TRANSLATION_OFFLINE_MODELS=1, and finally the untranslated text.
+
+TRANSLATOR_BACKEND=fake swaps the Google translator for a local fake with configurable
+latency and failure rate (FAKE_TRANSLATOR_LATENCY, FAKE_TRANSLATOR_FAILURE_RATE), for tests:
+
+    python translation_service.py --latency 10 --requests 20
+"""
+
+import os
+import time
+import random
+import logging
+import argparse
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+
+logger = logging.getLogger(__name__)
+
+TRANSLATOR_BACKEND = os.environ.get("TRANSLATOR_BACKEND", "google")
+# Seconds one attempt may take, and all attempts of one call together
+TRANSLATION_TIMEOUT = float(os.environ.get("TRANSLATION_TIMEOUT", "3"))
+TRANSLATION_DEADLINE = float(os.environ.get("TRANSLATION_DEADLINE", "6"))
+TRANSLATION_RETRIES = int(os.environ.get("TRANSLATION_RETRIES", "2"))
+RETRY_BACKOFF = 0.2
+# Threads running upstream calls; a hung call holds its thread until the socket gives up
+TRANSLATION_WORKERS = int(os.environ.get("TRANSLATION_WORKERS", "8"))
+BREAKER_FAILURES = int(os.environ.get("TRANSLATION_BREAKER_FAILURES", "5"))
+BREAKER_RESET_SECONDS = float(os.environ.get("TRANSLATION_BREAKER_RESET", "30"))
+TRANSLATION_CACHE_SIZE = 2048
+TRANSLATION_OFFLINE_MODELS = os.environ.get("TRANSLATION_OFFLINE_MODELS", "0") == "1"
+OFFLINE_MODELS = {"en": "Helsinki-NLP/opus-mt-ur-en", "ur": "Helsinki-NLP/opus-mt-en-ur"}
+# Latency samples kept for the percentiles in metrics()
+LATENCY_SAMPLES = 500
+
+
+# === Backends ===
+class GoogleBackend:
+    def translate(self, text, source, target):
+        from deep_translator import GoogleTranslator
+        return GoogleTranslator(source=source, target=target).translate(text)
+
+
+class FakeBackend:
+    """
+    Local stand-in for the remote translator: waits `latency` seconds, fails with
+    probability `failure_rate`, and otherwise returns the text tagged with the target language.
+    """
+
+    def __init__(self, latency=None, failure_rate=None):
+        self.latency = float(os.environ.get("FAKE_TRANSLATOR_LATENCY", "0")) if latency is None else latency
+        self.failure_rate = float(os.environ.get("FAKE_TRANSLATOR_FAILURE_RATE", "0")) if failure_rate is None else failure_rate
+        self.calls = 0
+
+    def translate(self, text, source, target):
+        self.calls += 1
+        time.sleep(self.latency)
+        if random.random() < self.failure_rate:
+            raise ConnectionError("fake translator failure")
+        return f"[{target}] {text}"
+
+
+# === Circuit breaker ===
+class CircuitBreaker:
+    """
+    closed -> open after `failures` consecutive failures; open -> half_open after `reset_seconds`,
+    when one probe call is allowed; the probe closes the breaker or opens it again.
+    """
+
+    def __init__(self, failures=BREAKER_FAILURES, reset_seconds=BREAKER_RESET_SECONDS):
+        self.failures = failures
+        self.reset_seconds = reset_seconds
+        self.lock = threading.Lock()
+        self.state = "closed"
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.probing = False
+        self.trips = 0
+
+    def allow(self):
+        with self.lock:
+            if self.state == "open" and time.monotonic() - self.opened_at >= self.reset_seconds:
+                self.state = "half_open"
+                self.probing = False
+            if self.state == "closed":
+                return True
+            if self.state == "half_open" and not self.probing:
+                self.probing = True
+                return True
+            return False
+
+    def record_success(self):
+        with self.lock:
+            self.state = "closed"
+            self.consecutive_failures = 0
+            self.probing = False
+
+    def record_failure(self):
+        with self.lock:
+            self.consecutive_failures += 1
+            if self.state == "half_open" or self.consecutive_failures >= self.failures:
+                if self.state != "open":
+                    self.trips += 1
+                    logger.warning(f"Translation circuit breaker opened after {self.consecutive_failures} failures")
+                self.state = "open"
+                self.opened_at = time.monotonic()
+                self.probing = False
+
+
+# === Translation service ===
+def _percentile(samples, fraction):
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    return round(ordered[min(len(ordered) - 1, int(fraction * len(ordered)))] * 1000, 1)
+
+
+class TranslationService:
+    def __init__(self, backend=None):
+        self.backend = backend or (FakeBackend() if TRANSLATOR_BACKEND == "fake" else GoogleBackend())
+        self.breaker = CircuitBreaker()
+        self.executor = ThreadPoolExecutor(max_workers=TRANSLATION_WORKERS, thread_name_prefix="translate")
+        self.lock = threading.Lock()
+        self.cache = OrderedDict()  # (source, target, text) -> translation
+        self.offline = {}  # target -> transformers pipeline
+        self.offline_lock = threading.Lock()  # guards loading only, never held while translating
+        self.latencies = deque(maxlen=LATENCY_SAMPLES)
+        self.upstream_latencies = deque(maxlen=LATENCY_SAMPLES)
+        self.stats = {
+            "calls": 0, "upstream_ok": 0, "upstream_errors": 0, "timeouts": 0, "retries": 0,
+            "short_circuited": 0, "cache_fallbacks": 0, "offline_fallbacks": 0, "untranslated": 0,
+        }
+        if TRANSLATION_OFFLINE_MODELS:
+            # Load at startup so the first fallback during an outage does not wait on a download
+            threading.Thread(target=self._load_offline_models, name="translate-offline", daemon=True).start()
+
+    def _count(self, name):
+        with self.lock:
+            self.stats[name] += 1
+
+    def _attempt(self, text, source, target, timeout):
+        started = time.monotonic()
+        future = self.executor.submit(self.backend.translate, text, source, target)
+        try:
+            result = future.result(timeout)
+        except TimeoutError:
+            # Drop the attempt if it is still queued behind hung calls; one already running
+            # cannot be interrupted and finishes (or fails) on its thread unobserved
+            future.cancel()
+            self._count("timeouts")
+            raise
+        except Exception:
+            self._count("upstream_errors")
+            raise
+        self._count("upstream_ok")
+        with self.lock:
+            self.upstream_latencies.append(time.monotonic() - started)
+        return result
+
+    def _upstream(self, text, source, target):
+        deadline = time.monotonic() + TRANSLATION_DEADLINE
+        for attempt in range(TRANSLATION_RETRIES + 1):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None
+            if not self.breaker.allow():
+                self._count("short_circuited")
+                return None
+            try:
+                result = self._attempt(text, source, target, min(TRANSLATION_TIMEOUT, remaining))
+            except Exception as e:
+                self.breaker.record_failure()
+                logger.warning(f"Translation attempt {attempt + 1} failed: {type(e).__name__}: {e}")
+                if attempt == TRANSLATION_RETRIES:
+                    return None
+                # Full jitter: concurrent retries do not hit the upstream in lockstep
+                backoff = random.uniform(0, RETRY_BACKOFF * 2 ** attempt)
+                if time.monotonic() + backoff >= deadline:
+                    return None
+                self._count("retries")
+                time.sleep(backoff)
+                continue
+            self.breaker.record_success()
+            return result
+        return None
+
+    def _load_offline_models(self):
+        with self.offline_lock:
+            for target, model in OFFLINE_MODELS.items():
+                if target in self.offline:
+                    continue
+                try:
+                    from transformers import pipeline
+                    self.offline[target] = pipeline("translation", model=model)
+                    logger.info(f"Loaded offline translation model {model}")
+                except Exception as e:
+                    logger.error(f"Could not load offline translation model {model}: {e}")
+
+    def _offline(self, text, target):
+        # None while the models are still loading (or failed to load)
+        translator = self.offline.get(target)
+        if translator is None:
+            return None
+        try:
+            return translator(text, max_length=512)[0]["translation_text"]
+        except Exception as e:
+            logger.error(f"Offline translation failed: {e}")
+            return None
+
+    def translate(self, text, source, target):
+        """
+        Translate text, returning a fallback (possibly the text itself) instead of raising.
+        """
+        if not text or not text.strip():
+            return text
+        started = time.monotonic()
+        key = (source, target, text)
+        self._count("calls")
+        try:
+            result = self._upstream(text, source, target)
+            if result:
+                with self.lock:
+                    self.cache[key] = result
+                    self.cache.move_to_end(key)
+                    while len(self.cache) > TRANSLATION_CACHE_SIZE:
+                        self.cache.popitem(last=False)
+                return result
+            with self.lock:
+                result = self.cache.get(key)
+            if result:
+                self._count("cache_fallbacks")
+                return result
+            result = self._offline(text, target)
+            if result:
+                self._count("offline_fallbacks")
+                return result
+            self._count("untranslated")
+            return text
+        finally:
+            with self.lock:
+                self.latencies.append(time.monotonic() - started)
+
+    def metrics(self):
+        with self.lock:
+            latencies, upstream = list(self.latencies), list(self.upstream_latencies)
+            stats = dict(self.stats)
+        return dict(
+            stats,
+            breaker=self.breaker.state,
+            breaker_trips=self.breaker.trips,
+            latency_p50_ms=_percentile(latencies, 0.5),
+            latency_p95_ms=_percentile(latencies, 0.95),
+            upstream_p50_ms=_percentile(upstream, 0.5),
+            upstream_p95_ms=_percentile(upstream, 0.95),
+        )
+
+
+_service = None
+_service_lock = threading.Lock()
+
+
+def get_service():
+    global _service
+    with _service_lock:
+        if _service is None:
+            _service = TranslationService()
+        return _service
+
+
+def set_backend(backend):
+    """
+    Replace the translator backend (e.g. with a FakeBackend in tests); resets breaker and metrics.
+    """
+    global _service
+    with _service_lock:
+        _service = TranslationService(backend)
+        return _service
+
+
+def translate(text, source, target):
+    return get_service().translate(text, source, target)
+
+
+def metrics():
+    return _service.metrics() if _service else {}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Exercise the translation fallbacks against a fake, degraded translator.")
+    parser.add_argument("--latency", type=float, default=10.0, help="seconds each fake upstream call takes")
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    parser.add_argument("--requests", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, default=5)
+    args = parser.parse_args()
+
+    service = set_backend(FakeBackend(latency=args.latency, failure_rate=args.failure_rate))
+    started = time.monotonic()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        list(pool.map(lambda i: service.translate(f"message {i % 5}", "auto", "en"), range(args.requests)))
+    print(f"{args.requests} translations in {time.monotonic() - started:.1f}s")
+    for name, value in service.metrics().items():
+        print(f"  {name}: {value}")
+    os._exit(0)  # do not wait for abandoned fake calls
+
+
+if __name__ == "__main__":
+    main()
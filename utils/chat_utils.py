@@ -0,0 +1,156 @@
+"""
+Chat repository shared by the Streamlit app and chatbot_reply.
+
+Both read and write the same append-only history log (see history_store). Each user's chats
+are kept in memory together with a snapshot of what has already been persisted, so saving
+only writes the difference (new chats, new messages, edited or deleted chats) in one append.
+Chats are {"id", "title", "messages"} dicts and are tracked by id, never by title.
+"""
+
+import logging
+import threading
+from utils import history_store
+
+# Configure logging
+logging.basicConfig(filename='chatbot_errors.log', level=logging.DEBUG)
+
+_lock = threading.RLock()
+_cache = {}  # username -> {"key": log file stat, "chats": [...], "persisted": {chat id: [texts]}}
+_message_listeners = []
+
+def _on_write(username, version_before, version_after):
+    # Our own writes (possibly flushed later by the write-behind thread) keep the cache valid.
+    # Runs on the writer thread, so it must not take _lock.
+    entry = _cache.get(username)
+    if entry is not None and entry["key"] == version_before:
+        entry["key"] = version_after
+
+history_store.add_write_listener(_on_write)
+
+def add_message_listener(listener):
+    """
+    Register listener(username, session_id, text), called for every user message persisted.
+    """
+    _message_listeners.append(listener)
+
+def _notify(username, new_messages):
+    for session_id, msg in new_messages:
+        if msg.get("role") != "user":
+            continue
+        for listener in _message_listeners:
+            try:
+                listener(username, session_id, msg.get("query") or msg.get("text", ""))
+            except Exception as e:
+                logging.error(f"Message listener failed for {username}: {str(e)}", exc_info=True)
+
+def _snapshot(chats):
+    return {chat["id"]: [msg.get("text", "") for msg in chat["messages"]] for chat in chats}
+
+def _load_entry(username):
+    """
+    Return the cached entry for a user, reloading it if the log changed on disk.
+    """
+    history_store.migrate_legacy(username)
+    key = history_store.log_version(username)
+    entry = _cache.get(username)
+    if entry is None or entry["key"] != key:
+        # Newest chat first, as shown in the sidebar
+        chats = list(reversed(history_store.load_sessions(username)))
+        entry = {"key": key, "chats": chats, "persisted": _snapshot(chats)}
+        _cache[username] = entry
+        logging.debug(f"Loaded {len(chats)} chats for {username}")
+    return entry
+
+def load_user_chats(username):
+    """
+    Return the user's chats, newest first, as {"id", "title", "messages"} dicts.
+    The list is the in-memory copy: mutate it and call save_user_chats to persist. A chat
+    added without an id is given one when it is saved.
+    """
+    if not username:
+        return []
+    with _lock:
+        return _load_entry(username)["chats"]
+
+def save_user_chats(username, chats):
+    """
+    Persist changes made to the user's chats since they were last loaded or saved.
+    Only the difference is appended to the log, in a single write.
+    """
+    if not username:
+        return
+    with _lock:
+        # Diff against what this process last persisted, even if another process has written
+        # since: the records are appends, so their changes are kept, and ours are applied on top
+        entry = _cache.get(username) or _load_entry(username)
+        persisted = entry["persisted"]
+        records = []
+        new_messages = []
+        ids = set()
+        # Oldest first, so replaying the log keeps the sidebar order
+        for chat in reversed(chats):
+            session_id = chat.setdefault("id", history_store.new_session_id())
+            ids.add(session_id)
+            texts = [msg.get("text", "") for msg in chat["messages"]]
+            old_texts = persisted.get(session_id)
+            if old_texts is None:
+                records.append(history_store.session_record(session_id, chat["title"]))
+                old_texts = []
+            for index, text in enumerate(texts[:len(old_texts)]):
+                if text != old_texts[index]:
+                    records.append({"op": "edit", "session": session_id, "index": index, "text": text, "ts": history_store.now_ts()})
+            for msg in chat["messages"][len(old_texts):]:
+                records.append(history_store.message_record(session_id, msg.get("role"), msg.get("text", "")))
+                new_messages.append((session_id, msg))
+        for session_id in persisted:
+            if session_id not in ids:
+                records.append({"op": "delete", "session": session_id, "ts": history_store.now_ts()})
+
+        if records:
+            history_store.append_records(username, records)
+            logging.debug(f"Saved {len(records)} chat records for {username}")
+        entry["chats"] = chats
+        entry["persisted"] = _snapshot(chats)
+    _notify(username, new_messages)
+
+def delete_chat(username, session_id):
+    """
+    Delete a chat by id.
+    """
+    if not username:
+        return
+    with _lock:
+        entry = _load_entry(username)
+        chats = [chat for chat in entry["chats"] if chat["id"] != session_id]
+        entry["chats"][:] = chats
+        save_user_chats(username, entry["chats"])
+
+def append_messages(username, session_id, messages, title=None):
+    """
+    Append messages ({"role", "text", optional "query"}) to a chat in one write. Pass title to
+    create the chat with those messages. If the user's chats are loaded in this process the
+    in-memory copy is updated too, so the next save_user_chats does not write them again.
+    """
+    if not username or not messages:
+        return
+    records = [history_store.session_record(session_id, title)] if title else []
+    records += [history_store.message_record(session_id, msg["role"], msg["text"], query=msg.get("query")) for msg in messages]
+    with _lock:
+        entry = _cache.get(username)
+        up_to_date = entry is not None and entry["key"] == history_store.log_version(username)
+        history_store.append_records(username, records)
+        if not up_to_date:
+            # Not loaded here (or changed elsewhere): the next load reads it from the log
+            _cache.pop(username, None)
+        else:
+            _append_to_cache(entry, session_id, messages, title)
+    _notify(username, [(session_id, msg) for msg in messages])
+
+def _append_to_cache(entry, session_id, messages, title=None):
+    chat = next((c for c in entry["chats"] if c["id"] == session_id), None)
+    if chat is None:
+        chat = {"id": session_id, "title": title or session_id, "messages": []}
+        entry["chats"].insert(0, chat)
+    for msg in messages:
+        chat["messages"].append({"role": msg["role"], "text": msg["text"]})
+    entry["persisted"][session_id] = [m.get("text", "") for m in chat["messages"]]
@@ -0,0 +1,129 @@
+"""
+Course catalog and embedding-ranked course recommendations.
+
+Courses are listed in data/course_catalog.json (course, category, description, prerequisites
+and the schedule names each course is taught under). Their vectors are computed once with
+cached_embeddings and kept on disk, so a recommendation is one matrix-vector product over the
+catalog and never runs the model over it per request.
+"""
+
+import os
+import json
+import logging
+from datetime import date
+import numpy as np
+from utils.embedding_cache import cached_embeddings
+from utils.schedule_utils import load_schedule, get_schedule_index, parse_start_date
+
+# Configure logging
+logging.basicConfig(filename='chatbot_errors.log', level=logging.DEBUG)
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+CATALOG_PATH = os.path.join(BASE_DIR, "..", "data", "course_catalog.json")
+
+RECOMMEND_TOP_K = 3
+# Added to the cosine score of courses in the user's dominant category
+CATEGORY_BOOST = 0.1
+
+_catalog_cache = {"key": None, "courses": []}
+_recommender_cache = {"courses": None, "model": None, "recommender": None}
+
+def load_catalog():
+    """
+    Load data/course_catalog.json. The parsed list is reused until the file changes.
+    """
+    try:
+        stat = os.stat(CATALOG_PATH)
+    except FileNotFoundError:
+        logging.error(f"Course catalog not found at {CATALOG_PATH}")
+        return []
+    key = (stat.st_mtime_ns, stat.st_size)
+    if _catalog_cache["key"] == key:
+        return _catalog_cache["courses"]
+    try:
+        with open(CATALOG_PATH, "r", encoding="utf-8") as f:
+            courses = json.load(f)
+    except (OSError, ValueError) as e:
+        logging.error(f"Error loading course catalog from {CATALOG_PATH}: {str(e)}")
+        return []
+    _catalog_cache["key"] = key
+    _catalog_cache["courses"] = courses
+    return courses
+
+def course_text(course):
+    return f"{course['course']}. {course.get('category', '')}. {course.get('description', '')}"
+
+class CourseRecommender:
+    """
+    Ranks catalog courses by cosine similarity to a query vector.
+    """
+
+    def __init__(self, courses, model_name, encode):
+        self.courses = list(courses)
+        self.categories = np.array([course.get("category", "general") for course in self.courses])
+        vectors = np.asarray(
+            cached_embeddings([course_text(course) for course in self.courses], model_name, encode, name="catalog"),
+            dtype=np.float32,
+        )
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        self.vectors = vectors / np.maximum(norms, 1e-12)
+
+    def recommend(self, query_vector, k=RECOMMEND_TOP_K, category=None, exclude=()):
+        """
+        Return up to k (score, course) pairs, best first. Courses in category get CATEGORY_BOOST;
+        courses named in exclude are skipped.
+        """
+        if not self.courses:
+            return []
+        query = np.asarray(query_vector, dtype=np.float32).ravel()
+        query = query / max(float(np.linalg.norm(query)), 1e-12)
+        scores = self.vectors @ query
+        if category:
+            scores = scores + CATEGORY_BOOST * (self.categories == category)
+        if exclude:
+            excluded = {name.lower() for name in exclude}
+            skip = np.array([course["course"].lower() in excluded for course in self.courses])
+            scores = np.where(skip, -np.inf, scores)
+        k = min(k, len(self.courses))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(float(scores[i]), self.courses[i]) for i in top if np.isfinite(scores[i])]
+
+def get_recommender(model_name, encode):
+    """
+    Return the recommender for the current catalog, rebuilding it only when the catalog changes.
+    """
+    courses = load_catalog()
+    if _recommender_cache["courses"] is not courses or _recommender_cache["model"] != model_name:
+        _recommender_cache["recommender"] = CourseRecommender(courses, model_name, encode)
+        _recommender_cache["courses"] = courses
+        _recommender_cache["model"] = model_name
+    return _recommender_cache["recommender"]
+
+def upcoming_batches(course, today=None):
+    """
+    Return the schedule entries for a catalog course, looked up by its schedule names, that
+    have not started yet, soonest first. Entries without a readable start date come last.
+    """
+    today = today or date.today()
+    index = get_schedule_index(load_schedule())
+    entry_ids = set()
+    for name in course.get("schedule") or [course["course"]]:
+        entry_ids.update(index.match_course(name))
+    batches = []
+    for entry in index.filter(sorted(entry_ids)):
+        start = parse_start_date(entry)
+        if start is None or start >= today:
+            batches.append((start is None, start or today, entry))
+    batches.sort(key=lambda batch: batch[:2])
+    return [entry for _, _, entry in batches]
+
+def recommend_courses(query_vector, model_name, encode, k=RECOMMEND_TOP_K, category=None, exclude=()):
+    """
+    Return the top-k courses for a query vector as dicts with "score" and "batches" added.
+    """
+    recommender = get_recommender(model_name, encode)
+    return [
+        dict(course, score=round(score, 4), batches=upcoming_batches(course))
+        for score, course in recommender.recommend(query_vector, k=k, category=category, exclude=exclude)
+    ]
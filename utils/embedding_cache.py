@@ -0,0 +1,96 @@
+import os
+import json
+import hashlib
+import logging
+import numpy as np
+
+# Configure logging
+logging.basicConfig(filename='chatbot_errors.log', level=logging.DEBUG)
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+CACHE_DIR = os.environ.get("EMBEDDING_CACHE_DIR", os.path.join(BASE_DIR, "..", "data", "embedding_cache"))
+
+def text_hash(text):
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+def _cache_name(model_name):
+    return "".join(c if c.isalnum() or c in "-_." else "_" for c in model_name)
+
+def _save_atomic(path, array):
+    tmp_path = f"{path}.tmp.{os.getpid()}.npy"
+    np.save(tmp_path, array)
+    os.replace(tmp_path, path)
+
+def _referenced_vectors():
+    """
+    Return the .npy file names referenced by any manifest in CACHE_DIR.
+    """
+    referenced = set()
+    for name in os.listdir(CACHE_DIR):
+        if not name.endswith(".manifest.json"):
+            continue
+        try:
+            with open(os.path.join(CACHE_DIR, name), "r", encoding="utf-8") as f:
+                referenced.add(json.load(f)["vectors"])
+        except (OSError, ValueError, KeyError, TypeError):
+            continue
+    return referenced
+
+def cached_embeddings(texts, model_name, encode, name="default"):
+    """
+    Return embeddings for texts, computed with encode(list_of_texts) -> np.ndarray.
+
+    Vectors are stored in CACHE_DIR as a .npy file named after a hash of the model name, the
+    namespace `name` and the texts, and loaded memory-mapped when the hash matches. Each
+    model+namespace pair has its own manifest, so callers caching different text sets with the
+    same model do not evict each other. When the texts change, rows for unchanged texts are
+    reused from the previous file and only new texts are encoded.
+    """
+    if not texts:
+        return np.empty((0, 0), dtype=np.float32)
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    hashes = [text_hash(text) for text in texts]
+    digest = hashlib.sha256("\n".join([model_name, name] + hashes).encode("utf-8")).hexdigest()[:16]
+    prefix = f"{_cache_name(model_name)}.{_cache_name(name)}"
+    vectors_path = os.path.join(CACHE_DIR, f"{prefix}-{digest}.npy")
+    manifest_path = os.path.join(CACHE_DIR, f"{prefix}.manifest.json")
+
+    if os.path.exists(vectors_path):
+        logging.info(f"Loading cached embeddings from {vectors_path}")
+        return np.load(vectors_path, mmap_mode="r")
+
+    # Reuse rows from the previous cache for this model and namespace where the text is unchanged
+    previous_rows = {}
+    previous = None
+    try:
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            previous = json.load(f)
+        old_vectors = np.load(os.path.join(CACHE_DIR, previous["vectors"]), mmap_mode="r")
+        previous_rows = {h: i for i, h in enumerate(previous["hashes"])}
+    except (OSError, ValueError, KeyError):
+        old_vectors = None
+
+    missing = [i for i, h in enumerate(hashes) if h not in previous_rows]
+    logging.info(f"Encoding {len(missing)} of {len(texts)} texts with {model_name}")
+    encoded = np.asarray(encode([texts[i] for i in missing]), dtype=np.float32) if missing else None
+
+    dimension = encoded.shape[1] if encoded is not None else old_vectors.shape[1]
+    vectors = np.empty((len(texts), dimension), dtype=np.float32)
+    for i, h in enumerate(hashes):
+        if h in previous_rows:
+            vectors[i] = old_vectors[previous_rows[h]]
+    if missing:
+        vectors[missing] = encoded
+
+    _save_atomic(vectors_path, vectors)
+    tmp_manifest = f"{manifest_path}.tmp.{os.getpid()}"
+    with open(tmp_manifest, "w", encoding="utf-8") as f:
+        json.dump({"vectors": os.path.basename(vectors_path), "hashes": hashes}, f)
+    os.replace(tmp_manifest, manifest_path)
+    # Prune the replaced file unless another manifest still points at it
+    if previous and previous.get("vectors") not in _referenced_vectors():
+        try:
+            os.remove(os.path.join(CACHE_DIR, previous["vectors"]))
+        except OSError:
+            pass
+    return np.load(vectors_path, mmap_mode="r")
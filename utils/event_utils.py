@@ -1,18 +1,123 @@
 from datetime import datetime, timedelta
 import json
 import os
-from utils.common_utils import extract_keywords
-from difflib import SequenceMatcher
+import math
+import re
+from collections import Counter, defaultdict
+
+EVENTS_PATH = "data/events.json"
+
+# BM25 parameters for event search; title terms are weighted higher than description terms
+BM25_K1 = 1.5
+BM25_B = 0.75
+TITLE_WEIGHT = 2
+EVENT_SEARCH_TOP_K = 3
+EVENT_NEAR_TIE_RATIO = 0.05
+
+STOPWORDS = {
+    "a", "an", "the", "is", "are", "was", "were", "be", "to", "of", "in", "on", "at", "for",
+    "and", "or", "with", "about", "any", "there", "what", "when", "where", "which", "who",
+    "how", "do", "does", "i", "me", "my", "you", "your", "can", "will", "tell", "please",
+    "event", "events", "corvit",
+}
+
+_events_cache = {"key": None, "events": []}
+_index_cache = {"events": None, "index": None}
 
 def load_events():
-    file_path = "data/events.json"
+    """
+    Load events from data/events.json. The parsed list is reused until the file changes,
+    so the search index built on it stays valid across calls.
+    """
+    file_path = EVENTS_PATH
     if not os.path.exists(file_path):
         return []
+    stat = os.stat(file_path)
+    key = (stat.st_mtime_ns, stat.st_size)
+    if _events_cache["key"] == key:
+        return _events_cache["events"]
     try:
         with open(file_path, "r", encoding="utf-8") as f:
-            return json.load(f)
+            events = json.load(f)
     except json.JSONDecodeError:
         return []
+    _events_cache["key"] = key
+    _events_cache["events"] = events
+    return events
+
+def tokenize(text):
+    return [t for t in re.findall(r"[a-z0-9]+", (text or "").lower()) if t not in STOPWORDS]
+
+class EventSearchIndex:
+    """
+    Inverted index over event titles and descriptions scored with BM25.
+    Query cost depends on the postings of the query terms, not on description length.
+    """
+
+    def __init__(self, events):
+        self.events = list(events)
+        self.postings = defaultdict(list)  # term -> [(doc_id, weighted term frequency)]
+        self.doc_lengths = []
+        for doc_id, event in enumerate(self.events):
+            counts = Counter(tokenize(event.get("description", "")))
+            for term in tokenize(event.get("title", "")):
+                counts[term] += TITLE_WEIGHT
+            for term, tf in counts.items():
+                self.postings[term].append((doc_id, tf))
+            self.doc_lengths.append(sum(counts.values()))
+        total = len(self.doc_lengths)
+        self.avg_length = (sum(self.doc_lengths) / total) if total else 0.0
+        self.idf = {
+            term: math.log(1 + (total - len(docs) + 0.5) / (len(docs) + 0.5))
+            for term, docs in self.postings.items()
+        }
+
+    def search(self, query, k=EVENT_SEARCH_TOP_K):
+        """
+        Return up to k (score, event) pairs, best first. Equal scores are ordered by
+        the nearest upcoming date, then by title, so results are deterministic.
+        """
+        scores = defaultdict(float)
+        for term in set(tokenize(query)):
+            idf = self.idf.get(term)
+            if idf is None:
+                continue
+            for doc_id, tf in self.postings[term]:
+                norm = 1 - BM25_B + BM25_B * self.doc_lengths[doc_id] / (self.avg_length or 1)
+                scores[doc_id] += idf * tf * (BM25_K1 + 1) / (tf + BM25_K1 * norm)
+        if not scores:
+            return []
+        today = datetime.today().date()
+
+        def sort_key(doc_id):
+            event = self.events[doc_id]
+            try:
+                days = (datetime.strptime(event.get("date") or "", "%Y-%m-%d").date() - today).days
+            except (TypeError, ValueError):
+                days = None
+            # Upcoming events first (soonest first), then past events (most recent first)
+            date_rank = (0, days) if days is not None and days >= 0 else (1, -days if days is not None else float("inf"))
+            return (-round(scores[doc_id], 9), date_rank, event.get("title", ""))
+
+        ranked = sorted(scores, key=sort_key)[:k]
+        return [(scores[doc_id], self.events[doc_id]) for doc_id in ranked]
+
+def get_event_index(events):
+    """
+    Return the search index for this events list, rebuilding it only when the list changes.
+    """
+    if _index_cache["events"] is not events:
+        _index_cache["index"] = EventSearchIndex(events)
+        _index_cache["events"] = events
+    return _index_cache["index"]
+
+def rank_events(user_input, events, k=EVENT_SEARCH_TOP_K):
+    """
+    Top-k ranked event search. Returns a list of (score, event) tuples.
+    """
+    if not events:
+        return []
+    return get_event_index(events).search(user_input, k=k)
 
 def get_this_week_events(events):
     today = datetime.today()
@@ -48,26 +153,19 @@ def get_next_month_events(events):
                               datetime.strptime(e["date"], "%Y-%m-%d").year == year]
 
 # Search by keywords (fallback)
-def search_events(user_input, events):
-    keywords = extract_keywords(user_input)
-    query = user_input.lower()
-    best_score = 0
-    best_match = None
-
-    for event in events:
-        title = event.get("title", "").lower()
-        description = event.get("description", "").lower()
-        content = f"{title} {description}"
-        keyword_score = sum(1 for kw in keywords if kw in content)
-        similarity_score = SequenceMatcher(None, query, content).ratio()
-        total_score = keyword_score * 0.6 + similarity_score * 0.4
-        if total_score > best_score:
-            best_score = total_score
-            best_match = event
-
-    if best_match:
-        return [best_match]
-    return []
+def search_events(user_input, events, k=EVENT_SEARCH_TOP_K):
+    """
+    Return the best matching event(s) for a free-text query.
+
+    Events whose score is within EVENT_NEAR_TIE_RATIO of the best score are returned
+    together (up to k) so near-ties are shown instead of picking one arbitrarily.
+    """
+    ranked = rank_events(user_input, events, k=k)
+    if not ranked:
+        return []
+    best_score = ranked[0][0]
+    return [event for score, event in ranked if score >= best_score * (1 - EVENT_NEAR_TIE_RATIO)]
+
 def format_events(events):
     return [
         f"📌 **{e['title']}**\n {e['description']}\n Date: {e['date']}"
@@ -0,0 +1,228 @@
+"""
+Retention and compaction for chat history logs.
+
+For each user the log is rewritten to hold only live data: deleted chats and superseded
+edits are dropped, and only the RETENTION_HOT_SESSIONS most recently active chats (and any
+active within RETENTION_MAX_AGE_DAYS) stay in the hot log. Older chats are moved to
+compressed monthly bundles, chat_logs/archive/<user>/<YYYY-MM>.jsonl.gz.
+
+Run it from the command line (python -m utils.history_retention --dry-run) or start it in
+the background with start_background_retention().
+"""
+
+import os
+import gzip
+import json
+import time
+import logging
+import argparse
+import threading
+from datetime import datetime, timedelta
+from utils import history_store
+
+# Configure logging
+logging.basicConfig(filename='chatbot_errors.log', level=logging.DEBUG)
+
+RETENTION_HOT_SESSIONS = int(os.environ.get("RETENTION_HOT_SESSIONS", "50"))
+# Chats active within this many days stay hot even beyond RETENTION_HOT_SESSIONS (0 = off)
+RETENTION_MAX_AGE_DAYS = int(os.environ.get("RETENTION_MAX_AGE_DAYS", "0"))
+RETENTION_INTERVAL_HOURS = float(os.environ.get("RETENTION_INTERVAL_HOURS", "24"))
+
+ARCHIVE_DIR = os.path.join(history_store.HISTORY_DIR, "archive")
+# Email chat_handler files anonymous chats under; it has no account in users.db
+DEFAULT_USER = "default_user@gmail.com"
+
+def archive_dir(email):
+    return os.path.join(ARCHIVE_DIR, history_store.user_key(email))
+
+def collect_sessions(records):
+    """
+    Group live records by session, applying edits and dropping deleted sessions.
+    Returns ({session id: {"last": ts, "records": [...]}} in creation order, number of records dropped).
+    """
+    sessions = {}
+    dropped = 0
+    for record in records:
+        op, title = record.get("op"), record.get("session")
+        if not title:
+            dropped += 1
+            continue
+        if op == "delete":
+            removed = sessions.pop(title, None)
+            dropped += 1 + (len(removed["records"]) if removed else 0)
+            continue
+        session = sessions.get(title)
+        if session is None:
+            session = sessions[title] = {"last": record.get("ts", ""), "records": []}
+            if op != "session":
+                session["records"].append({"op": "session", "session": title, "ts": record.get("ts", "")})
+        session["last"] = max(session["last"], record.get("ts", "") or "")
+        if op == "edit":
+            messages = [r for r in session["records"] if r.get("op") == "message"]
+            index = record.get("index", -1)
+            if 0 <= index < len(messages):
+                messages[index]["text"] = record.get("text", "")
+            dropped += 1
+        elif op == "session" and session["records"]:
+            dropped += 1
+        else:
+            session["records"].append(dict(record))
+    return sessions, dropped
+
+def select_hot(sessions, hot_sessions=RETENTION_HOT_SESSIONS, max_age_days=RETENTION_MAX_AGE_DAYS):
+    """
+    Return the session ids that stay in the hot log.
+    """
+    # Timestamps have one-second resolution (and migrated chats all share one), so ties go
+    # to the most recently created chat
+    order = {title: i for i, title in enumerate(sessions)}
+    by_activity = sorted(sessions, key=lambda title: (sessions[title]["last"], order[title]), reverse=True)
+    hot = set(by_activity[:hot_sessions])
+    if max_age_days:
+        cutoff = (datetime.now() - timedelta(days=max_age_days)).isoformat(timespec="seconds")
+        hot |= {title for title, session in sessions.items() if session["last"] >= cutoff}
+    return hot
+
+def compact_user(email, hot_sessions=RETENTION_HOT_SESSIONS, max_age_days=RETENTION_MAX_AGE_DAYS, dry_run=False):
+    """
+    Compact one user's log and archive cold chats. Returns a report dict.
+    """
+    filepath = history_store.log_path(email)
+    if dry_run and not os.path.exists(filepath) and os.path.exists(history_store.legacy_path(email)):
+        return {"user": email, "skipped": "legacy history, migrated on the next run"}
+    history_store.migrate_legacy(email)
+    history_store.flush_pending()
+    with history_store.user_lock(email):
+        if not os.path.exists(filepath):
+            return {"user": email, "skipped": "no log"}
+        bytes_before = os.path.getsize(filepath)
+        records = list(history_store.read_records(email, flush=False))
+        sessions, dropped = collect_sessions(records)
+        hot = select_hot(sessions, hot_sessions, max_age_days)
+
+        hot_records, archived = [], {}
+        for title, session in sessions.items():
+            if title in hot:
+                hot_records.extend(session["records"])
+            else:
+                month = (session["last"] or "unknown")[:7]
+                archived.setdefault(month, []).extend(session["records"])
+        data = history_store.encode_records(hot_records)
+
+        report = {
+            "user": email,
+            "records_before": len(records),
+            "records_after": len(hot_records),
+            "records_dropped": dropped,
+            "bytes_before": bytes_before,
+            "bytes_after": len(data),
+            "sessions_hot": len(hot),
+            "sessions_archived": {month: len({r["session"] for r in recs}) for month, recs in archived.items()},
+        }
+        if dry_run or (not archived and not dropped):
+            return report
+
+        # Archive first: a crash before the log is replaced only duplicates chats, never loses them
+        if archived:
+            os.makedirs(archive_dir(email), exist_ok=True)
+            for month, month_records in archived.items():
+                bundle = os.path.join(archive_dir(email), f"{month}.jsonl.gz")
+                with open(bundle, "ab") as raw:
+                    # Each run adds a gzip member; gzip readers concatenate them
+                    with gzip.GzipFile(fileobj=raw, mode="ab") as file:
+                        file.write(history_store.encode_records(month_records))
+                    raw.flush()
+                    os.fsync(raw.fileno())
+        history_store.write_atomic(filepath, data)
+    logging.info(f"Compacted history for {email}: {report}")
+    return report
+
+def read_archive(email):
+    """
+    Yield archived records for a user, oldest bundle first.
+    """
+    directory = archive_dir(email)
+    if not os.path.isdir(directory):
+        return
+    for name in sorted(os.listdir(directory)):
+        if not name.endswith(".jsonl.gz"):
+            continue
+        with gzip.open(os.path.join(directory, name), "rt", encoding="utf-8") as file:
+            for line in file:
+                if line.strip():
+                    yield json.loads(line)
+
+def known_users():
+    """
+    Emails that can own a history log: every registered account plus DEFAULT_USER.
+    """
+    users = {DEFAULT_USER}
+    try:
+        import auth  # top-level module, only needed when scanning every user
+        users.update(auth.list_usernames())
+    except Exception as e:
+        logging.error(f"Could not list registered users: {str(e)}")
+    return users
+
+def discover_users():
+    """
+    Resolve the history files on disk (JSONL logs and legacy .json histories) to their owners.
+    Returns (sorted emails, sorted file keys that match no known user).
+    """
+    keys = set()
+    for name in os.listdir(history_store.HISTORY_DIR):
+        key, ext = os.path.splitext(name)
+        # Keys never contain dots, which skips .tail.json, .profile.json and backups
+        if ext in (".jsonl", ".json") and "." not in key:
+            keys.add(key)
+    owners = {history_store.user_key(email): email for email in known_users()}
+    return sorted(owners[key] for key in keys if key in owners), sorted(key for key in keys if key not in owners)
+
+def run_retention(hot_sessions=RETENTION_HOT_SESSIONS, max_age_days=RETENTION_MAX_AGE_DAYS, dry_run=False, users=None):
+    """
+    Compact every user's log (or just the given users). Returns the list of reports.
+    """
+    reports = []
+    if users is None:
+        users, orphans = discover_users()
+        for key in orphans:
+            logging.warning(f"No account matches history file {key}; skipping it")
+            reports.append({"key": key, "skipped": "no matching account"})
+    for user in users:
+        try:
+            reports.append(compact_user(user, hot_sessions, max_age_days, dry_run=dry_run))
+        except Exception as e:
+            logging.error(f"Retention failed for {user}: {str(e)}", exc_info=True)
+            reports.append({"user": user, "error": str(e)})
+    return reports
+
+def start_background_retention(interval_hours=RETENTION_INTERVAL_HOURS, **policy):
+    """
+    Run retention every interval_hours on a daemon thread.
+    """
+    def loop():
+        while True:
+            time.sleep(interval_hours * 3600)
+            run_retention(**policy)
+
+    thread = threading.Thread(target=loop, name="history-retention", daemon=True)
+    thread.start()
+    return thread
+
+def main():
+    parser = argparse.ArgumentParser(description="Compact chat history logs and archive old chats.")
+    parser.add_argument("--dry-run", action="store_true", help="report what would change without writing")
+    parser.add_argument("--hot-sessions", type=int, default=RETENTION_HOT_SESSIONS)
+    parser.add_argument("--max-age-days", type=int, default=RETENTION_MAX_AGE_DAYS)
+    parser.add_argument("--user", action="append", help="email of a user to process (repeatable); default all")
+    args = parser.parse_args()
+
+    reports = run_retention(args.hot_sessions, args.max_age_days, dry_run=args.dry_run, users=args.user)
+    for report in reports:
+        print(json.dumps(report, ensure_ascii=False))
+    total_before = sum(r.get("bytes_before", 0) for r in reports)
+    total_after = sum(r.get("bytes_after", r.get("bytes_before", 0)) for r in reports)
+    print(f"{'Would reduce' if args.dry_run else 'Reduced'} hot history from {total_before} to {total_after} bytes across {len(reports)} users")
+
+if __name__ == "__main__":
+    main()
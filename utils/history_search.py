@@ -0,0 +1,209 @@
+"""
+Full-text search over a user's chat history.
+
+Each user has a SQLite FTS5 index next to their log, chat_logs/<email>.search.db, holding
+every message with its session and position. Like the tail index it records how far into the
+log it has read, so only records appended since the last update are parsed. It is brought up
+to date lazily before each search, never on the write path, and each user's connection is
+kept open between searches. Edits and deleted chats are applied; a log that was replaced
+(e.g. compacted by history_retention) is re-indexed from the start.
+"""
+
+import os
+import re
+import json
+import sqlite3
+import logging
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from utils import history_store
+
+# Configure logging
+logging.basicConfig(filename='chatbot_errors.log', level=logging.DEBUG)
+
+SEARCH_LIMIT = 20
+# Words of context shown around the matched terms in a snippet
+SNIPPET_WORDS = 12
+# Users whose index connection is kept open; the least recently searched is dropped first
+MAX_CONNECTIONS = 64
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY,
+    session TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    role TEXT,
+    ts TEXT,
+    text TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS messages_session ON messages (session, position);
+CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+    text, content='messages', content_rowid='id', tokenize='unicode61 remove_diacritics 2'
+);
+CREATE TRIGGER IF NOT EXISTS messages_ai AFTER INSERT ON messages BEGIN
+    INSERT INTO messages_fts (rowid, text) VALUES (new.id, new.text);
+END;
+CREATE TRIGGER IF NOT EXISTS messages_ad AFTER DELETE ON messages BEGIN
+    INSERT INTO messages_fts (messages_fts, rowid, text) VALUES ('delete', old.id, old.text);
+END;
+CREATE TRIGGER IF NOT EXISTS messages_au AFTER UPDATE OF text ON messages BEGIN
+    INSERT INTO messages_fts (messages_fts, rowid, text) VALUES ('delete', old.id, old.text);
+    INSERT INTO messages_fts (rowid, text) VALUES (new.id, new.text);
+END;
+CREATE TABLE IF NOT EXISTS sessions (
+    id TEXT PRIMARY KEY,
+    title TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS index_state (
+    id INTEGER PRIMARY KEY CHECK (id = 0),
+    inode INTEGER NOT NULL,
+    offset INTEGER NOT NULL
+);
+"""
+
+def index_path(email):
+    key = history_store.user_key(email)
+    return os.path.join(history_store.HISTORY_DIR, key + ".search.db") if key else None
+
+_connections = OrderedDict()  # email -> (connection, lock serializing its use)
+_connections_guard = threading.Lock()
+
+def _connect(email):
+    conn = sqlite3.connect(index_path(email), timeout=30, isolation_level=None, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.executescript(SCHEMA)
+    return conn
+
+@contextmanager
+def _connection(email):
+    """
+    Borrow the user's open index connection, opening it on first use.
+    """
+    with _connections_guard:
+        entry = _connections.get(email)
+        if entry is None:
+            entry = _connections[email] = (_connect(email), threading.Lock())
+            if len(_connections) > MAX_CONNECTIONS:
+                # A borrower still holding the evicted connection keeps it alive until it is done
+                _connections.popitem(last=False)
+        else:
+            _connections.move_to_end(email)
+    with entry[1]:
+        yield entry[0]
+
+def _apply(conn, record):
+    op, session_id = record.get("op"), record.get("session")
+    if not session_id:
+        return
+    if op == "delete":
+        conn.execute("DELETE FROM messages WHERE session = ?", (session_id,))
+        conn.execute("DELETE FROM sessions WHERE id = ?", (session_id,))
+    elif op == "session" and record.get("title"):
+        conn.execute("INSERT OR REPLACE INTO sessions (id, title) VALUES (?, ?)", (session_id, record["title"]))
+    elif op == "edit":
+        conn.execute(
+            "UPDATE messages SET text = ? WHERE session = ? AND position = ?",
+            (record.get("text", ""), session_id, record.get("index", -1)),
+        )
+    elif op == "message":
+        position = conn.execute(
+            "SELECT COALESCE(MAX(position) + 1, 0) FROM messages WHERE session = ?", (session_id,)
+        ).fetchone()[0]
+        conn.execute(
+            "INSERT INTO messages (session, position, role, ts, text) VALUES (?, ?, ?, ?, ?)",
+            (session_id, position, record.get("role"), record.get("ts"), record.get("text", "")),
+        )
+
+def update_index(email, flush=True):
+    """
+    Index records appended to the user's log since the last update. Returns how many were read.
+    """
+    filepath = history_store.log_path(email)
+    if not filepath:
+        return 0
+    if flush:
+        history_store.flush_pending()
+    try:
+        stat = os.stat(filepath)
+    except OSError:
+        return 0
+
+    with _connection(email) as conn:
+        return _update(conn, filepath, stat)
+
+def _update(conn, filepath, stat):
+    try:
+        # IMMEDIATE: two processes updating at once apply each record only once
+        conn.execute("BEGIN IMMEDIATE")
+        row = conn.execute("SELECT inode, offset FROM index_state WHERE id = 0").fetchone()
+        inode, offset = row if row else (None, 0)
+        if inode != stat.st_ino or offset > stat.st_size:
+            # The log was replaced (e.g. compacted) or truncated: rebuild from the start
+            conn.execute("DELETE FROM messages")
+            conn.execute("DELETE FROM sessions")
+            offset = 0
+        count = 0
+        if offset < stat.st_size:
+            with open(filepath, "rb") as file:
+                file.seek(offset)
+                data = file.read(stat.st_size - offset)
+            # Only consume complete lines; a partial last line is read next time
+            end = data.rfind(b"\n") + 1
+            for line in data[:end].splitlines():
+                try:
+                    _apply(conn, json.loads(line))
+                    count += 1
+                except ValueError:
+                    continue
+            offset += end
+        conn.execute(
+            "INSERT OR REPLACE INTO index_state (id, inode, offset) VALUES (0, ?, ?)",
+            (stat.st_ino, offset),
+        )
+        conn.execute("COMMIT")
+        return count
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+
+def _match_expression(query):
+    # Quote every word so user input cannot form FTS5 syntax; the last word matches as a prefix
+    words = re.findall(r"\w+", query or "")
+    if not words:
+        return None
+    terms = [f'"{word}"' for word in words]
+    terms[-1] += "*"
+    return " ".join(terms)
+
+def search_history(email, query, limit=SEARCH_LIMIT, session_id=None):
+    """
+    Search the user's messages. Returns up to `limit` dicts, best match first:
+    {"session", "title", "position", "role", "ts", "snippet", "score"}, where session is the chat
+    id; matched words in the snippet are wrapped in ** for markdown.
+    """
+    expression = _match_expression(query)
+    if not expression or not index_path(email):
+        return []
+    update_index(email)
+    if not os.path.exists(index_path(email)):
+        return []
+    sql = (
+        "SELECT m.session, COALESCE(s.title, m.session), m.position, m.role, m.ts, "
+        f"snippet(messages_fts, 0, '**', '**', '…', {SNIPPET_WORDS}), bm25(messages_fts) "
+        "FROM messages_fts JOIN messages m ON m.id = messages_fts.rowid "
+        "LEFT JOIN sessions s ON s.id = m.session "
+        "WHERE messages_fts MATCH ?"
+    )
+    params = [expression]
+    if session_id:
+        sql += " AND m.session = ?"
+        params.append(session_id)
+    sql += " ORDER BY bm25(messages_fts) LIMIT ?"
+    params.append(limit)
+    with _connection(email) as conn:
+        rows = conn.execute(sql, params).fetchall()
+    return [
+        {"session": session, "title": title, "position": position, "role": role, "ts": ts, "snippet": snippet, "score": round(-score, 4)}
+        for session, title, position, role, ts, snippet, score in rows
+    ]
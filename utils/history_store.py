@@ -0,0 +1,453 @@
+"""
+Append-only chat history storage.
+
+Each user has one JSONL log, chat_logs/<sanitized email>.jsonl, holding one record per line:
+
+    {"op": "session", "session": id, "title": title, "ts": ...}   (a chat was created)
+    {"op": "message", "session": id, "role": "user" | "bot", "text": ..., "ts": ..., ["query": ...]}
+    {"op": "edit", "session": id, "index": i, "text": ...}
+    {"op": "delete", "session": id, "ts": ...}
+
+Sessions are keyed by an id assigned when the chat is created, so two chats with the same
+title (titles only have minute resolution) stay separate. Logs written before ids existed
+used the title as the key and have no "title" field; their key doubles as the title.
+
+Replaying the log in order gives the user's sessions. Appending a turn is a single
+O_APPEND write regardless of how much history the user already has.
+"""
+
+import os
+import json
+import uuid
+import logging
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+# Configure logging
+logging.basicConfig(filename='chatbot_errors.log', level=logging.DEBUG)
+
+HISTORY_DIR = "chat_logs"
+
+# fsync after every append (slower, survives power loss rather than just process crashes)
+HISTORY_FSYNC = os.environ.get("CHAT_HISTORY_FSYNC", "0") == "1"
+
+# "sync" writes each append before returning; "write_behind" hands it to utils.history_writer
+WRITE_MODE = os.environ.get("CHAT_HISTORY_WRITE_MODE", "sync")
+
+# Recent user messages kept per session in the tail index (load_user_chat_history reads 3)
+TAIL_SIZE = 10
+
+_write_listeners = []
+_tails = {}  # email -> tail index state
+_tails_lock = threading.Lock()
+_thread_locks = {}
+_thread_locks_guard = threading.Lock()
+
+# Ensure the directory exists
+os.makedirs(HISTORY_DIR, exist_ok=True)
+
+def user_key(email):
+    """
+    Sanitize an email address into the base name of its history files (e.g. a@b.com -> a_b_com).
+    """
+    if not email or not isinstance(email, str):
+        return None
+    return email.replace('@', '_').replace('.', '_')
+
+def log_path(email):
+    key = user_key(email)
+    return os.path.join(HISTORY_DIR, key + ".jsonl") if key else None
+
+def tail_path(email):
+    key = user_key(email)
+    return os.path.join(HISTORY_DIR, key + ".tail.json") if key else None
+
+def legacy_path(email):
+    key = user_key(email)
+    return os.path.join(HISTORY_DIR, key + ".json") if key else None
+
+def lock_path(email):
+    key = user_key(email)
+    return os.path.join(HISTORY_DIR, key + ".lock") if key else None
+
+@contextmanager
+def user_lock(email):
+    """
+    Exclusive per-user lock held across threads and processes (e.g. several Streamlit
+    workers) while a user's files are written. Re-entrant within a thread.
+    """
+    with _thread_locks_guard:
+        thread_lock = _thread_locks.setdefault(email, [threading.RLock(), 0])
+    with thread_lock[0]:
+        if thread_lock[1]:
+            # Already held by this thread, which also holds the file lock
+            thread_lock[1] += 1
+            try:
+                yield
+            finally:
+                thread_lock[1] -= 1
+            return
+        with open(lock_path(email), "a+b") as lock_file:
+            if fcntl:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+            else:
+                lock_file.seek(0)
+                msvcrt.locking(lock_file.fileno(), msvcrt.LK_LOCK, 1)
+            thread_lock[1] = 1
+            try:
+                yield
+            finally:
+                thread_lock[1] = 0
+                if fcntl:
+                    fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+                else:
+                    lock_file.seek(0)
+                    msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+
+def now_ts():
+    return datetime.now().isoformat(timespec="seconds")
+
+def new_session_id():
+    return uuid.uuid4().hex
+
+def session_record(session_id, title, ts=None):
+    """
+    The record that creates a chat, naming its title.
+    """
+    return {"op": "session", "session": session_id, "title": title, "ts": ts or now_ts()}
+
+def message_record(session_id, role, text, ts=None, query=None):
+    """
+    A message record. query holds the English text the bot answered when it differs from
+    what the user typed (e.g. translated Urdu).
+    """
+    record = {"op": "message", "session": session_id, "role": role, "text": text, "ts": ts or now_ts()}
+    if query and query != text:
+        record["query"] = query
+    return record
+
+def encode_records(records):
+    return "".join(json.dumps(record, ensure_ascii=False) + "\n" for record in records).encode("utf-8")
+
+def read_legacy_history(filepath):
+    """
+    Load a legacy whole-file JSON history (a list of {"title", "messages"} sessions).
+    Returns None when the file exists but cannot be parsed.
+    """
+    if not os.path.exists(filepath):
+        return []
+    try:
+        with open(filepath, "r", encoding="utf-8") as file:
+            data = json.load(file)
+        return data if isinstance(data, list) else None
+    except (json.JSONDecodeError, UnicodeDecodeError):
+        logging.error(f"Invalid JSON in {filepath}")
+        return None
+
+def salvage_legacy_history(filepath):
+    """
+    Recover the complete sessions from a legacy JSON history that was cut short
+    (e.g. by a crash during json.dump). Returns the sessions that could be decoded.
+    """
+    try:
+        with open(filepath, "r", encoding="utf-8", errors="replace") as file:
+            text = file.read()
+    except OSError:
+        return []
+    decoder = json.JSONDecoder()
+    sessions = []
+    position = text.find("[") + 1
+    while position:
+        while position < len(text) and text[position] in " \t\r\n,":
+            position += 1
+        try:
+            session, position = decoder.raw_decode(text, position)
+        except ValueError:
+            break
+        if isinstance(session, dict):
+            sessions.append(session)
+    return sessions
+
+def write_atomic(filepath, data):
+    """
+    Write bytes to filepath through a temp file and rename, so readers never see a partial file.
+    """
+    tmp_path = f"{filepath}.tmp.{os.getpid()}.{threading.get_ident()}"
+    with open(tmp_path, "wb") as file:
+        file.write(data)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(tmp_path, filepath)
+
+def migrate_legacy(email):
+    """
+    One-time conversion of chat_logs/<email>.json into the JSONL log. The old file is kept
+    as <email>.json.migrated. A damaged file is kept as <email>.json.corrupt and whatever
+    complete sessions it still holds are migrated.
+    """
+    old_path, new_path = legacy_path(email), log_path(email)
+    if not old_path or not os.path.exists(old_path) or os.path.exists(new_path):
+        return False
+    with user_lock(email):
+        # Another process may have migrated while we waited for the lock
+        if not os.path.exists(old_path) or os.path.exists(new_path):
+            return False
+        sessions = read_legacy_history(old_path)
+        backup_path = old_path + ".migrated"
+        if sessions is None:
+            sessions = salvage_legacy_history(old_path)
+            backup_path = old_path + ".corrupt"
+            logging.error(f"{old_path} is damaged; recovered {len(sessions)} sessions, keeping the original as {backup_path}")
+
+        ts = datetime.fromtimestamp(os.path.getmtime(old_path)).isoformat(timespec="seconds")
+        records = []
+        for session in sessions:
+            if not isinstance(session, dict) or not session.get("title"):
+                continue
+            session_id = new_session_id()
+            records.append(session_record(session_id, session["title"], ts=ts))
+            for message in session.get("messages") or []:
+                if isinstance(message, dict) and "text" in message:
+                    records.append(message_record(session_id, message.get("role", "user"), message["text"], ts=ts))
+        write_atomic(new_path, encode_records(records))
+        os.replace(old_path, backup_path)
+    logging.info(f"Migrated {len(sessions)} sessions from {old_path} to {new_path}")
+    return True
+
+def log_version(email):
+    """
+    (mtime, size) of the user's log, or None if it does not exist. Changes on every write.
+    """
+    try:
+        stat = os.stat(log_path(email))
+        return (stat.st_mtime_ns, stat.st_size)
+    except (OSError, TypeError):
+        return None
+
+def add_write_listener(listener):
+    """
+    Register listener(email, version_before, version_after), called after each write to a log.
+    """
+    _write_listeners.append(listener)
+
+def append_records(email, records):
+    """
+    Append records to the user's log, directly or through the write-behind queue.
+    """
+    if not log_path(email) or not records:
+        return
+    if WRITE_MODE == "write_behind":
+        from utils import history_writer
+        history_writer.get_writer().submit(email, records)
+    else:
+        write_records(email, records)
+
+def flush_pending():
+    """
+    Write out anything still queued by the write-behind writer.
+    """
+    if WRITE_MODE == "write_behind":
+        from utils import history_writer
+        history_writer.get_writer().flush()
+
+def repair_torn_tail(fd):
+    """
+    Cut off a partial last record left by a crash mid-write, so the log ends on a full line.
+    Must be called with the user lock held.
+    """
+    size = os.fstat(fd).st_size
+    if not size:
+        return
+    os.lseek(fd, size - 1, os.SEEK_SET)
+    if os.read(fd, 1) == b"\n":
+        return
+    chunk = min(size, 64 * 1024)
+    while True:
+        os.lseek(fd, size - chunk, os.SEEK_SET)
+        last_newline = os.read(fd, chunk).rfind(b"\n")
+        if last_newline >= 0 or chunk == size:
+            break
+        chunk = min(size, chunk * 2)
+    keep = size - chunk + last_newline + 1 if last_newline >= 0 else 0
+    logging.error(f"Discarding {size - keep} bytes of a torn history record")
+    os.ftruncate(fd, keep)
+
+def write_records(email, records):
+    """
+    Append records to the user's log with a single write, holding the user lock.
+    """
+    filepath = log_path(email)
+    if not filepath or not records:
+        return
+    migrate_legacy(email)
+    data = encode_records(records)
+    with user_lock(email):
+        version_before = log_version(email)
+        fd = os.open(filepath, os.O_RDWR | os.O_APPEND | os.O_CREAT | getattr(os, "O_BINARY", 0), 0o644)
+        try:
+            repair_torn_tail(fd)
+            os.write(fd, data)
+            if HISTORY_FSYNC:
+                os.fsync(fd)
+        finally:
+            os.close(fd)
+        version_after = log_version(email)
+    for listener in _write_listeners:
+        listener(email, version_before, version_after)
+
+def read_records(email, flush=True):
+    """
+    Yield the user's records in write order. A torn last line left by a crash is skipped.
+    Pass flush=False when holding the user lock, so queued write-behind records are not waited for.
+    """
+    filepath = log_path(email)
+    if not filepath:
+        return
+    if flush:
+        flush_pending()
+    migrate_legacy(email)
+    if not os.path.exists(filepath):
+        return
+    with open(filepath, "r", encoding="utf-8", errors="replace") as file:
+        for line_no, line in enumerate(file, start=1):
+            if not line.strip():
+                continue
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                logging.error(f"Skipping unreadable record {filepath}:{line_no}")
+
+def replay(records):
+    """
+    Rebuild the list of sessions ({"id", "title", "messages"}) in creation order from records.
+    """
+    sessions = {}
+    for record in records:
+        op, session_id = record.get("op"), record.get("session")
+        if not session_id:
+            continue
+        if op == "delete":
+            sessions.pop(session_id, None)
+            continue
+        session = sessions.setdefault(session_id, {"id": session_id, "title": session_id, "messages": []})
+        if op == "session" and record.get("title"):
+            session["title"] = record["title"]
+        elif op == "message":
+            message = {"role": record.get("role"), "text": record.get("text", "")}
+            if record.get("query"):
+                message["query"] = record["query"]
+            session["messages"].append(message)
+        elif op == "edit":
+            index = record.get("index", -1)
+            if 0 <= index < len(session["messages"]):
+                session["messages"][index]["text"] = record.get("text", "")
+    return list(sessions.values())
+
+def load_sessions(email):
+    return replay(read_records(email))
+
+def delete_session(email, session_id):
+    append_records(email, [{"op": "delete", "session": session_id, "ts": now_ts()}])
+
+def _new_tail(inode):
+    return {"inode": inode, "offset": 0, "sessions": {}, "latest": []}
+
+def _apply_to_tail(state, record):
+    op, title = record.get("op"), record.get("session")
+    if not title:
+        return
+    if op == "delete":
+        state["sessions"].pop(title, None)
+        state["latest"] = [item for item in state["latest"] if item[0] != title]
+    elif op == "message" and record.get("role") == "user":
+        text = (record.get("query") or record.get("text") or "").strip()
+        if not text:
+            return
+        recent = state["sessions"].setdefault(title, [])
+        recent.append(text)
+        del recent[:-TAIL_SIZE]
+        state["latest"].append([title, text])
+        del state["latest"][:-TAIL_SIZE]
+
+def _load_tail_file(email):
+    try:
+        with open(tail_path(email), "r", encoding="utf-8") as file:
+            state = json.load(file)
+        return state if isinstance(state, dict) and "offset" in state else None
+    except (OSError, ValueError):
+        return None
+
+def recent_user_messages(email, session_id=None, limit=3):
+    """
+    Return the latest `limit` user messages (the English query when there is one) of a session,
+    or across all sessions in write order when session_id is None.
+
+    Served from a small per-user tail index (chat_logs/<email>.tail.json) that records how far
+    into the log it has read; only records appended since then are parsed. Edits of earlier
+    messages are not reflected in the index.
+    """
+    filepath = log_path(email)
+    if not filepath:
+        return []
+    flush_pending()
+    migrate_legacy(email)
+    try:
+        stat = os.stat(filepath)
+    except OSError:
+        return []
+
+    with _tails_lock:
+        state = _tails.get(email) or _load_tail_file(email)
+        # The log was replaced (e.g. compacted) or truncated: rebuild from the start
+        if state is None or state.get("inode") != stat.st_ino or state["offset"] > stat.st_size:
+            state = _new_tail(stat.st_ino)
+        if state["offset"] < stat.st_size:
+            with open(filepath, "rb") as file:
+                file.seek(state["offset"])
+                data = file.read(stat.st_size - state["offset"])
+            # Only consume complete lines; a partial last line is read next time
+            end = data.rfind(b"\n") + 1
+            for line in data[:end].splitlines():
+                try:
+                    _apply_to_tail(state, json.loads(line))
+                except ValueError:
+                    continue
+            if end:
+                state["offset"] += end
+                with user_lock(email):
+                    write_atomic(tail_path(email), json.dumps(state, ensure_ascii=False).encode("utf-8"))
+        _tails[email] = state
+
+        if session_id:
+            messages = state["sessions"].get(session_id, [])
+            truncated = len(messages) >= TAIL_SIZE
+        else:
+            messages = [text for _, text in state["latest"]]
+            # After deletes, "latest" can hold fewer entries than the remaining sessions do
+            truncated = sum(len(recent) for recent in state["sessions"].values()) > len(messages)
+
+    if len(messages) < limit and truncated:
+        return _scan_user_messages(email, session_id)[-limit:]
+    return messages[-limit:]
+
+def _scan_user_messages(email, session_id=None):
+    """
+    User messages of a session (or of all sessions, in write order) read from the full log.
+    """
+    messages = []  # [title, text]
+    for record in read_records(email, flush=False):
+        op, title = record.get("op"), record.get("session")
+        if op == "delete":
+            messages = [item for item in messages if item[0] != title]
+        elif op == "message" and record.get("role") == "user" and (session_id is None or title == session_id):
+            text = (record.get("query") or record.get("text") or "").strip()
+            if text:
+                messages.append([title, text])
+    return [text for _, text in messages]
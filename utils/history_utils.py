@@ -1,16 +1,11 @@
-import os
-import json
 import logging
 from datetime import datetime
+from utils import history_store, chat_utils
+from utils.history_store import HISTORY_DIR
 
 # Configure logging
 logging.basicConfig(filename='chatbot_errors.log', level=logging.DEBUG)
 
-HISTORY_DIR = "chat_logs"
-
-# Ensure the directory exists
-os.makedirs(HISTORY_DIR, exist_ok=True)
-
 def sanitize_filename(email):
     """
     Sanitize email address for use as a filename (e.g., rehab11@gamil.com -> rehab11_gamil_com.json).
@@ -23,7 +18,8 @@ def sanitize_filename(email):
 
 def load_user_chat_history(email, session_id=None):
     """
-    Load the latest three user messages from the specified session or all sessions if session_id is None.
+    Load the latest three user messages from the specified session, or the latest three across
+    all sessions if session_id is None. Only the small per-session tail index is read.
     """
     if not email or not isinstance(email, str):
         logging.error(f"Invalid email: {email}")
@@ -34,56 +30,25 @@ def load_user_chat_history(email, session_id=None):
         logging.error(f"Failed to sanitize email: {email}")
         return []
     
-    filepath = os.path.join(HISTORY_DIR, filename)
-    logging.debug(f"Attempting to load chat history from {filepath}")
-    
-    if not os.path.exists(filepath):
-        logging.debug(f"No chat history file found for {email} at {filepath}")
-        return []
+    logging.debug(f"Attempting to load chat history for {email}")
     
     try:
-        with open(filepath, "r", encoding="utf-8") as file:
-            chat_sessions = json.load(file)
-        
-        if not isinstance(chat_sessions, list):
-            logging.error(f"Invalid chat history format for {email}: expected list, got {type(chat_sessions)}")
-            return []
-        
-        user_messages = []
-        if session_id:
-            # Find the session with the matching session_id
-            for session in chat_sessions:
-                if session.get("title") == session_id and isinstance(session.get("messages"), list):
-                    # Extract the latest three user messages from this session
-                    session_messages = [
-                        {"user_message": msg["text"]}
-                        for msg in session["messages"]
-                        if msg.get("role") == "user" and "text" in msg and msg["text"].strip()
-                    ]
-                    user_messages = session_messages[-3:]  # Take the latest 3
-                    break
-        else:
-            # Fallback: Extract latest three user messages from all sessions
-            chat_sessions = sorted(chat_sessions, key=lambda x: x.get("title", ""), reverse=True)
-            for session in chat_sessions:
-                if isinstance(session, dict) and "messages" in session and isinstance(session["messages"], list):
-                    for message in session["messages"]:
-                        if message.get("role") == "user" and "text" in message and message["text"].strip():
-                            user_messages.append({"user_message": message["text"]})
-            user_messages = user_messages[-3:]  # Take the latest 3
+        user_messages = [
+            {"user_message": text}
+            for text in history_store.recent_user_messages(email, session_id=session_id, limit=3)
+        ]
         
         logging.debug(f"Extracted {len(user_messages)} user messages for {email} (session_id: {session_id}): {user_messages}")
         return user_messages
-    except json.JSONDecodeError as e:
-        logging.error(f"Invalid JSON in {filepath}: {str(e)}")
-        return []
     except Exception as e:
         logging.error(f"Error loading chat history for {email}: {str(e)}", exc_info=True)
         return []
 
-def append_chat_history(email, user_msg, bot_response, session_id=None):
+def append_chat_history(email, user_msg, bot_response, session_id=None, original_msg=None):
     """
-    Append a user and bot message pair to the chat_logs/{email}.json file in the specified session.
+    Append a user and bot message pair to the user's history log in the specified session.
+    Only the new messages are written; the existing history is not read or rewritten.
+    original_msg is the message as the user typed it, when user_msg is its translation.
     """
     if not email or not isinstance(email, str):
         logging.error(f"Invalid email for appending history: {email}")
@@ -94,56 +59,30 @@ def append_chat_history(email, user_msg, bot_response, session_id=None):
         logging.error(f"Failed to sanitize email: {email}")
         return
     
-    filepath = os.path.join(HISTORY_DIR, filename)
-    logging.debug(f"Appending chat history to {filepath}")
-    
-    chat_sessions = load_raw_chat_history(filepath)
-    
-    # Find or create the session
-    current_session = None
-    if session_id:
-        for session in chat_sessions:
-            if session.get("title") == session_id:
-                current_session = session
-                break
-    if not current_session:
-        current_session = {"title": session_id or f"Chat {datetime.now().strftime('%d-%b %H:%M')}", "messages": []}
-        chat_sessions.append(current_session)
+    # Without a session, start a new chat under its own id
+    title = None
+    if not session_id:
+        session_id = history_store.new_session_id()
+        title = f"Chat {datetime.now().strftime('%d-%b %H:%M')}"
     
     # Append new messages if they are non-empty
+    messages = []
     if user_msg and isinstance(user_msg, str):
-        current_session["messages"].append({
-            "role": "user",
-            "text": user_msg.strip()
-        })
-        logging.debug(f"Appended user message for {email}: {user_msg.strip()}")
+        shown = original_msg.strip() if original_msg and isinstance(original_msg, str) else user_msg.strip()
+        messages.append({"role": "user", "text": shown, "query": user_msg.strip()})
     if bot_response and isinstance(bot_response, str):
-        current_session["messages"].append({
-            "role": "bot",
-            "text": bot_response.strip()
-        })
-        logging.debug(f"Appended bot response for {email}: {bot_response.strip()}")
+        messages.append({"role": "bot", "text": bot_response.strip()})
     
-    # Save updated history
     try:
-        with open(filepath, "w", encoding="utf-8") as file:
-            json.dump(chat_sessions, file, indent=4, ensure_ascii=False)
-        logging.debug(f"Successfully appended chat history for {email} to {filepath}")
+        chat_utils.append_messages(email, session_id, messages, title=title)
+        logging.debug(f"Successfully appended {len(messages)} messages for {email} to session {session_id}")
     except Exception as e:
         logging.error(f"Error saving chat history for {email}: {str(e)}", exc_info=True)
 
 def load_raw_chat_history(filepath):
     """
-    Helper function to load raw chat history or return an empty list.
+    Helper function to load a legacy whole-file JSON chat history or return an empty list.
     """
-    if os.path.exists(filepath):
-        try:
-            with open(filepath, "r", encoding="utf-8") as file:
-                data = json.load(file)
-                logging.debug(f"Loaded raw chat history from {filepath}: {len(data)} sessions")
-                return data if isinstance(data, list) else []
-        except json.JSONDecodeError:
-            logging.error(f"Invalid JSON in {filepath}")
-            return []
-    logging.debug(f"No chat history file found at {filepath}")
-    return []
\ No newline at end of file
+    data = history_store.read_legacy_history(filepath)
+    logging.debug(f"Loaded raw chat history from {filepath}: {len(data or [])} sessions")
+    return data or []
@@ -0,0 +1,206 @@
+"""
+Write-behind writer for chat history.
+
+When CHAT_HISTORY_WRITE_MODE=write_behind, history_store hands appended records to a
+bounded queue instead of writing them on the request path. A background thread groups
+them per user and writes each user's batch with one append, when the oldest queued record
+is CHAT_HISTORY_FLUSH_MS old, when CHAT_HISTORY_FLUSH_RECORDS records are waiting, on an
+explicit flush, and at interpreter shutdown.
+
+A batch that fails to write stays queued ahead of newer records for that user and is
+retried with exponential backoff; after CHAT_HISTORY_WRITE_RETRIES failed attempts it is
+dropped and logged. An explicit flush does not retry it early.
+"""
+
+import os
+import time
+import queue
+import atexit
+import logging
+import threading
+from utils import history_store
+
+# Configure logging
+logging.basicConfig(filename='chatbot_errors.log', level=logging.DEBUG)
+
+# Longest time a record may wait in memory before it is written (0 = flush before returning)
+FLUSH_INTERVAL_MS = int(os.environ.get("CHAT_HISTORY_FLUSH_MS", "200"))
+# Write as soon as this many records are waiting
+FLUSH_RECORDS = int(os.environ.get("CHAT_HISTORY_FLUSH_RECORDS", "256"))
+# Queued appends accepted before callers have to wait for the writer
+QUEUE_SIZE = int(os.environ.get("CHAT_HISTORY_QUEUE_SIZE", "10000"))
+# Failed writes of a user's batch before it is dropped, and the first retry delay
+WRITE_RETRIES = int(os.environ.get("CHAT_HISTORY_WRITE_RETRIES", "5"))
+RETRY_BACKOFF = 0.5
+MAX_RETRY_BACKOFF = 30.0
+
+_FLUSH = object()
+_STOP = object()
+
+class HistoryWriter:
+    def __init__(self, flush_interval_ms=FLUSH_INTERVAL_MS, flush_records=FLUSH_RECORDS, queue_size=QUEUE_SIZE):
+        self.flush_interval = flush_interval_ms / 1000.0
+        self.flush_records = flush_records
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.pending = {}  # email -> [records]
+        self.pending_since = {}  # email -> enqueue time of that user's oldest unwritten record
+        self.pending_count = 0
+        self.oldest = None  # enqueue time of the oldest unwritten record
+        self.failures = {}  # email -> (failed attempts, monotonic time of the next retry)
+        self.stats_lock = threading.Lock()
+        self.stats = {
+            "enqueued": 0, "written": 0, "flushes": 0, "queue_full_waits": 0, "errors": 0,
+            "retries": 0, "dropped": 0, "max_lag_ms": 0.0, "last_flush_ms": 0.0,
+        }
+        self.thread = threading.Thread(target=self._run, name="history-writer", daemon=True)
+        self.thread.start()
+
+    def submit(self, email, records):
+        """
+        Queue records for email. Returns once they are written if the flush interval is 0.
+        """
+        if self.flush_interval <= 0:
+            self.queue.put((email, records, time.monotonic()))
+            self._count("enqueued", len(records))
+            self.flush()
+            return
+        try:
+            self.queue.put_nowait((email, records, time.monotonic()))
+        except queue.Full:
+            # Back-pressure: wait for room rather than dropping or reordering history
+            self._count("queue_full_waits")
+            self.queue.put((email, records, time.monotonic()))
+        self._count("enqueued", len(records))
+
+    def _count(self, name, amount=1):
+        with self.stats_lock:
+            self.stats[name] += amount
+
+    def flush(self, timeout=None):
+        """
+        Block until everything queued before this call has been written, apart from batches
+        waiting to retry a failed write.
+        """
+        if threading.current_thread() is self.thread:
+            return
+        done = threading.Event()
+        self.queue.put((_FLUSH, done, None))
+        done.wait(timeout)
+
+    def close(self):
+        self.queue.put((_STOP, None, None))
+        self.thread.join(timeout=10)
+
+    def metrics(self):
+        """
+        Queue depth and lag figures for monitoring.
+        """
+        oldest = self.oldest
+        lag_ms = (time.monotonic() - oldest) * 1000 if oldest else 0.0
+        with self.stats_lock:
+            stats = dict(self.stats)
+        return dict(stats, queue_depth=self.queue.qsize(), buffered=self.pending_count, lag_ms=round(lag_ms, 1))
+
+    def _next_wakeup(self):
+        deadlines = []
+        for email, since in self.pending_since.items():
+            deadline = since + self.flush_interval
+            if email in self.failures:
+                deadline = max(deadline, self.failures[email][1])
+            deadlines.append(deadline)
+        return min(deadlines) if deadlines else None
+
+    def _run(self):
+        while True:
+            timeout = None
+            wakeup = self._next_wakeup()
+            if wakeup is not None:
+                timeout = max(0.0, wakeup - time.monotonic())
+            try:
+                email, payload, enqueued_at = self.queue.get(timeout=timeout)
+            except queue.Empty:
+                self._write_pending()
+                continue
+
+            if email is _STOP:
+                self._write_pending(final=True)
+                for email, records in self.pending.items():
+                    self._count("dropped", len(records))
+                    logging.error(f"Dropping {len(records)} unwritten history records for {email} at shutdown")
+                return
+            if email is _FLUSH:
+                self._write_pending()
+                payload.set()
+                continue
+
+            self.pending.setdefault(email, []).extend(payload)
+            self.pending_count += len(payload)
+            self.pending_since.setdefault(email, enqueued_at)
+            if self.oldest is None:
+                self.oldest = enqueued_at
+            if self.pending_count >= self.flush_records:
+                self._write_pending()
+
+    def _write_pending(self, final=False):
+        """
+        Write every user's buffered records. Users whose last write failed are skipped until
+        their retry time, also on an explicit flush, so frequent reads cannot use up the retry
+        attempts; only the final write at shutdown ignores the backoff.
+        """
+        if not self.pending:
+            return
+        started = time.monotonic()
+        lag_ms = (started - self.oldest) * 1000 if self.oldest else 0.0
+        pending, self.pending = self.pending, {}
+        for email, records in pending.items():
+            attempts, retry_at = self.failures.get(email, (0, 0.0))
+            if not final and retry_at > started:
+                self.pending[email] = records
+                continue
+            try:
+                history_store.write_records(email, records)
+                self.failures.pop(email, None)
+                self.pending_since.pop(email, None)
+                self._count("written", len(records))
+                if attempts:
+                    self._count("retries")
+            except Exception as e:
+                attempts += 1
+                self._count("errors")
+                if attempts > WRITE_RETRIES:
+                    self.failures.pop(email, None)
+                    self.pending_since.pop(email, None)
+                    self._count("dropped", len(records))
+                    logging.error(
+                        f"Dropping {len(records)} history records for {email} after {attempts} failed writes: {str(e)}",
+                        exc_info=True,
+                    )
+                    continue
+                # Keep the batch ahead of records queued after it, so history stays in order
+                backoff = min(MAX_RETRY_BACKOFF, RETRY_BACKOFF * 2 ** (attempts - 1))
+                self.failures[email] = (attempts, time.monotonic() + backoff)
+                self.pending[email] = records
+                logging.error(f"Write-behind flush failed for {email} (attempt {attempts}), retrying in {backoff:.1f}s: {str(e)}")
+        self.pending_count = sum(len(records) for records in self.pending.values())
+        self.oldest = min(self.pending_since.values()) if self.pending_since else None
+        with self.stats_lock:
+            self.stats["flushes"] += 1
+            self.stats["max_lag_ms"] = max(self.stats["max_lag_ms"], round(lag_ms, 1))
+            self.stats["last_flush_ms"] = round((time.monotonic() - started) * 1000, 1)
+
+_writer = None
+_writer_lock = threading.Lock()
+
+def get_writer():
+    """
+    Return the process-wide writer, starting it on first use.
+    """
+    global _writer
+    with _writer_lock:
+        if _writer is None:
+            _writer = HistoryWriter()
+            atexit.register(_writer.close)
+        return _writer
+
+def metrics():
+    return _writer.metrics() if _writer else {}
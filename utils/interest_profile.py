@@ -0,0 +1,130 @@
+"""
+Incrementally maintained interest profiles for recommendations.
+
+For each user a profile is kept per chat session plus one across all sessions ("*"). A
+profile holds decayed category counts, a decayed mean embedding, the embedding of the latest
+message and the last few message texts. Each new user message updates them in O(1), so a
+recommendation request only reads the profile instead of re-reading and re-encoding history.
+
+Profiles are stored next to the history log as chat_logs/<email>.profile.json. Updates
+re-read the file under the user's history lock and merge into it, so several processes
+can update the same user without losing each other's messages; reads are cached until the
+file changes.
+"""
+
+import os
+import json
+import logging
+import threading
+import numpy as np
+from utils import history_store
+
+# Configure logging
+logging.basicConfig(filename='chatbot_errors.log', level=logging.DEBUG)
+
+# Weight kept by older messages each time a new one arrives
+PROFILE_DECAY = float(os.environ.get("PROFILE_DECAY", "0.6"))
+# Per-session profiles kept per user (least recently updated are dropped)
+PROFILE_MAX_SESSIONS = int(os.environ.get("PROFILE_MAX_SESSIONS", "20"))
+RECENT_TEXTS = 3
+ALL_SESSIONS = "*"
+
+_profiles = {}  # email -> ((mtime_ns, size) of the file, {session key: profile})
+_lock = threading.Lock()
+
+def profile_path(email):
+    key = history_store.user_key(email)
+    return os.path.join(history_store.HISTORY_DIR, key + ".profile.json") if key else None
+
+def _file_key(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size)
+
+def _load(email):
+    """
+    The user's profiles as currently on disk (cached until the file changes). Do not modify.
+    """
+    path = profile_path(email)
+    key = _file_key(path)
+    with _lock:
+        cached = _profiles.get(email)
+        if cached is not None and cached[0] == key:
+            return cached[1]
+    profiles = {}
+    if key is not None:
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                profiles = json.load(f)
+        except (OSError, ValueError):
+            profiles = {}
+    with _lock:
+        _profiles[email] = (key, profiles)
+    return profiles
+
+def _update(profile, category, embedding, text):
+    counts = {name: value * PROFILE_DECAY for name, value in profile.get("counts", {}).items()}
+    counts[category] = counts.get(category, 0.0) + 1.0
+    profile["counts"] = {name: round(value, 4) for name, value in counts.items() if value >= 0.01}
+    vector = np.asarray(embedding, dtype=np.float32)
+    if profile.get("mean"):
+        mean = PROFILE_DECAY * np.asarray(profile["mean"], dtype=np.float32) + (1 - PROFILE_DECAY) * vector
+    else:
+        mean = vector
+    profile["mean"] = [round(float(x), 5) for x in mean]
+    profile["last"] = [round(float(x), 5) for x in vector]
+    profile["recent"] = (profile.get("recent", []) + [text])[-RECENT_TEXTS:]
+    profile["messages"] = profile.get("messages", 0) + 1
+    profile["updated"] = history_store.now_ts()
+
+def observe_many(email, updates):
+    """
+    Fold user messages, [(session_id, category, embedding, text)] oldest first, into the
+    sessions' and the user-wide profiles, and persist them with one write.
+    """
+    if not history_store.user_key(email) or not updates:
+        return
+    path = profile_path(email)
+    try:
+        with history_store.user_lock(email):
+            # Start from the file, not the cache: another process may have updated it
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    profiles = json.load(f)
+            except (OSError, ValueError):
+                profiles = {}
+            for session_id, category, embedding, text in updates:
+                for key in {session_id or ALL_SESSIONS, ALL_SESSIONS}:
+                    _update(profiles.setdefault(key, {}), category, embedding, text)
+            sessions = [key for key in profiles if key != ALL_SESSIONS]
+            if len(sessions) > PROFILE_MAX_SESSIONS:
+                sessions.sort(key=lambda key: profiles[key].get("updated", ""))
+                for key in sessions[:len(sessions) - PROFILE_MAX_SESSIONS]:
+                    del profiles[key]
+            history_store.write_atomic(path, json.dumps(profiles, ensure_ascii=False).encode("utf-8"))
+            key = _file_key(path)
+        with _lock:
+            _profiles[email] = (key, profiles)
+    except Exception as e:
+        logging.error(f"Error saving interest profile for {email}: {str(e)}", exc_info=True)
+
+def observe(email, session_id, category, embedding, text):
+    """
+    Fold one user message into the session's and the user-wide profile, and persist them.
+    """
+    observe_many(email, [(session_id, category, embedding, text)])
+
+def get_profile(email, session_id=None):
+    """
+    Return the profile for a session (or across sessions when session_id is None), or None.
+    """
+    if not history_store.user_key(email):
+        return None
+    profile = _load(email).get(session_id or ALL_SESSIONS)
+    return dict(profile) if profile else None
+
+def dominant_category(profile):
+    counts = profile.get("counts") or {}
+    return max(counts, key=counts.get) if counts else "general"
@@ -3,7 +3,14 @@ import re
 import json
 import numpy as np
 import os
+import queue
+import threading
 from utils.history_utils import load_user_chat_history
+from utils.embedding_cache import cached_embeddings
+from utils.chat_utils import add_message_listener
+from utils import interest_profile
+from utils.course_catalog import recommend_courses
+from utils.schedule_utils import parse_start_date
 from sentence_transformers import SentenceTransformer
 import faiss
 
@@ -37,12 +44,18 @@ except UnicodeDecodeError as e:
     )
 
 # Initialize sentence transformer and FAISS index
-embedder = SentenceTransformer('all-MiniLM-L6-v2')
+EMBEDDER_MODEL = 'all-MiniLM-L6-v2'
+embedder = SentenceTransformer(EMBEDDER_MODEL)
 dimension = 384  # Sentence transformer embedding size
 faiss_index = faiss.IndexFlatL2(dimension)
 page_contents = [entry["page_content"] for entry in dataset]
-embeddings = embedder.encode(page_contents, convert_to_numpy=True)
-faiss_index.add(embeddings)
+
+def encode_texts(texts):
+    return embedder.encode(texts, convert_to_numpy=True)
+
+# Dataset vectors are cached on disk and only recomputed for changed entries
+embeddings = cached_embeddings(page_contents, EMBEDDER_MODEL, encode_texts, name="dataset")
+faiss_index.add(np.ascontiguousarray(embeddings, dtype=np.float32))
 
 
 # Define intent categories with keywords
@@ -57,29 +70,179 @@ INTENT_CATEGORIES = {
     "location_contact": ["location", "contact", "islamabad", "branch"],
 }
 
-def categorize_query(query):
+OFF_TOPIC_KEYWORDS = ["cook", "cooking", "travel", "traveling", "gaming", "sad", "hobbies","mood", "joke","dress","art","dresses","animals"]
+
+def embed_texts(texts):
     """
-    Categorize a query based on keywords or semantic similarity to dataset.
+    Encode a list of texts in one forward pass, encoding each distinct text once.
+    Returns a float32 array with one row per input text.
     """
-    query = query.lower().strip()
+    distinct = list(dict.fromkeys(texts))
+    if not distinct:
+        return np.empty((0, dimension), dtype=np.float32)
+    vectors = np.asarray(encode_texts(distinct), dtype=np.float32)
+    position = {text: row for row, text in enumerate(distinct)}
+    return vectors[[position[text] for text in texts]]
+
+def search_dataset(query_embeddings, k=1):
+    """
+    Look up the nearest dataset entries for every row of query_embeddings with one FAISS call.
+    Returns (distances, indices), one row per query.
+    """
+    return faiss_index.search(np.ascontiguousarray(query_embeddings, dtype=np.float32), k)
+
+def keyword_category(text):
     for category, keywords in INTENT_CATEGORIES.items():
-        if any(kw in query for kw in keywords):
+        if any(kw in text for kw in keywords):
             return category
-    
-    # Fallback to semantic similarity
-    query_embedding = embedder.encode([query])[0]
-    distances, indices = faiss_index.search(np.array([query_embedding]), k=1)
-    if distances[0][0] < 0.35:  # Similarity threshold
-        closest_query = dataset[indices[0][0]]["page_content"].lower()
-        for category, keywords in INTENT_CATEGORIES.items():
-            if any(kw in closest_query for kw in keywords):
-                return category
-    return "general"
+    return None
+
+def categorize_queries(queries, query_embeddings=None):
+    """
+    Categorize a list of queries based on keywords or semantic similarity to dataset.
+    Queries without a keyword match are encoded together (unless query_embeddings is given)
+    and looked up with a single FAISS search.
+    """
+    queries = [query.lower().strip() for query in queries]
+    categories = [keyword_category(query) for query in queries]
+    pending = [i for i, category in enumerate(categories) if category is None]
+    if pending:
+        # Fallback to semantic similarity
+        if query_embeddings is None:
+            vectors = embed_texts([queries[i] for i in pending])
+        else:
+            vectors = np.asarray(query_embeddings, dtype=np.float32)[pending]
+        distances, indices = search_dataset(vectors, k=1)
+        for row, i in enumerate(pending):
+            if distances[row][0] < 0.35:  # Similarity threshold
+                closest_query = dataset[indices[row][0]]["page_content"].lower()
+                categories[i] = keyword_category(closest_query)
+    return [category or "general" for category in categories]
+
+def categorize_query(query, query_embedding=None):
+    """
+    Categorize a single query; see categorize_queries.
+    """
+    embeddings = None if query_embedding is None else [query_embedding]
+    return categorize_queries([query], embeddings)[0]
+
+# Messages folded into profiles per background batch, and how long a recommendation waits
+# for queued messages to be folded in
+PROFILE_BATCH_SIZE = 64
+PROFILE_FLUSH_TIMEOUT = 5.0
+
+_profile_queue = queue.Queue()
+_profile_thread = None
+_profile_thread_lock = threading.Lock()
+
+def _fold_messages(items):
+    """
+    Fold user messages [(email, session_id, text)], oldest first, into the interest profiles.
+    All texts are encoded together, once, and each user's profile file is written once.
+    """
+    items = [(email, session_id, text.lower().strip()) for email, session_id, text in items if text and text.strip()]
+    if not items:
+        return
+    texts = [text for _, _, text in items]
+    embeddings = embed_texts(texts)
+    categories = categorize_queries(texts, embeddings)
+    updates = {}  # email -> [(session_id, category, embedding, text)]
+    for (email, session_id, text), category, embedding in zip(items, categories, embeddings):
+        updates.setdefault(email, []).append((session_id, category, embedding, text))
+    for email, user_updates in updates.items():
+        interest_profile.observe_many(email, user_updates)
+        logging.debug(f"Updated interest profile for {email}: {[update[1] for update in user_updates]}")
+
+def observe_user_messages(email, session_id, texts):
+    """
+    Fold user messages of one session into the interest profile now, oldest first.
+    """
+    _fold_messages([(email, session_id, text) for text in texts])
+
+def _profile_worker():
+    while True:
+        items, waiters = [], []
+        item = _profile_queue.get()
+        while True:
+            email, payload, text = item
+            if email is None:
+                waiters.append(payload)
+            else:
+                items.append(item)
+            if len(items) >= PROFILE_BATCH_SIZE:
+                break
+            try:
+                item = _profile_queue.get_nowait()
+            except queue.Empty:
+                break
+        try:
+            _fold_messages(items)
+        except Exception as e:
+            logging.error(f"Error updating interest profiles: {str(e)}", exc_info=True)
+        for done in waiters:
+            done.set()
+
+def _start_profile_worker():
+    global _profile_thread
+    with _profile_thread_lock:
+        if _profile_thread is None:
+            _profile_thread = threading.Thread(target=_profile_worker, name="interest-profiles", daemon=True)
+            _profile_thread.start()
+
+def observe_user_message(email, session_id, text):
+    # Called on the reply path: only queue the message. Encoding, categorizing and the profile
+    # write happen in batches on the background thread
+    _start_profile_worker()
+    _profile_queue.put((email, session_id, text))
+
+def flush_profile_updates(timeout=PROFILE_FLUSH_TIMEOUT):
+    """
+    Wait until messages queued so far are folded into the profiles.
+    """
+    if _profile_thread is None or threading.current_thread() is _profile_thread:
+        return
+    done = threading.Event()
+    _profile_queue.put((None, done, None))
+    done.wait(timeout)
+
+# Keep profiles current as user messages are stored
+add_message_listener(observe_user_message)
+
+def load_interest_profile(email, session_id=None):
+    """
+    Return the interest profile, building it once from recent history for users whose
+    messages predate profiles.
+    """
+    # Include the user's latest messages still waiting on the background thread
+    flush_profile_updates()
+    profile = interest_profile.get_profile(email, session_id)
+    if profile is None:
+        history = load_user_chat_history(email, session_id=session_id)
+        observe_user_messages(email, session_id, [item["user_message"] for item in history])
+        profile = interest_profile.get_profile(email, session_id)
+    return profile
+
+def format_course(course):
+    """
+    One recommendation line: the course, its prerequisites and its next batch from the schedule.
+    """
+    line = f"- {course['course']}: {course.get('description', '')}"
+    if course.get("prerequisites"):
+        line += f" Prerequisites: {', '.join(course['prerequisites'])}."
+    if course.get("batches"):
+        # Batches are upcoming ones, soonest first; an undated one is not called "next"
+        batch = course["batches"][0]
+        label = "Next batch" if parse_start_date(batch) else "Batch"
+        line += (
+            f" {label}: {batch.get('days')} at {batch.get('time')}, starting {batch.get('starting_date')}"
+            f" ({batch.get('mode')}, {batch.get('city')}) with {batch.get('instructor')}."
+        )
+    return line
 
 def generate_recommendations(email, session_id=None):
     """
-    Generate learning recommendations based on the latest three user messages in the current session,
-    tailored to Corvit Systems Islamabad's offerings using the dataset.
+    Generate learning recommendations from the user's interest profile for the current session
+    (kept up to date from their messages), ranked against the course catalog and joined with the class schedule.
 
     Args:
         email (str): The user's email to load chat history for (e.g., 'user@gamil.com').
@@ -96,10 +259,10 @@ def generate_recommendations(email, session_id=None):
                 "from Corvit Systems Islamabad. Contact us at 0303-8888555 or visit https://corvit.com."
             )
 
-        history = load_user_chat_history(email, session_id=session_id)
-        logging.debug(f"Loaded history for {email} (session_id: {session_id}): {history}")
+        profile = load_interest_profile(email, session_id=session_id)
+        logging.debug(f"Loaded interest profile for {email} (session_id: {session_id}): {profile and profile.get('counts')}")
         
-        if not history:
+        if not profile:
             logging.info(f"No chat history found for {email} in session {session_id}")
             return (
                 "I don’t have enough information from your recent questions to recommend anything yet. "
@@ -107,90 +270,51 @@ def generate_recommendations(email, session_id=None):
                 "Visit our campus at 70-W, Al-Malik Center, Jinnah Avenue, call 0303-8888555, or check https://corvit.com to start your IT journey!"
             )
 
-        # Use the latest three messages
-        recent_messages = [item["user_message"].lower() for item in history[-3:]]
+        # The latest three messages, as kept in the profile
+        recent_messages = profile.get("recent", [])
         logging.debug(f"Raw recent messages for {email}: {recent_messages}")
 
         # Normalize text
         joined = " ".join(re.sub(r'[^\w\s]', '', msg.strip()).replace("  ", " ") for msg in recent_messages if msg.strip())
         logging.debug(f"Joined and normalized text for {email}: '{joined}'")
 
-        # Categorize queries
-        categories = [categorize_query(msg) for msg in recent_messages]
-        dominant_category = max(set(categories), key=categories.count, default="general")
+        # Dominant category from the decayed category counts
+        dominant_category = interest_profile.dominant_category(profile)
         logging.debug(f"Dominant category for {email}: {dominant_category}")
 
-        # Retrieve dataset context for the latest query
-        latest_query = recent_messages[-1] if recent_messages else ""
-        query_embedding = embedder.encode([latest_query])[0]
-        distances, indices = faiss_index.search(np.array([query_embedding]), k=1)
+        # Retrieve dataset context for the latest query, using its stored embedding
+        query_embedding = np.asarray(profile["last"], dtype=np.float32)
+        distances, indices = search_dataset(query_embedding[None, :], k=1)
         dataset_answer = ""
         if distances[0][0] < 0.35:  # Similarity threshold
             dataset_answer = dataset[indices[0][0]]["metadata"]["answer"]
             logging.debug(f"Dataset answer for {email}: {dataset_answer}")
 
-        # Generate recommendations based on dominant category
-        if dominant_category == "networking":
-            return (
-                f"{dataset_answer or 'Based on your interest in networking,'} Corvit Systems Islamabad’s CCNA course, covering VLANs, OSPF, and automation, is perfect for you, taught by experts like Mr. Abdul Waheed (3xCCIE). "
-                "Consider our CCNP or Network Automation with Python courses to advance your skills. "
-                "Visit 70-W, Al-Malik Center, Jinnah Avenue, call 0303-8888555, or check https://corvit.com for details."
-            )
-        elif dominant_category == "cybersecurity":
-            return (
-                f"{dataset_answer or 'Your interest in cybersecurity is a great fit for'} Corvit Systems Islamabad’s Cybersecurity course, covering ethical hacking and network security. "
-                "You might also explore our Certified Ethical Hacker (CEH) training to boost your credentials. "
-                "Contact our Islamabad campus at 70-W, Al-Malik Center, Jinnah Avenue, at 0303-8888555 or visit https://corvit.com."
-            )
-        elif dominant_category == "programming":
+        # Handle irrelevant or general queries
+        if dominant_category == "general" and any(kw in joined for kw in OFF_TOPIC_KEYWORDS):
             return (
-                f"{dataset_answer or 'Since you’re interested in programming,'} Corvit Systems Islamabad offers a Web Development course with Flask and Django, ideal for building modern applications. "
-                "You could also explore Python for Data Science to diversify your skills. "
-                "Reach out at 70-W, Al-Malik Center, Jinnah Avenue, via 0303-8888555 or https://corvit.com for enrollment details."
-            )
-        elif dominant_category == "ai":
-            return (
-                f"{dataset_answer or 'Your interest in AI aligns with'} Corvit Systems Islamabad’s Artificial Intelligence course, covering machine learning and TensorFlow. "
-                "Consider our Data Science course to master AI-driven analytics. "
-                "Visit our campus at 70-W, Al-Malik Center, Jinnah Avenue, or call 0303-8888555 to get started at https://corvit.com."
-            )
-        elif dominant_category == "career":
-            return (
-                f"{dataset_answer or 'To boost your career,'} Corvit Systems Islamabad offers job-oriented certifications like CCNA, AWS, and Full Stack Development. "
-                "Our career counseling and internship programs can help you build a strong portfolio. "
-                "Contact us at 70-W, Al-Malik Center, Jinnah Avenue, via 0303-8888555 or visit https://corvit.com."
-            )
-        elif dominant_category == "enrollment":
-            return (
-                f"{dataset_answer or 'To enroll at Corvit Systems Islamabad,'} visit https://corvit.com, select a course like CCNA or Cybersecurity, and follow the registration process at our campus, 70-W, Al-Malik Center, Jinnah Avenue. "
-                "Our team can guide you on fees and documents. "
-                "Call 0303-8888555 or email info@corvit.com for assistance."
-            )
-        elif dominant_category == "instructor":
-            return (
-                f"{dataset_answer or 'Corvit Systems Islamabad boasts expert instructors like'} Mr. Abdul Waheed (3xCCIE) for courses like CCNA and CCNP, ensuring top-tier training. "
-                "Learn from our team of 8 CCIE professionals to excel in IT. "
-                "Visit us at 70-W, Al-Malik Center, Jinnah Avenue, or call 0303-8888555 to explore our courses at https://corvit.com."
-            )
-        elif dominant_category == "location_contact":
-            return (
-                f"{dataset_answer or 'Corvit Systems Islamabad is located at'} 70-W, Al-Malik Center, Jinnah Avenue, offering top IT courses like CCNA and Cybersecurity. "
-                "Reach out at 0303-8888555 or info@corvit.com for course schedules. "
-                "Visit https://corvit.com to explore our offerings."
+                "Corvit Systems Islamabad specializes in IT training, offering courses like CCNA, Cybersecurity, and Artificial Intelligence, but we don’t provide training for cooking or travel. "
+                "Explore our industry-recognized programs to build in-demand tech skills. "
+                "Visit our campus at 70-W, Al-Malik Center, Jinnah Avenue, call 0303-8888555, or check https://corvit.com for details."
             )
-        else:
-            # Handle irrelevant or general queries
-            if any(kw in joined for kw in ["cook", "cooking", "travel", "traveling", "gaming", "sad", "hobbies","mood", "joke","dress","art","dresses","animals"]):
-                return (
-                    "Corvit Systems Islamabad specializes in IT training, offering courses like CCNA, Cybersecurity, and Artificial Intelligence, but we don’t provide training for cooking or travel. "
-                    "Explore our industry-recognized programs to build in-demand tech skills. "
-                    "Visit our campus at 70-W, Al-Malik Center, Jinnah Avenue, call 0303-8888555, or check https://corvit.com for details."
-                )
+
+        # Rank catalog courses against the user's recent-query vector
+        courses = recommend_courses(
+            profile["mean"], EMBEDDER_MODEL, encode_texts,
+            category=None if dominant_category == "general" else dominant_category,
+        )
+        logging.debug(f"Recommended courses for {email}: {[(c['course'], c['score']) for c in courses]}")
+        if not courses:
             return (
                 f"{dataset_answer or 'Based on current tech trends,'} I recommend exploring Corvit Systems Islamabad’s popular courses like CCNA, Cybersecurity, or Artificial Intelligence to build in-demand IT skills. "
                 "Our hands-on training and 8 CCIE instructors ensure you’re job-ready. "
                 "Visit our campus at 70-W, Al-Malik Center, Jinnah Avenue, call 0303-8888555, or check https://corvit.com for details."
             )
+        return (
+            f"{dataset_answer or 'Based on your recent questions,'} these Corvit Systems Islamabad courses are a good fit for you:\n"
+            + "\n".join(format_course(course) for course in courses)
+            + "\nVisit our campus at 70-W, Al-Malik Center, Jinnah Avenue, call 0303-8888555, or check https://corvit.com for details."
+        )
     
     except Exception as e:
         logging.error(f"Error generating recommendations for {email}: {str(e)}", exc_info=True)
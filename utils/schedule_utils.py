@@ -1,12 +1,221 @@
 import json
-from utils.common_utils import extract_keywords
+import os
+import re
+from datetime import datetime
+
+SCHEDULE_PATH = "data/schedule.json"
+
+# Longest course phrase (in tokens) looked up in the schedule index
+MAX_PHRASE_TOKENS = 5
+
+# Abbreviations and the full names they stand for; any member of a group finds the others
+COURSE_ALIASES = {
+    "ccna": ["cisco certified network associate"],
+    "ccnp": ["cisco certified network professional"],
+    "ccie": ["cisco certified internetwork expert"],
+    "ceh": ["certified ethical hacker", "ethical hacking"],
+    "aws": ["amazon web services"],
+    "ai": ["artificial intelligence"],
+    "ml": ["machine learning"],
+    "cyber security": ["cybersecurity"],
+    "devops": ["dev ops"],
+}
+
+SCHEDULE_STOPWORDS = {
+    "a", "an", "the", "of", "for", "and", "in", "on", "at", "to", "with", "is", "are", "what",
+    "when", "which", "me", "my", "i", "tell", "about", "please", "course", "courses", "class",
+    "classes", "timing", "timings", "schedule", "schedules", "batch", "batches", "training",
+    "program", "time", "times", "corvit",
+}
+
+DAY_NAMES = {
+    "mon": "monday", "tue": "tuesday", "wed": "wednesday", "thu": "thursday",
+    "fri": "friday", "sat": "saturday", "sun": "sunday",
+}
+WEEK = list(DAY_NAMES.values())
+DAY_GROUPS = {"weekday": WEEK[:5], "weekdays": WEEK[:5], "weekend": WEEK[5:], "weekends": WEEK[5:]}
+# "Mon-Fri", "Monday to Thursday", "Sat - Sun": every day from the first to the second
+DAY_RANGE = re.compile(r"\b(mon|tue|wed|thu|fri|sat|sun)[a-z]*\.?\s*(?:-|–|to|till|through)\s*(mon|tue|wed|thu|fri|sat|sun)[a-z]*")
+
+# Formats tried when reading an entry's starting_date
+START_DATE_FORMATS = ("%Y-%m-%d", "%d-%m-%Y", "%d/%m/%Y", "%d %B %Y", "%d %b %Y", "%B %d %Y", "%b %d %Y")
+
+_schedule_cache = {"key": None, "schedule": []}
+_index_cache = {"schedule": None, "index": None}
 
 def load_schedule():
+    """
+    Load data/schedule.json. The parsed list is reused until the file changes,
+    so the schedule index is built once per file version.
+    """
     try:
-        with open("data/schedule.json", "r", encoding="utf-8") as f:
-            return json.load(f)
+        stat = os.stat(SCHEDULE_PATH)
     except FileNotFoundError:
         return []
+    key = (stat.st_mtime_ns, stat.st_size)
+    if _schedule_cache["key"] == key:
+        return _schedule_cache["schedule"]
+    try:
+        with open(SCHEDULE_PATH, "r", encoding="utf-8") as f:
+            schedule = json.load(f)
+    except FileNotFoundError:
+        return []
+    _schedule_cache["key"] = key
+    _schedule_cache["schedule"] = schedule
+    return schedule
+
+def normalize_tokens(text):
+    return re.findall(r"[a-z0-9+#]+", (text or "").lower())
+
+def _normalize_value(text):
+    return " ".join(normalize_tokens(text))
+
+def parse_start_date(entry):
+    """
+    The entry's starting_date as a date, or None when it is missing or not in a known format.
+    """
+    text = re.sub(r"(\d)(st|nd|rd|th)\b", r"\1", str(entry.get("starting_date") or "")).replace(",", " ")
+    text = " ".join(text.split())
+    for fmt in START_DATE_FORMATS:
+        try:
+            return datetime.strptime(text, fmt).date()
+        except ValueError:
+            continue
+    return None
+
+def _day_keys(days_text):
+    """
+    The set of full day names an entry's days text covers, with ranges and weekday/weekend expanded.
+    """
+    text = (days_text or "").lower()
+    keys = set()
+    for first, last in DAY_RANGE.findall(text):
+        start, end = WEEK.index(DAY_NAMES[first]), WEEK.index(DAY_NAMES[last])
+        length = (end - start) % len(WEEK) + 1
+        keys.update(WEEK[(start + i) % len(WEEK)] for i in range(length))
+    for token in normalize_tokens(text):
+        day = DAY_NAMES.get(token[:3])
+        # "tues" or "thurs" name a day; "month" or "sunny" do not
+        if day and day.startswith(token):
+            keys.add(day)
+        keys.update(DAY_GROUPS.get(token, ()))
+    return keys
+
+class ScheduleIndex:
+    """
+    Hash index from normalized course phrases, aliases and abbreviations to schedule entries.
+    Lookups walk the query once, trying phrases of up to MAX_PHRASE_TOKENS tokens at each position.
+    """
+
+    def __init__(self, schedule):
+        self.entries = list(schedule)
+        self.entry_days = [_day_keys(entry.get("days", "")) for entry in self.entries]
+        self.phrases = {}  # "phrase" -> set of entry ids
+        self.course_names = []  # (entry id, full normalized course name, initials)
+        self.modes = set()
+        self.cities = set()
+        self.alias_groups = alias_groups = [{alias, *expansions} for alias, expansions in COURSE_ALIASES.items()]
+        for entry_id, entry in enumerate(self.entries):
+            tokens = normalize_tokens(entry.get("course", ""))
+            keys = set()
+            for start in range(len(tokens)):
+                for end in range(start + 1, min(start + MAX_PHRASE_TOKENS, len(tokens)) + 1):
+                    phrase = tokens[start:end]
+                    if len(phrase) == 1 and phrase[0] in SCHEDULE_STOPWORDS:
+                        continue
+                    keys.add(" ".join(phrase))
+            # Abbreviation built from initials, e.g. "Certified Ethical Hacker" -> "ceh"
+            initials = "".join(t[0] for t in tokens if t not in SCHEDULE_STOPWORDS)
+            if len(initials) >= 2:
+                keys.add(initials)
+            self.course_names.append((entry_id, " ".join(tokens), initials))
+            for group in alias_groups:
+                if keys & group:
+                    keys |= group
+            for key in keys:
+                self.phrases.setdefault(key, set()).add(entry_id)
+            if entry.get("mode"):
+                self.modes.add(_normalize_value(entry["mode"]))
+            if entry.get("city"):
+                self.cities.add(_normalize_value(entry["city"]))
+
+    def match(self, query):
+        """
+        Return the ids of every entry whose course name, alias or abbreviation appears in the query.
+        The longest phrase matching at each position wins.
+        """
+        tokens = normalize_tokens(query)
+        matched = set()
+        position = 0
+        while position < len(tokens):
+            step = 1
+            for length in range(min(MAX_PHRASE_TOKENS, len(tokens) - position), 0, -1):
+                ids = self.phrases.get(" ".join(tokens[position:position + length]))
+                if ids:
+                    matched |= ids
+                    step = length
+                    break
+            position += step
+        return sorted(matched)
+
+    def match_course(self, name):
+        """
+        Return the ids of entries for exactly this course: the name (or an alias of it) is the
+        entry's full course name, its leading words, or its abbreviation. Unlike match(), a word
+        that merely appears in another course's name ("python" in "Network Automation with
+        Python") does not match.
+        """
+        target = _normalize_value(name)
+        if not target:
+            return []
+        names = {target}
+        for group in self.alias_groups:
+            if target in group:
+                names |= group
+        return [
+            entry_id for entry_id, full, initials in self.course_names
+            if initials in names or any(full == n or full.startswith(n + " ") for n in names)
+        ]
+
+    def extract_filters(self, query):
+        """
+        Pick up day, mode and city filters mentioned in the query, using values present in the schedule.
+        """
+        tokens = normalize_tokens(query)
+        text = " ".join(tokens)
+        days = {DAY_NAMES.get(t, t) for t in tokens if t in DAY_NAMES or t in DAY_NAMES.values()}
+        mode = next((m for m in self.modes if re.search(rf"\b{re.escape(m)}\b", text)), None)
+        city = next((c for c in self.cities if re.search(rf"\b{re.escape(c)}\b", text)), None)
+        return {"day": days.pop() if len(days) == 1 else None, "mode": mode, "city": city}
+
+    def filter(self, entry_ids=None, day=None, mode=None, city=None):
+        """
+        Return the entries (all of them when entry_ids is None) that run on the given day, mode and city.
+        """
+        ids = range(len(self.entries)) if entry_ids is None else entry_ids
+        results = []
+        for entry_id in ids:
+            entry = self.entries[entry_id]
+            if day and DAY_NAMES.get(day.lower()[:3]) not in self.entry_days[entry_id]:
+                continue
+            if mode and _normalize_value(entry.get("mode")) != _normalize_value(mode):
+                continue
+            if city and _normalize_value(entry.get("city")) != _normalize_value(city):
+                continue
+            results.append(entry)
+        return results
+
+    def lookup(self, query, day=None, mode=None, city=None):
+        return self.filter(self.match(query), day=day, mode=mode, city=city)
+
+def get_schedule_index(schedule):
+    """
+    Return the index for this schedule list, rebuilding it only when the list changes.
+    """
+    if _index_cache["schedule"] is not schedule:
+        _index_cache["index"] = ScheduleIndex(schedule)
+        _index_cache["schedule"] = schedule
+    return _index_cache["index"]
 
 def format_schedule(entry):
     return (
@@ -20,31 +229,9 @@ def format_schedule(entry):
     )
 
 # ✅ New: For specific course schedule
-def get_course_schedule(course_name, schedule):
-    course_name = course_name.lower()
-    for entry in schedule:
-        if course_name in entry.get("course", "").lower():
-            return [format_schedule(entry)]
-    return []
+def get_course_schedule(course_name, schedule, day=None, mode=None, city=None):
+    return [format_schedule(entry) for entry in get_schedule_index(schedule).lookup(course_name, day=day, mode=mode, city=city)]
 
 # ✅ New: For full schedule
 def get_all_schedule(schedule):
     return [format_schedule(entry) for entry in schedule]
-
-# (Optional) Old search function — useful for fallback or general search
-def search_schedule(user_input, schedule):
-    keywords = extract_keywords(user_input)
-    results = []
-
-    # If a specific course is mentioned
-    for entry in schedule:
-        course = entry.get("course", "").lower()
-        if any(kw in course for kw in keywords):
-            results.append(format_schedule(entry))
-
-    # If nothing matched but query is about general schedule
-    if not results and any(word in user_input.lower() for word in ["schedule", "class", "classes", "timing"]):
-        for entry in schedule:
-            results.append(format_schedule(entry))
-
-    return results
@@ -0,0 +1,71 @@
+"""
+Single-flight coalescing of identical concurrent work.
+
+When many users send the same message at once (e.g. right after a broadcast), only the first
+caller for a key runs the computation; callers arriving while it is in flight wait for it and
+receive the same result, or the same exception. Nothing is kept once the call finishes, so
+this never serves stale answers.
+
+Work is grouped by stage ("translation", "retrieval", "generation"), each with counters of
+computations run ("leaders") and callers that shared one ("hits").
+"""
+
+import threading
+from concurrent.futures import Future
+
+STAGES = ("translation", "retrieval", "generation")
+
+def normalize_query(query):
+    return " ".join((query or "").lower().split())
+
+class SingleFlight:
+    def __init__(self, name):
+        self.name = name
+        self.lock = threading.Lock()
+        self.calls = {}  # key -> Future of the running computation
+        self.leaders = 0
+        self.hits = 0
+
+    def do(self, key, fn, *args):
+        """
+        Return fn(*args), sharing the result with concurrent calls for the same key.
+        """
+        with self.lock:
+            future = self.calls.get(key)
+            leader = future is None
+            if leader:
+                future = self.calls[key] = Future()
+                self.leaders += 1
+            else:
+                self.hits += 1
+        if not leader:
+            return future.result()
+        try:
+            result = fn(*args)
+        except BaseException as e:
+            self._finish(key, future)
+            future.set_exception(e)
+            raise
+        self._finish(key, future)
+        future.set_result(result)
+        return result
+
+    def _finish(self, key, future):
+        with self.lock:
+            if self.calls.get(key) is future:
+                del self.calls[key]
+
+    def metrics(self):
+        with self.lock:
+            return {"leaders": self.leaders, "hits": self.hits, "inflight": len(self.calls)}
+
+_flights = {stage: SingleFlight(stage) for stage in STAGES}
+
+def coalesce(stage, key, fn, *args):
+    """
+    Run fn(*args) once for all concurrent callers with the same stage and key.
+    """
+    return _flights[stage].do(key, fn, *args)
+
+def metrics():
+    return {stage: flight.metrics() for stage, flight in _flights.items()}